@@ -1,11 +1,21 @@
 import os
+import asyncio
 import logging
+import signal
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
+from telegram.ext import Application, ApplicationHandlerStop, CommandHandler, MessageHandler, CallbackQueryHandler, TypeHandler, filters, ContextTypes
 from dotenv import load_dotenv
-import redis
 
-from modules.models import Session, User, TourRequest
+from modules.redis_client import close_redis
+from modules.local_cache import start_invalidation_listener, stop_invalidation_listener
+from modules.redis_persistence import RedisPersistence
+from modules.update_bus import publish_update, consume_updates, mark_failed_update, StaleLeaderError
+from modules.update_processor import ChatOrderedUpdateProcessor
+from modules.outbound_queue import outbound
+from modules.broadcast import start_broadcast_supervisor, stop_broadcast_supervisor
+from modules.system_stats import start_stats_reconciler, stop_stats_reconciler
+from modules.ledger import start_snapshotter, stop_snapshotter
+from modules.user_repository import users, get_current_user
 from modules.user_handlers import (
     start, handle_phone, show_statistics,
     request_tour, handle_tour_request
@@ -17,9 +27,11 @@ from modules.admin_handlers import (
     show_users_list, search_user, handle_user_search, show_users_statistics,
     show_bonus_history, show_tour_request_details, complete_tour_request,
     show_tour_requests_menu, search_tour_request, handle_tour_search,
-    show_user_referrals, show_user_info, handle_deduct_amount, handle_deduct_description
+    show_user_referrals, show_user_info, handle_deduct_amount, handle_deduct_description,
+    show_cache_stats, sweep_cache, start_broadcast, handle_broadcast_text,
+    confirm_broadcast, discard_broadcast, stop_broadcast
 )
-from single_bot import SingletonBot
+from single_bot import LeaderLease
 
 # Завантаження змінних середовища
 load_dotenv()
@@ -31,16 +43,30 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Підключення до Redis
-redis_client = redis.Redis(host='localhost', port=6379, db=0)
+# Режим отримання оновлень: polling або webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# Публічна адреса бота для webhook, наприклад https://bot.example.com
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8443))
+# Роль процесу: all - приймає та обробляє оновлення, intake - тільки приймає
+# та передає їх через Redis, worker - тільки обробляє оновлення з Redis
+BOT_ROLE = os.getenv('BOT_ROLE', 'all')
+
+# Лізинг лідера: polling веде тільки один екземпляр, решта - гарячий резерв
+leader_lease = LeaderLease()
+
+async def resolve_current_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Визначення користувача один раз на оновлення - до всіх інших обробників"""
+    user = update.effective_user
+    context.current_user = await users.get_by_telegram_id(user.id) if user else None
 
 
 async def check_user_authorization(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Перевірка авторизації користувача"""
-    user_id = update.effective_user.id
-    with Session() as session:
-        user = session.query(User).filter_by(telegram_id=str(user_id)).first()
-        return user
+    return get_current_user(context)
 
 
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -80,6 +106,11 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await handle_tour_search(update, context)
         return
 
+    # Перевіряємо чи очікуємо текст розсилки
+    if context.user_data.get('waiting_for_broadcast_text'):
+        await handle_broadcast_text(update, context)
+        return
+
     # Перевіряємо авторизацію користувача
     user = await check_user_authorization(update, context)
 
@@ -91,7 +122,7 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text
 
     # Якщо користувач є адміністратором
-    if user.is_admin:
+    if user['is_admin']:
         await handle_admin_text(update, context, text, user)
     else:
         await handle_user_text(update, context, text, user)
@@ -128,18 +159,16 @@ async def handle_user_text(update: Update, context: ContextTypes.DEFAULT_TYPE, t
     elif text == "🔗 Моє посилання":
         await update.message.reply_text(
             f"🔗 Ваше реферальне посилання:\n"
-            f"t.me/TourWithUsBot?start={user.referral_code}",
+            f"t.me/TourWithUsBot?start={user['referral_code']}",
             parse_mode='Markdown',
             disable_web_page_preview=True
         )
     elif text == "🛠 Адмін панель":
         # Перевіряємо чи користувач адмін
-        with Session() as session:
-            current_user = session.query(User).filter_by(telegram_id=user.telegram_id).first()
-            if current_user and current_user.is_admin:
-                await admin_panel(update, context)
-            else:
-                await update.message.reply_text("❌ У вас немає доступу до адмін-панелі!")
+        if user['is_admin']:
+            await admin_panel(update, context)
+        else:
+            await update.message.reply_text("❌ У вас немає доступу до адмін-панелі!")
     elif context.user_data.get('waiting_for_tour_request'):
         await handle_tour_request(update, context)
     else:
@@ -154,6 +183,8 @@ async def handle_admin_text(update: Update, context: ContextTypes.DEFAULT_TYPE,
         await show_tour_requests_menu(update, context)
     elif text == "💰 Нарахування балів":
         await show_users_for_bonus(update, context)
+    elif text == "📢 Розсилка":
+        await start_broadcast(update, context)
     elif text == "👤 Режим користувача":
         # Перемикання в режим користувача
         keyboard = [
@@ -210,54 +241,180 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await start(update, context)
 
 
-def main():
-    """Запуск бота з захистом від повторного запуску"""
-
-    # Варіант 1: Використання file locking (рекомендований)
-    with SingletonBot('telegram_bot.lock'):
-        print("🚀 Запускаємо Telegram бота...")
-
-        application = Application.builder().token(os.getenv('TELEGRAM_TOKEN')).build()
-
-        # Основні обробники
-        application.add_handler(CommandHandler("start", start_command))
-        application.add_handler(MessageHandler(filters.CONTACT, handle_phone))
-        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
-
-        # Обробники команд
-        application.add_handler(CommandHandler("stats", show_statistics))
-        application.add_handler(CommandHandler("tour", request_tour))
-        application.add_handler(CommandHandler("admin", admin_panel))
-        application.add_handler(CommandHandler("set_admin", set_admin))
-        application.add_handler(CommandHandler("remove_admin", remove_admin))
-
-        # Обробники callback-запитів
-        application.add_handler(CallbackQueryHandler(show_users_list, pattern='^admin_users_list$'))
-        application.add_handler(CallbackQueryHandler(search_user, pattern='^admin_users_search$'))
-        application.add_handler(CallbackQueryHandler(show_users, pattern='^admin_users$'))
-        application.add_handler(CallbackQueryHandler(show_users_for_bonus, pattern='^bonus_user_\d+$'))
-        application.add_handler(CallbackQueryHandler(show_users_for_bonus, pattern='^deduct_points_\d+$'))
-        application.add_handler(CallbackQueryHandler(show_bonus_history, pattern='^bonus_history_\d+$'))
-        application.add_handler(CallbackQueryHandler(show_tour_requests, pattern='^admin_tours_list$'))
-        application.add_handler(CallbackQueryHandler(search_tour_request, pattern='^admin_tours_search$'))
-        application.add_handler(CallbackQueryHandler(show_tour_requests_menu, pattern='^admin_tours$'))
-        application.add_handler(CallbackQueryHandler(show_tour_request_details, pattern='^tour_request_\d+$'))
-        application.add_handler(CallbackQueryHandler(complete_tour_request, pattern='^complete_request_\d+$'))
-        application.add_handler(CallbackQueryHandler(show_user_referrals, pattern='^show_referrals_\d+$'))
-        application.add_handler(CallbackQueryHandler(show_user_info, pattern='^user_info_\d+$'))
-
-        print("✅ Бот успішно запущений!")
+async def forward_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Процес-приймач (BOT_ROLE=intake) не обробляє оновлення, а передає їх обробникам"""
+    # У режимі polling публікує тільки актуальний лідер (токен 0 ніколи не збігається)
+    fencing_token = None if BOT_MODE == 'webhook' else leader_lease.fencing_token or 0
+    try:
+        await publish_update(update, leader_lease.fencing_key, fencing_token)
+    except StaleLeaderError as e:
+        logger.warning(f"Оновлення {update.update_id} відхилено: {e}")
+    raise ApplicationHandlerStop
+
+
+async def on_startup(application: Application):
+    """Запуск фонових задач після ініціалізації бота"""
+    start_invalidation_listener()
+    outbound.start(application.bot)
+    if BOT_ROLE != 'intake':
+        # Продовжуємо розсилку, перервану зупинкою бота
+        start_broadcast_supervisor(application.bot)
+        start_stats_reconciler()
+        start_snapshotter()
+
+
+async def on_shutdown(application: Application):
+    """Звільнення ресурсів після зупинки бота"""
+    await stop_stats_reconciler()
+    await stop_snapshotter()
+    await stop_invalidation_listener()
+    await close_redis()
+
+
+def build_application() -> Application:
+    """Створення застосунку та реєстрація обробників для ролі процесу (BOT_ROLE)"""
+    builder = Application.builder().token(os.getenv('TELEGRAM_TOKEN'))
+    if BOT_ROLE == 'worker':
+        # Обробник отримує оновлення з Redis, а не від Telegram
+        builder = builder.updater(None)
+    if BOT_ROLE != 'intake':
+        # Оновлення різних чатів обробляються паралельно, одного чату - по порядку
+        builder = builder.persistence(RedisPersistence()).concurrent_updates(ChatOrderedUpdateProcessor())
+    application = builder.build()
+
+    if BOT_ROLE == 'intake':
+        application.add_handler(TypeHandler(Update, forward_update))
+        return application
+
+    if BOT_ROLE == 'worker':
+        # Оновлення з помилкою в обробнику не підтверджується в потоці і буде оброблене повторно
+        application.add_error_handler(mark_failed_update)
+
+    # Визначення користувача перед усіма іншими групами обробників
+    application.add_handler(TypeHandler(Update, resolve_current_user), group=-1)
+
+    # Основні обробники
+    application.add_handler(CommandHandler("start", start_command))
+    application.add_handler(MessageHandler(filters.CONTACT, handle_phone))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
+
+    # Обробники команд
+    application.add_handler(CommandHandler("stats", show_statistics))
+    application.add_handler(CommandHandler("tour", request_tour))
+    application.add_handler(CommandHandler("admin", admin_panel))
+    application.add_handler(CommandHandler("set_admin", set_admin))
+    application.add_handler(CommandHandler("remove_admin", remove_admin))
+    application.add_handler(CommandHandler("cache_stats", show_cache_stats))
+    application.add_handler(CommandHandler("cache_sweep", sweep_cache))
+    application.add_handler(CommandHandler("broadcast", start_broadcast))
+
+    # Обробники callback-запитів
+    application.add_handler(CallbackQueryHandler(show_users_list, pattern='^admin_users_list$'))
+    application.add_handler(CallbackQueryHandler(show_users_list, pattern='^ul:'))
+    application.add_handler(CallbackQueryHandler(search_user, pattern='^admin_users_search$'))
+    application.add_handler(CallbackQueryHandler(show_users, pattern='^admin_users$'))
+    application.add_handler(CallbackQueryHandler(show_users_for_bonus, pattern='^bonus_user_\d+$'))
+    application.add_handler(CallbackQueryHandler(show_users_for_bonus, pattern='^deduct_points_\d+$'))
+    application.add_handler(CallbackQueryHandler(show_bonus_history, pattern='^bonus_history_\d+$'))
+    application.add_handler(CallbackQueryHandler(show_tour_requests, pattern='^admin_tours_list$'))
+    application.add_handler(CallbackQueryHandler(show_tour_requests, pattern='^tl:'))
+    application.add_handler(CallbackQueryHandler(search_tour_request, pattern='^admin_tours_search$'))
+    application.add_handler(CallbackQueryHandler(show_tour_requests_menu, pattern='^admin_tours$'))
+    application.add_handler(CallbackQueryHandler(show_tour_request_details, pattern='^tour_request_\d+$'))
+    application.add_handler(CallbackQueryHandler(complete_tour_request, pattern='^complete_request_\d+$'))
+    application.add_handler(CallbackQueryHandler(show_user_referrals, pattern='^show_referrals_\d+$'))
+    application.add_handler(CallbackQueryHandler(show_user_info, pattern='^user_info_\d+$'))
+    application.add_handler(CallbackQueryHandler(confirm_broadcast, pattern='^broadcast_confirm$'))
+    application.add_handler(CallbackQueryHandler(discard_broadcast, pattern='^broadcast_discard$'))
+    application.add_handler(CallbackQueryHandler(stop_broadcast, pattern='^broadcast_stop$'))
+
+    return application
+
+
+async def poll_as_leader(application: Application, stop_event: asyncio.Event):
+    """Polling тільки поки процес тримає лізинг лідера, інакше - гарячий резерв"""
+    while not stop_event.is_set():
+        print("⏳ Очікуємо на лідерство...")
+        if not await leader_lease.wait_for_leadership(stop_event):
+            return
+        print(f"👑 Процес став лідером (fencing token {leader_lease.fencing_token})")
+        await application.updater.start_polling()
+        try:
+            await leader_lease.hold(stop_event)
+        finally:
+            await application.updater.stop()
+            await leader_lease.release()
+        if not stop_event.is_set():
+            print("⚠️ Лідерство втрачено, переходимо в резерв")
 
+
+async def serve(application: Application):
+    """Життєвий цикл бота: ініціалізація, отримання оновлень у вибраному режимі, зупинка"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Windows - зупинка через KeyboardInterrupt
+            pass
+
+    async with application:
+        await on_startup(application)
+        await application.start()
         try:
-            # Запуск бота
-            application.run_polling()
-        except KeyboardInterrupt:
-            print("\n🛑 Отримано сигнал переривання. Зупиняємо бота...")
-        except Exception as e:
-            print(f"❌ Помилка при роботі бота: {e}")
+            if BOT_ROLE == 'worker':
+                await consume_updates(application, stop_event)
+            elif BOT_MODE == 'webhook':
+                # Кілька екземплярів можуть працювати за балансувальником - лідер не потрібен.
+                # Вбудований веб-сервер PTB перевіряє секретний токен, одразу відповідає
+                # Telegram і передає оновлення в чергу обробки
+                await application.updater.start_webhook(
+                    listen=WEBHOOK_LISTEN,
+                    port=WEBHOOK_PORT,
+                    url_path=WEBHOOK_PATH,
+                    secret_token=WEBHOOK_SECRET,
+                    webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}"
+                )
+                await stop_event.wait()
+            else:
+                await poll_as_leader(application, stop_event)
         finally:
-            print("👋 Бот завершив роботу")
+            if application.updater and application.updater.running:
+                await application.updater.stop()
+            await application.stop()
+            # Надсилаємо залишок черги, поки бот ще не закрив з'єднання
+            await stop_broadcast_supervisor()
+            await outbound.stop()
+    await on_shutdown(application)
+
+
+def main():
+    """Запуск бота (polling тільки на екземплярі-лідері, див. single_bot.LeaderLease)"""
+    if BOT_MODE == 'webhook' and BOT_ROLE != 'worker' and not WEBHOOK_URL:
+        print("❌ Для режиму webhook потрібно вказати WEBHOOK_URL")
+        return
+    if BOT_MODE == 'webhook' and BOT_ROLE != 'worker' and not WEBHOOK_SECRET:
+        # Без секрету будь-хто, хто знає адресу, може надсилати підроблені оновлення
+        print("❌ Для режиму webhook потрібно вказати WEBHOOK_SECRET")
+        return
+
+    print(f"🚀 Запускаємо Telegram бота (режим: {BOT_MODE}, роль: {BOT_ROLE})...")
+
+    application = build_application()
+
+    print("✅ Бот успішно запущений!")
+
+    try:
+        # Запуск бота
+        asyncio.run(serve(application))
+    except KeyboardInterrupt:
+        print("\n🛑 Отримано сигнал переривання. Зупиняємо бота...")
+    except Exception as e:
+        print(f"❌ Помилка при роботі бота: {e}")
+    finally:
+        print("👋 Бот завершив роботу")
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
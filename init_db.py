@@ -1,6 +1,22 @@
+import argparse
+import asyncio
+
 from modules.models import init_db
+from modules.referral_tree import rebuild_referral_closure
 
 if __name__ == '__main__':
-    print("Створення таблиць в базі даних...")
+    parser = argparse.ArgumentParser(description="Службові операції з базою даних")
+    parser.add_argument(
+        '--backfill-closure', action='store_true',
+        help="заповнити таблицю замикання реферального дерева для існуючих користувачів"
+    )
+    args = parser.parse_args()
+
+    print("Застосування міграцій бази даних...")
     init_db()
-    print("✅ База даних успішно створена!") 
\ No newline at end of file
+    print("✅ Схема бази даних актуальна!")
+
+    if args.backfill_closure:
+        print("Заповнення таблиці замикання реферального дерева...")
+        inserted = asyncio.run(rebuild_referral_closure())
+        print(f"✅ Додано записів: {inserted}")
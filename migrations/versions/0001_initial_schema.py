@@ -0,0 +1,94 @@
+"""Початкова схема - така, яку створював Base.metadata.create_all до появи міграцій
+
+Баланси та суми в гривнях (Float), telegram_id - рядок: їх переводять наступні
+міграції. Для бази, створеної раніше через create_all, тут створюються тільки
+таблиці, яких ще немає (referral_closure), а решту схеми наступні міграції
+перетворюють так само, як і для нової бази. Таблиця замикання заповнюється для
+вже існуючих користувачів, щоб запрошення від них одразу нараховували бонуси.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+# Таблиця замикання для існуючих користувачів: той самий INSERT ... WITH RECURSIVE
+# по users.referred_by, що й referral_tree.rebuild_referral_closure (повторний запуск
+# безпечний; WHERE true потрібен SQLite для ON CONFLICT після SELECT)
+BACKFILL_CLOSURE = """
+INSERT INTO referral_closure (ancestor_id, descendant_id, depth)
+WITH RECURSIVE chain (ancestor_id, descendant_id, depth) AS (
+    SELECT id, id, 0 FROM users
+    UNION ALL
+    SELECT chain.ancestor_id, users.id, chain.depth + 1
+    FROM chain JOIN users ON users.referred_by = chain.descendant_id
+)
+SELECT ancestor_id, descendant_id, depth FROM chain WHERE true
+ON CONFLICT DO NOTHING
+"""
+
+
+def _missing(table: str) -> bool:
+    return not sa.inspect(op.get_bind()).has_table(table)
+
+
+def upgrade():
+    if _missing('users'):
+        op.create_table(
+            'users',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('telegram_id', sa.String(), nullable=False, unique=True),
+            sa.Column('phone_number', sa.String(), nullable=False),
+            sa.Column('referral_code', sa.String(), unique=True),
+            sa.Column('referred_by', sa.Integer(), sa.ForeignKey('users.id'), nullable=True),
+            sa.Column('balance', sa.Float()),
+            sa.Column('is_admin', sa.Boolean()),
+            sa.Column('created_at', sa.DateTime()),
+        )
+
+    if _missing('referral_closure'):
+        op.create_table(
+            'referral_closure',
+            sa.Column('ancestor_id', sa.Integer(), sa.ForeignKey('users.id'), primary_key=True),
+            sa.Column('descendant_id', sa.Integer(), sa.ForeignKey('users.id'), primary_key=True),
+            sa.Column('depth', sa.Integer(), nullable=False),
+        )
+        op.create_index('ix_referral_closure_ancestor_depth', 'referral_closure', ['ancestor_id', 'depth'])
+        op.create_index('ix_referral_closure_descendant', 'referral_closure', ['descendant_id', 'depth'])
+
+    op.execute(BACKFILL_CLOSURE)
+
+    if _missing('referral_bonuses'):
+        op.create_table(
+            'referral_bonuses',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id')),
+            sa.Column('amount', sa.Float()),
+            sa.Column('description', sa.String(200)),
+            sa.Column('created_at', sa.DateTime()),
+        )
+
+    if _missing('tour_requests'):
+        op.create_table(
+            'tour_requests',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id')),
+            sa.Column('description', sa.Text()),
+            sa.Column('status', sa.String(20)),
+            sa.Column('created_at', sa.DateTime()),
+            sa.Column('updated_at', sa.DateTime()),
+        )
+
+
+def downgrade():
+    op.drop_table('tour_requests')
+    op.drop_table('referral_bonuses')
+    op.drop_table('referral_closure')
+    op.drop_table('users')
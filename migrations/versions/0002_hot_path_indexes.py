@@ -0,0 +1,38 @@
+"""Індекси для частих запитів
+
+Індекси будуються CONCURRENTLY поза транзакцією міграції, тому таблиці
+не блокуються для запису і оновлення не потребує зупинки бота.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    # Кількість рефералів: WHERE referred_by = ?
+    ('ix_users_referred_by', 'users', ['referred_by']),
+    # Пошук за номером телефону
+    ('ix_users_phone_number', 'users', ['phone_number']),
+    # Історія нарахувань користувача: WHERE user_id = ? ORDER BY created_at DESC
+    ('ix_referral_bonuses_user_created', 'referral_bonuses', ['user_id', 'created_at']),
+    # Список заявок з фільтром за статусом та періодом
+    ('ix_tour_requests_status_created', 'tour_requests', ['status', 'created_at']),
+]
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, _ in INDEXES:
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,69 @@
+"""Тип, рівень та джерело записів журналу
+
+Нові колонки заповнюються з описів існуючих записів пачками по BATCH_SIZE рядків
+(в режимі autocommit кожен UPDATE - окрема коротка транзакція), індекс будується CONCURRENTLY.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 10000
+
+# Опис реферального бонусу: "Бонус за запрошення користувача <телефон>[ (<N>-й рівень)]"
+BACKFILL_REFERRAL = sa.text(r"""
+    UPDATE referral_bonuses AS b
+    SET kind = 'referral',
+        level = coalesce(substring(b.description FROM '\((\d+)-й рівень\)$')::int, 1),
+        source_user_id = (
+            SELECT u.id FROM users AS u
+            WHERE u.phone_number = substring(b.description FROM '^Бонус за запрошення користувача (\S+)')
+            ORDER BY u.id
+            LIMIT 1
+        )
+    WHERE b.id >= :start AND b.id < :end
+      AND b.level IS NULL
+      AND b.description LIKE 'Бонус за запрошення користувача %'
+""")
+
+
+def upgrade():
+    op.add_column('referral_bonuses', sa.Column('kind', sa.String(20), nullable=False, server_default='manual'))
+    op.add_column('referral_bonuses', sa.Column('level', sa.Integer(), nullable=True))
+    op.add_column('referral_bonuses', sa.Column('source_user_id', sa.Integer(), nullable=True))
+    op.create_foreign_key(
+        'referral_bonuses_source_user_id_fkey', 'referral_bonuses', 'users', ['source_user_id'], ['id']
+    )
+
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        start = 0
+        # Максимальний id перечитується, щоб охопити записи, додані під час заповнення
+        while start <= (bind.scalar(sa.text("SELECT max(id) FROM referral_bonuses")) or 0):
+            end = start + BATCH_SIZE
+            bind.execute(BACKFILL_REFERRAL, {'start': start, 'end': end})
+            start = end
+
+        op.create_index(
+            'ix_referral_bonuses_user_level', 'referral_bonuses', ['user_id', 'level'],
+            postgresql_include=['amount'], postgresql_concurrently=True, if_not_exists=True
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_referral_bonuses_user_level', table_name='referral_bonuses',
+            postgresql_concurrently=True, if_exists=True
+        )
+    op.drop_constraint('referral_bonuses_source_user_id_fkey', 'referral_bonuses', type_='foreignkey')
+    op.drop_column('referral_bonuses', 'source_user_id')
+    op.drop_column('referral_bonuses', 'level')
+    op.drop_column('referral_bonuses', 'kind')
@@ -0,0 +1,80 @@
+"""users.telegram_id: VARCHAR -> BIGINT без зупинки бота
+
+Поруч створюється колонка telegram_id_new, яку тригер синхронізує з telegram_id
+для нових та змінених рядків, а існуючі рядки заповнюються пачками. Унікальний
+індекс будується CONCURRENTLY, NOT NULL спирається на попередньо перевірений
+CHECK. Блокування таблиці потрібне тільки для короткої заміни колонок у кінці.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 10000
+
+SYNC_FUNCTION = """
+    CREATE OR REPLACE FUNCTION users_sync_telegram_id() RETURNS trigger AS $$
+    BEGIN
+        NEW.telegram_id_new := NEW.telegram_id::bigint;
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+"""
+
+SYNC_TRIGGER = """
+    CREATE TRIGGER users_sync_telegram_id
+    BEFORE INSERT OR UPDATE OF telegram_id ON users
+    FOR EACH ROW EXECUTE FUNCTION users_sync_telegram_id()
+"""
+
+BACKFILL = sa.text("""
+    UPDATE users
+    SET telegram_id_new = telegram_id::bigint
+    WHERE id >= :start AND id < :end AND telegram_id_new IS NULL
+""")
+
+
+def upgrade():
+    op.add_column('users', sa.Column('telegram_id_new', sa.BigInteger(), nullable=True))
+    op.execute(SYNC_FUNCTION)
+    op.execute(SYNC_TRIGGER)
+
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        max_id = bind.scalar(sa.text("SELECT max(id) FROM users")) or 0
+        # Рядки, додані після max_id, заповнює тригер
+        for start in range(0, max_id + 1, BATCH_SIZE):
+            bind.execute(BACKFILL, {'start': start, 'end': start + BATCH_SIZE})
+
+        op.create_index(
+            'users_telegram_id_new_key', 'users', ['telegram_id_new'],
+            unique=True, postgresql_concurrently=True, if_not_exists=True
+        )
+        op.execute(
+            "ALTER TABLE users ADD CONSTRAINT users_telegram_id_new_not_null "
+            "CHECK (telegram_id_new IS NOT NULL) NOT VALID"
+        )
+        op.execute("ALTER TABLE users VALIDATE CONSTRAINT users_telegram_id_new_not_null")
+
+    # Заміна колонок - одна коротка транзакція без перечитування таблиці
+    op.execute("DROP TRIGGER users_sync_telegram_id ON users")
+    op.execute("DROP FUNCTION users_sync_telegram_id()")
+    op.alter_column('users', 'telegram_id_new', nullable=False)
+    op.drop_constraint('users_telegram_id_new_not_null', 'users', type_='check')
+    op.drop_column('users', 'telegram_id')
+    op.alter_column('users', 'telegram_id_new', new_column_name='telegram_id')
+    op.execute("ALTER TABLE users ADD CONSTRAINT users_telegram_id_key UNIQUE USING INDEX users_telegram_id_new_key")
+
+
+def downgrade():
+    op.alter_column(
+        'users', 'telegram_id', type_=sa.String(), existing_nullable=False,
+        postgresql_using='telegram_id::varchar'
+    )
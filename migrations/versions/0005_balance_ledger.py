@@ -0,0 +1,77 @@
+"""Журнал балансів у копійках та знімки балансів
+
+users.balance та referral_bonuses.amount переводяться з гривень (Float) у копійки
+(BIGINT). Для користувачів, чий баланс не збігається з сумою історії, додається
+запис коригування, після чого журнал стає джерелом істини для балансу.
+
+Зміна типу колонок перезаписує таблиці, тому бота на час міграції потрібно зупинити.
+Кожен крок перевіряє поточний стан схеми, тому повторний запуск нічого не змінює.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+ADJUSTMENT_DESCRIPTION = 'Коригування залишку при переході на журнал'
+
+INSERT_ADJUSTMENTS = sa.text("""
+    INSERT INTO referral_bonuses (user_id, amount, kind, description, created_at)
+    SELECT u.id, u.balance - coalesce(b.total, 0), 'adjustment', :description, now()
+    FROM users AS u
+    LEFT JOIN (
+        SELECT user_id, sum(amount) AS total FROM referral_bonuses GROUP BY user_id
+    ) AS b ON b.user_id = u.id
+    WHERE u.balance <> coalesce(b.total, 0)
+""")
+
+
+def _is_bigint(table: str, column: str) -> bool:
+    columns = sa.inspect(op.get_bind()).get_columns(table)
+    return isinstance(next(c['type'] for c in columns if c['name'] == column), sa.BigInteger)
+
+
+def upgrade():
+    if not _is_bigint('users', 'balance'):
+        op.alter_column(
+            'users', 'balance', type_=sa.BigInteger(), nullable=False, server_default='0',
+            postgresql_using='round(coalesce(balance, 0) * 100)::bigint'
+        )
+    if not _is_bigint('referral_bonuses', 'amount'):
+        op.alter_column(
+            'referral_bonuses', 'amount', type_=sa.BigInteger(), nullable=False,
+            postgresql_using='round(coalesce(amount, 0) * 100)::bigint'
+        )
+
+    # Після першого запуску розбіжностей немає - повторний запуск нічого не додає
+    op.get_bind().execute(INSERT_ADJUSTMENTS, {'description': ADJUSTMENT_DESCRIPTION})
+
+    if not sa.inspect(op.get_bind()).has_table('balance_snapshots'):
+        op.create_table(
+            'balance_snapshots',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+            sa.Column('last_entry_id', sa.Integer(), nullable=False),
+            sa.Column('balance', sa.BigInteger(), nullable=False),
+            sa.Column('created_at', sa.DateTime()),
+            sa.UniqueConstraint('user_id', 'last_entry_id', name='uq_balance_snapshots_user_entry'),
+        )
+
+
+def downgrade():
+    op.drop_table('balance_snapshots')
+    op.execute(sa.text("DELETE FROM referral_bonuses WHERE kind = 'adjustment'"))
+    op.alter_column(
+        'referral_bonuses', 'amount', type_=sa.Float(), nullable=True,
+        postgresql_using='amount / 100.0'
+    )
+    op.alter_column(
+        'users', 'balance', type_=sa.Float(), nullable=True, server_default=None,
+        postgresql_using='balance / 100.0'
+    )
@@ -0,0 +1,35 @@
+"""Індекси для сторінок списку користувачів
+
+Сортування за балансом та датою реєстрації читає сторінку за ключем (значення, id),
+тому кожен запит - короткий прохід індексу замість сортування всієї таблиці users.
+Індекси будуються CONCURRENTLY поза транзакцією міграції, як і в 0002.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    # ORDER BY balance DESC, id DESC з умовою (balance, id) < (?, ?)
+    ('ix_users_balance_id', 'users', ['balance', 'id']),
+    # ORDER BY created_at DESC, id DESC з умовою (created_at, id) < (?, ?)
+    ('ix_users_created_id', 'users', ['created_at', 'id']),
+]
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, _ in INDEXES:
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
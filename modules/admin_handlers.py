@@ -1,52 +1,71 @@
 import os
+from datetime import datetime, timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
 from telegram.ext import ContextTypes
-from .models import Session, User, ReferralBonus, TourRequest
-from sqlalchemy import func
+from .models import async_session, User, ReferralBonus, TourRequest
+from sqlalchemy import select, func, tuple_
+from .referral_tree import get_downline, get_level_stats
+from .user_repository import UserRepository, USER_LIST_SORTS, users, get_current_user
+from .local_cache import get_cache_stats
+from .outbound_queue import outbound
+from .system_stats import get_system_statistics, record_balance_change
+from .ledger import credit, debit, get_balance, to_minor, format_amount
+from .broadcast import (
+    get_broadcast, create_broadcast, cancel_broadcast,
+    format_progress, progress_markup, start_broadcast_task
+)
 from .redis_client import (
-    get_user_data, get_tour_request_status,
-    set_tour_request_status, set_tour_request_data, get_recent_requests,
-    set_user_data, get_user_balance, increment_user_balance,
-    get_system_stats, set_system_stats,
-    clear_users_list_cache
+    get_tour_request_status, get_many_tour_statuses,
+    set_tour_request_status,
+    get_users_list_page, set_users_list_page, clear_users_list_cache,
+    sweep_namespace, USERS_LIST_NAMESPACE
 )
 
+# Простори імен кешу, що інвалідуються поколіннями
+CACHE_NAMESPACES = [USERS_LIST_NAMESPACE]
 
-def is_admin(user_id: int) -> bool:
-    """Перевірка чи є користувач адміністратором - Redis first"""
-    # Спочатку перевіряємо в Redis
-    user_data = get_user_data(str(user_id))
-    if user_data:
-        return user_data.get('is_admin', False)
+# Кількість користувачів на сторінці списку
+USERS_PAGE_SIZE = 10
 
-    # Якщо немає в Redis - перевіряємо в БД та зберігаємо в Redis
-    with Session() as session:
-        user = session.query(User).filter_by(telegram_id=str(user_id)).first()
-        if user:
-            user_data = {
-                'id': user.id,
-                'telegram_id': str(user.telegram_id),
-                'phone_number': user.phone_number,
-                'referral_code': user.referral_code,
-                'referred_by': user.referred_by,
-                'balance': user.balance,
-                'is_admin': user.is_admin,
-                'created_at': user.created_at.strftime('%d.%m.%Y')
-            }
-            set_user_data(str(user_id), user_data)
-            return user.is_admin
-        return False
+USER_LIST_SORT_LABELS = {
+    'i': '🆔 ID',
+    'b': '💰 Баланс',
+    'd': '📅 Нові',
+}
+
+# Кількість заявок на сторінці списку
+TOUR_REQUESTS_PAGE_SIZE = 10
+
+TOUR_STATUSES = {
+    'new': '🆕 Нові',
+    'end': '✅ Оброблені',
+    'all': '📋 Всі',
+}
+
+# Фільтр за періодом: код -> (назва, тривалість)
+TOUR_PERIODS = {
+    'd': ('Доба', timedelta(days=1)),
+    'w': ('Тиждень', timedelta(days=7)),
+    'm': ('Місяць', timedelta(days=30)),
+    'all': ('Весь час', None),
+}
+
+
+def is_admin(context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """Перевірка чи є поточний користувач адміністратором (без запитів до Redis/БД)"""
+    user_data = get_current_user(context)
+    return bool(user_data and user_data.get('is_admin'))
 
 
 async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показ адмін-панелі"""
-    if not is_admin(update.effective_user.id):
+    if not is_admin(context):
         await update.message.reply_text("У вас немає доступу до адмін-панелі!")
         return
 
     keyboard = [
         [KeyboardButton("👥 Управління користувачами"), KeyboardButton("📋 Заявки на тури")],
-        [KeyboardButton("💰 Нарахування балів")],
+        [KeyboardButton("💰 Нарахування балів"), KeyboardButton("📢 Розсилка")],
         [KeyboardButton("👤 Режим користувача")]
     ]
     reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
@@ -59,36 +78,9 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
-def get_users_from_cache_or_db():
-    """Отримати користувачів з Redis або БД"""
-    # Спочатку отримуємо з БД
-    with Session() as session:
-        users = session.query(User).order_by(User.id).all()
-        users_data = []
-
-        for user in users:
-            # Отримуємо актуальні дані з БД
-            user_data = {
-                'id': user.id,
-                'telegram_id': str(user.telegram_id),
-                'phone_number': user.phone_number,
-                'referral_code': user.referral_code,
-                'referred_by': user.referred_by,
-                'balance': user.balance,
-                'is_admin': user.is_admin,
-                'created_at': user.created_at.strftime('%d.%m.%Y')
-            }
-            # Оновлюємо кеш в Redis
-            set_user_data(str(user.telegram_id), user_data)
-            users_data.append(user_data)
-
-        # Зберігаємо список в кеш на 5 хвилин
-        return users_data
-
-
 async def show_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показ меню управління користувачами"""
-    if not is_admin(update.effective_user.id):
+    if not is_admin(context):
         return
 
     keyboard = [
@@ -104,75 +96,97 @@ async def show_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(text, reply_markup=reply_markup)
 
 
-async def show_users_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показ списку всіх користувачів"""
-    if not is_admin(update.effective_user.id):
-        return
-
-    # Отримуємо користувачів з БД
-    users_data = get_users_from_cache_or_db()
-
-    text = "👥 СПИСОК КОРИСТУВАЧІВ:\n\n"
-
-    if users_data:
-        for user_data in users_data:
-            admin_mark = " 👑" if user_data.get('is_admin') else ""
+def _users_page_cursor(sort: str, user: User) -> str:
+    """Курсор сторінки для callback_data: значення колонки сортування та id"""
+    value = getattr(user, USER_LIST_SORTS[sort][0].key)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return f"{value}:{user.id}"
+
+
+async def render_users_page(page_key: str) -> dict:
+    """Сторінка списку користувачів: текст та кнопки (рядки [текст, callback_data])
+
+    page_key - callback_data виду ul:<сортування>[:<n|p>:<значення>:<id>]
+    """
+    parts = page_key.split(':', 3)
+    sort = parts[1] if len(parts) > 1 and parts[1] in USER_LIST_SORTS else 'i'
+    cursor, forward = None, True
+    if len(parts) == 4:
+        forward = parts[2] == 'n'
+        value, user_id = parts[3].rsplit(':', 1)
+        cursor = (USER_LIST_SORTS[sort][2](value), int(user_id))
+
+    page_users, has_prev, has_next = await users.page(sort, cursor, forward, USERS_PAGE_SIZE)
+    # Прочитані користувачі потрапляють у кеш одним pipeline замість SETEX на кожного
+    await users.remember_many(page_users)
+
+    buttons = []
+    if page_users:
+        text = "👥 СПИСОК КОРИСТУВАЧІВ:\n\n"
+        for user in page_users:
+            admin_mark = " 👑" if user.is_admin else ""
             text += (
-                f"ID: {user_data['id']}{admin_mark}\n"
-                f"📱 {user_data['phone_number']}\n"
-                f"💰 Баланс: {user_data['balance']} грн\n"
-                f"🔗 Код: {user_data['referral_code']}\n"
-                f"📅 {user_data.get('created_at', '')}\n"
+                f"ID: {user.id}{admin_mark}\n"
+                f"📱 {user.phone_number}\n"
+                f"💰 Баланс: {format_amount(user.balance)} грн\n"
+                f"🔗 Код: {user.referral_code}\n"
+                f"📅 {user.created_at.strftime('%d.%m.%Y')}\n"
                 "─────────────────\n"
             )
+        user_buttons = [[f"👤 {user.id} {user.phone_number}", f"user_info_{user.id}"] for user in page_users]
+        buttons += [user_buttons[i:i + 2] for i in range(0, len(user_buttons), 2)]
+
+        navigation = []
+        if has_prev:
+            navigation.append(["◀️", f"ul:{sort}:p:{_users_page_cursor(sort, page_users[0])}"])
+        if has_next:
+            navigation.append(["▶️", f"ul:{sort}:n:{_users_page_cursor(sort, page_users[-1])}"])
+        if navigation:
+            buttons.append(navigation)
     else:
         text = "Користувачів не знайдено"
 
-    keyboard = [
-        [InlineKeyboardButton("🔍 Пошук", callback_data='admin_users_search')],
-        [InlineKeyboardButton("◀️ Назад", callback_data='admin_users')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    buttons.append([
+        [f"{'• ' if code == sort else ''}{label}", f"ul:{code}"]
+        for code, label in USER_LIST_SORT_LABELS.items()
+    ])
+    buttons.append([["🔍 Пошук", 'admin_users_search'], ["◀️ Назад", 'admin_users']])
+    return {'text': text, 'buttons': buttons}
 
-    if hasattr(update, 'callback_query') and update.callback_query:
-        await update.callback_query.message.edit_text(text, reply_markup=reply_markup)
+
+async def show_users_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показ списку користувачів посторінково (пагінація за ключем, кеш сторінок в Redis)"""
+    if not is_admin(context):
+        return
+
+    query = update.callback_query
+    page_key = query.data if query and query.data.startswith('ul:') else 'ul:i'
+
+    generation, page = await get_users_list_page(page_key)
+    if not page:
+        page = await render_users_page(page_key)
+        await set_users_list_page(generation, page_key, page)
+
+    reply_markup = InlineKeyboardMarkup([
+        [InlineKeyboardButton(label, callback_data=data) for label, data in row]
+        for row in page['buttons']
+    ])
+
+    if query:
+        await query.message.edit_text(page['text'], reply_markup=reply_markup)
     else:
-        await update.message.reply_text(text, reply_markup=reply_markup)
+        await update.message.reply_text(page['text'], reply_markup=reply_markup)
 
 
-def find_user_by_id_or_phone(identifier):
+async def find_user_by_id_or_phone(identifier):
     """Пошук користувача за ID або телефоном"""
-    with Session() as session:
-        try:
-            user_id = int(identifier)
-            user = session.query(User).get(user_id) or session.query(User).filter_by(telegram_id=str(user_id)).first()
-        except ValueError:
-            pass
-        if not user:
-            user = session.query(User).filter_by(phone_number=str(user_id)).first()
-
-        if user:
-            # Отримуємо актуальні дані з БД
-            user_data = {
-                'id': user.id,
-                'telegram_id': str(user.telegram_id),
-                'phone_number': user.phone_number,
-                'referral_code': user.referral_code,
-                'referred_by': user.referred_by,
-                'balance': user.balance,
-                'is_admin': user.is_admin,
-                'created_at': user.created_at.strftime('%d.%m.%Y')
-            }
-            # Оновлюємо кеш в Redis
-            set_user_data(str(user.telegram_id), user_data)
-            return user_data
-
-    return None
+    return await users.find(identifier)
 
 
 async def search_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Початок процесу пошуку користувача"""
-    if not is_admin(update.effective_user.id):
+    if not is_admin(context):
         return
 
     text = "Введіть ID користувача або номер телефону для пошуку:\nДля скасування напишіть 'вийти'"
@@ -187,7 +201,7 @@ async def search_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def handle_user_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обробка пошуку користувача - оптимізовано"""
-    if not is_admin(update.effective_user.id):
+    if not is_admin(context):
         return
 
     if not context.user_data.get('waiting_for_user_search'):
@@ -201,25 +215,24 @@ async def handle_user_search(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
 
     # Отримуємо актуальні дані з БД
-    with Session() as session:
-        try:
-            user_id = int(identifier)
-            user = session.query(User).get(user_id) or session.query(User).filter_by(telegram_id=str(user_id)).first()
-        except ValueError:
-            pass
-        if not user:
-            user = session.query(User).filter_by(phone_number=str(user_id)).first()
+    user_data = await users.find(identifier)
+    async with async_session() as session:
+        user = await session.get(User, user_data['id']) if user_data else None
 
         if user:
             # Отримуємо актуальну статистику з БД
-            total_referrals = session.query(User).filter_by(referred_by=user.id).count()
-            total_bonuses = session.query(ReferralBonus).filter_by(user_id=user.id).count()
+            total_referrals = await session.scalar(
+                select(func.count(User.id)).filter_by(referred_by=user.id)
+            )
+            total_bonuses = await session.scalar(
+                select(func.count(ReferralBonus.id)).filter_by(user_id=user.id)
+            )
 
             text = (
                 f"👤 ІНФОРМАЦІЯ ПРО КОРИСТУВАЧА\n\n"
                 f"🆔 ID: {user.id}\n"
                 f"📱 Телефон: {user.phone_number}\n"
-                f"💰 Баланс: {user.balance} грн\n"
+                f"💰 Баланс: {format_amount(user.balance)} грн\n"
                 f"🔗 Реферальний код: {user.referral_code}\n"
                 f"📅 Дата реєстрації: {user.created_at.strftime('%d.%m.%Y')}\n"
                 f"👥 Запрошено рефералів: {total_referrals}\n"
@@ -247,49 +260,12 @@ async def handle_user_search(update: Update, context: ContextTypes.DEFAULT_TYPE)
     context.user_data.pop('waiting_for_user_search', None)
 
 
-def get_system_statistics():
-    """Отримати системну статистику - Redis first"""
-    # Спочатку перевіряємо кеш
-    cached_stats = get_system_stats()
-    if cached_stats:
-        return cached_stats
-
-    # Якщо немає в кеші - розраховуємо з БД
-    with Session() as session:
-        total_users = session.query(User).count()
-        active_users = session.query(User).filter(User.balance > 0).count()
-        total_referrals = session.query(User).filter(User.referred_by.isnot(None)).count()
-        total_bonuses = session.query(ReferralBonus).count()
-        total_bonus_amount = session.query(func.sum(ReferralBonus.amount)).scalar() or 0
-
-        # Отримуємо загальний баланс з Redis (більш актуальний)
-        total_balance = 0
-        users = session.query(User.telegram_id).all()
-        for user in users:
-            balance = get_user_balance(str(user.telegram_id))
-            if balance:
-                total_balance += float(balance)
-
-        stats = {
-            'total_users': total_users,
-            'active_users': active_users,
-            'total_balance': total_balance,
-            'total_referrals': total_referrals,
-            'total_bonuses': total_bonuses,
-            'total_bonus_amount': float(total_bonus_amount)
-        }
-
-        # Кешуємо на 10 хвилин
-        set_system_stats(stats, 600)
-        return stats
-
-
 async def show_users_statistics(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показ загальної статистики користувачів - оптимізовано"""
-    if not is_admin(update.effective_user.id):
+    """Показ загальної статистики користувачів (лічильники в Redis, без запитів до БД)"""
+    if not is_admin(context):
         return
 
-    stats = get_system_statistics()
+    stats = await get_system_statistics()
 
     text = (
         "📊 СТАТИСТИКА КОРИСТУВАЧІВ\n\n"
@@ -297,6 +273,8 @@ async def show_users_statistics(update: Update, context: ContextTypes.DEFAULT_TY
         f"✅ Активних користувачів: {stats['active_users']}\n"
         f"👥 Запрошено рефералів: {stats['total_referrals']}\n"
         f"🎁 Нараховано бонусів: {stats['total_bonuses']}\n"
+        f"💵 Сума нарахувань: {format_amount(stats['total_bonus_amount'])} грн\n"
+        f"💰 Загальний баланс: {format_amount(stats['total_balance'])} грн\n"
     )
 
     keyboard = [
@@ -310,34 +288,54 @@ async def show_users_statistics(update: Update, context: ContextTypes.DEFAULT_TY
         await update.message.reply_text(text, reply_markup=reply_markup)
 
 
+async def show_cache_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показ статистики локального кешу та черги вихідних повідомлень процесу"""
+    if not is_admin(context):
+        return
+
+    text = "🗄 ЛОКАЛЬНИЙ КЕШ\n\n"
+    for name, stats in get_cache_stats().items():
+        text += (
+            f"📦 {name}: {stats['size']}/{stats['maxsize']}\n"
+            f"├── Влучань: {stats['hits']}\n"
+            f"├── Промахів: {stats['misses']}\n"
+            f"└── Hit rate: {stats['hit_rate']:.1%}\n\n"
+        )
+
+    stats = outbound.stats()
+    text += (
+        "📤 ЧЕРГА ПОВІДОМЛЕНЬ\n\n"
+        f"├── В черзі: {stats['depth']} (чатів: {stats['chats']})\n"
+        f"├── Надіслано: {stats['sent']}\n"
+        f"├── Повторів: {stats['retried']}\n"
+        f"└── Не доставлено: {stats['failed']}\n"
+    )
+
+    await update.message.reply_text(text)
+
+
+async def sweep_cache(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Фізичне видалення застарілих поколінь кешу списків"""
+    if not is_admin(context):
+        return
+
+    await update.message.reply_text("🧹 Видаляємо застарілі ключі кешу...")
+    deleted = 0
+    for namespace in CACHE_NAMESPACES:
+        deleted += await sweep_namespace(namespace)
+    await update.message.reply_text(f"✅ Видалено ключів: {deleted}")
+
+
 async def show_users_for_bonus(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Початок процесу додавання бонусу - оптимізовано"""
-    if not is_admin(update.effective_user.id):
+    if not is_admin(context):
         return
 
     if hasattr(update, 'callback_query') and update.callback_query:
         data = update.callback_query.data.split('_')
         user_id = int(data[2])
+        user_data = await users.get_by_id(user_id)
         if 'deduct' in data[0]:
-            user_data = None
-            with Session() as session:
-                user = session.query(User).get(user_id)
-                if user:
-                    user_data = get_user_data(str(user.telegram_id))
-                    if not user_data:
-                        # Зберігаємо в Redis якщо немає
-                        user_data = {
-                            'id': user.id,
-                            'telegram_id': str(user.telegram_id),
-                            'phone_number': user.phone_number,
-                            'referral_code': user.referral_code,
-                            'referred_by': user.referred_by,
-                            'balance': user.balance,
-                            'is_admin': user.is_admin,
-                            'created_at': user.created_at.strftime('%d.%m.%Y')
-                        }
-                        set_user_data(str(user.telegram_id), user_data)
-
             if user_data:
                 context.user_data['deduct_user_id'] = user_data['id']
                 context.user_data['deduct_user_phone'] = user_data['phone_number']
@@ -345,33 +343,13 @@ async def show_users_for_bonus(update: Update, context: ContextTypes.DEFAULT_TYP
 
                 await update.callback_query.message.edit_text(
                     f"Знайдено: {user_data['phone_number']}\n"
-                    f"Поточний баланс: {user.balance} грн\n\n"
+                    f"Поточний баланс: {format_amount(user_data['balance'])} грн\n\n"
                     f"Введіть суму для віднімання:"
                 )
                 context.user_data['waiting_for_deduct_amount'] = True
             else:
                 await update.callback_query.message.edit_text("❌ Користувача не знайдено")
         else:
-            # Спочатку шукаємо в Redis
-            user_data = None
-            with Session() as session:
-                user = session.query(User).get(user_id)
-                if user:
-                    user_data = get_user_data(str(user.telegram_id))
-                    if not user_data:
-                        # Зберігаємо в Redis якщо немає
-                        user_data = {
-                            'id': user.id,
-                            'telegram_id': str(user.telegram_id),
-                            'phone_number': user.phone_number,
-                            'referral_code': user.referral_code,
-                            'referred_by': user.referred_by,
-                            'balance': user.balance,
-                            'is_admin': user.is_admin,
-                            'created_at': user.created_at.strftime('%d.%m.%Y')
-                        }
-                        set_user_data(str(user.telegram_id), user_data)
-
             if user_data:
                 context.user_data['bonus_user_id'] = user_data['id']
                 context.user_data['bonus_user_phone'] = user_data['phone_number']
@@ -379,7 +357,7 @@ async def show_users_for_bonus(update: Update, context: ContextTypes.DEFAULT_TYP
 
                 await update.callback_query.message.edit_text(
                     f"Знайдено: {user_data['phone_number']}\n"
-                    f"Поточний баланс: {user.balance} грн\n\n"
+                    f"Поточний баланс: {format_amount(user_data['balance'])} грн\n\n"
                     f"Введіть суму для нарахування:"
                 )
                 context.user_data['waiting_for_bonus_amount'] = True
@@ -392,7 +370,7 @@ async def show_users_for_bonus(update: Update, context: ContextTypes.DEFAULT_TYP
 
 async def handle_user_identifier(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обробка введення ID або номера телефону користувача - оптимізовано"""
-    if not is_admin(update.effective_user.id):
+    if not is_admin(context):
         return
 
     identifier = update.message.text.strip()
@@ -403,17 +381,18 @@ async def handle_user_identifier(update: Update, context: ContextTypes.DEFAULT_T
         return
 
     # Використовуємо оптимізовану функцію пошуку
-    user_data = find_user_by_id_or_phone(identifier)
+    user_data = await find_user_by_id_or_phone(identifier)
 
     if user_data:
-        balance = get_user_balance(user_data['telegram_id']) or user_data.get('balance', 0)
+        async with async_session() as session:
+            balance = await get_balance(session, user_data['id'])
         context.user_data['bonus_user_id'] = user_data['id']
         context.user_data['bonus_user_phone'] = user_data['phone_number']
         context.user_data['bonus_user_telegram_id'] = user_data['telegram_id']
 
         await update.message.reply_text(
             f"Знайдено: {user_data['phone_number']}\n"
-            f"Поточний баланс: {balance} грн\n\n"
+            f"Поточний баланс: {format_amount(balance)} грн\n\n"
             f"Введіть суму для нарахування:"
         )
         context.user_data['waiting_for_user_identifier'] = False
@@ -427,7 +406,7 @@ async def handle_user_identifier(update: Update, context: ContextTypes.DEFAULT_T
 
 async def handle_bonus_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обробка введеної суми бонусу"""
-    if not is_admin(update.effective_user.id):
+    if not is_admin(context):
         return
 
     text = update.message.text.strip()
@@ -442,7 +421,7 @@ async def handle_bonus_amount(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
 
     try:
-        amount = float(text)
+        amount = to_minor(text)
         if amount <= 0:
             await update.message.reply_text("❌ Сума має бути більше 0!")
             return
@@ -460,7 +439,7 @@ async def handle_bonus_amount(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def handle_deduct_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обробка введеної суми для віднімання"""
-    if not is_admin(update.effective_user.id):
+    if not is_admin(context):
         return
 
     text = update.message.text.strip()
@@ -475,7 +454,7 @@ async def handle_deduct_amount(update: Update, context: ContextTypes.DEFAULT_TYP
         return
 
     try:
-        amount = float(text)
+        amount = to_minor(text)
         if amount <= 0:
             await update.message.reply_text("❌ Сума має бути більше 0!")
             return
@@ -493,43 +472,35 @@ async def handle_deduct_amount(update: Update, context: ContextTypes.DEFAULT_TYP
 
 async def handle_bonus_description(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обробка опису бонусу та нарахування"""
-    if not is_admin(update.effective_user.id):
+    if not is_admin(context):
         return
 
     user_id = context.user_data.get('bonus_user_id')
     amount = context.user_data.get('bonus_amount')
     description = update.message.text
 
-    with Session() as session:
-        user = session.query(User).get(user_id)
+    async with async_session() as session:
+        user = await session.get(User, user_id)
         if user:
-            # Нараховуємо бонус в базі даних
-            user.balance += amount
-            bonus = ReferralBonus(
-                user_id=user.id,
-                amount=amount,
-                description=description
-            )
-            session.add(bonus)
-            session.commit()
+            # Запис у журнал та зміна балансу - в одній транзакції
+            await credit(session, user.id, amount, description)
+            await session.commit()
 
-            # Оновлюємо баланс в Redis
-            increment_user_balance(str(user.telegram_id), amount)
+            await users.invalidate(user.telegram_id)
+            await clear_users_list_cache()
+            await record_balance_change(amount)
 
             # Відправляємо повідомлення користувачу
-            try:
-                await context.bot.send_message(
-                    chat_id=user.telegram_id,
-                    text=f"💰 Вам нараховано +{amount} грн!\n"
-                         f"💬 {description}"
-                )
-            except Exception as e:
-                print(f"Помилка відправки повідомлення користувачу {user.telegram_id}: {str(e)}")
+            outbound.enqueue(
+                user.telegram_id,
+                f"💰 Вам нараховано +{format_amount(amount)} грн!\n"
+                f"💬 {description}"
+            )
 
             await update.message.reply_text(
                 f"✅ Бонус успішно нараховано!\n"
                 f"👤 Користувач: {user.phone_number}\n"
-                f"💰 Сума: {amount} грн\n"
+                f"💰 Сума: {format_amount(amount)} грн\n"
                 f"💬 Опис: {description}"
             )
         else:
@@ -543,18 +514,21 @@ async def handle_bonus_description(update: Update, context: ContextTypes.DEFAULT
 
 async def handle_deduct_description(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обробка опису віднімання та виконання віднімання"""
-    if not is_admin(update.effective_user.id):
+    if not is_admin(context):
         return
 
     user_id = context.user_data.get('deduct_user_id')
     amount = context.user_data.get('deduct_amount')
     description = update.message.text
 
-    with Session() as session:
-        user = session.query(User).get(user_id)
+    async with async_session() as session:
+        user = await session.get(User, user_id)
         if user:
-            # Перевіряємо чи достатньо коштів
-            if user.balance < amount:
+            # Перевірка коштів і списання - один умовний UPDATE, тому два паралельні
+            # списання не можуть обидва пройти перевірку
+            balance = await debit(session, user.id, amount, description)
+            if balance is None:
+                await session.rollback()
                 context.user_data.pop('waiting_for_deduct_description', None)
                 context.user_data.pop('deduct_user_id', None)
                 context.user_data.pop('deduct_user_phone', None)
@@ -562,31 +536,22 @@ async def handle_deduct_description(update: Update, context: ContextTypes.DEFAUL
                 context.user_data.pop('deduct_amount', None)
                 await update.message.reply_text("❌ У користувача недостатньо коштів!")
                 return
-
-            # Віднімаємо кошти в базі даних
-            user.balance -= amount
-            bonus = ReferralBonus(
-                user_id=user.id,
-                amount=-amount,  # Зберігаємо від'ємне значення
-                description=description
-            )
-            session.add(bonus)
-            session.commit()
+            await session.commit()
+            await users.invalidate(user.telegram_id)
+            await clear_users_list_cache()
+            await record_balance_change(-amount)
 
             # Відправляємо повідомлення користувачу
-            try:
-                await context.bot.send_message(
-                    chat_id=user.telegram_id,
-                    text=f"💰 З вашого балансу віднято {amount} грн!\n"
-                         f"💬 {description}"
-                )
-            except Exception as e:
-                print(f"Помилка відправки повідомлення користувачу {user.telegram_id}: {str(e)}")
+            outbound.enqueue(
+                user.telegram_id,
+                f"💰 З вашого балансу віднято {format_amount(amount)} грн!\n"
+                f"💬 {description}"
+            )
 
             await update.message.reply_text(
                 f"✅ Кошти успішно віднято!\n"
                 f"👤 Користувач: {user.phone_number}\n"
-                f"💰 Сума: {amount} грн\n"
+                f"💰 Сума: {format_amount(amount)} грн\n"
                 f"📝 Опис: {description}"
             )
 
@@ -598,183 +563,144 @@ async def handle_deduct_description(update: Update, context: ContextTypes.DEFAUL
             context.user_data.pop('deduct_amount', None)
 
 
-def get_tour_requests_from_cache_or_db():
-    """Отримати заявки з Redis або БД"""
-    # Спочатку перевіряємо кеш
-    cached_requests = get_recent_requests()
-    if cached_requests:
-        return cached_requests
-
-    # Якщо немає в кеші - отримуємо з БД
-    with Session() as session:
-        new_requests = session.query(TourRequest).filter_by(status='new').order_by(TourRequest.created_at.desc()).all()
-        processed_requests = session.query(TourRequest).filter_by(status='end').order_by(
-            TourRequest.created_at.desc()).all()
-
-        requests_data = {
-            'new': [],
-            'processed': []
-        }
-
-        # Обробляємо нові заявки
-        for request in new_requests:
-            # Отримуємо дані користувача
-            user = session.query(User).get(request.user_id)
-            user_data = get_user_data(str(user.telegram_id))
-            if not user_data:
-                user_data = {
-                    'id': user.id,
-                    'telegram_id': str(user.telegram_id),
-                    'phone_number': user.phone_number,
-                    'referral_code': user.referral_code,
-                    'referred_by': user.referred_by,
-                    'balance': user.balance,
-                    'is_admin': user.is_admin,
-                    'created_at': user.created_at.strftime('%d.%m.%Y')
-                }
-                set_user_data(str(user.telegram_id), user_data)
-
-            # Зберігаємо дані заявки в Redis
-            request_data = {
-                'id': request.id,
-                'user_id': request.user_id,
-                'description': request.description,
-                'status': request.status,
-                'created_at': request.created_at.strftime('%d.%m.%Y %H:%M'),
-                'user_phone': user_data['phone_number']
-            }
-            set_tour_request_data(request.id, request_data)
-            requests_data['new'].append(request_data)
-
-        # Обробляємо оброблені заявки
-        for request in processed_requests:
-            user = session.query(User).get(request.user_id)
-            user_data = get_user_data(str(user.telegram_id))
-            if not user_data:
-                user_data = {
-                    'id': user.id,
-                    'telegram_id': str(user.telegram_id),
-                    'phone_number': user.phone_number,
-                    'referral_code': user.referral_code,
-                    'referred_by': user.referred_by,
-                    'balance': user.balance,
-                    'is_admin': user.is_admin,
-                    'created_at': user.created_at.strftime('%d.%m.%Y')
-                }
-                set_user_data(str(user.telegram_id), user_data)
-
-            request_data = {
-                'id': request.id,
-                'user_id': request.user_id,
-                'description': request.description,
-                'status': request.status,
-                'created_at': request.created_at.strftime('%d.%m.%Y %H:%M'),
-                'user_phone': user_data['phone_number']
-            }
-            set_tour_request_data(request.id, request_data)
-            requests_data['processed'].append(request_data)
-
-        return requests_data
+def _tour_filters(status: str, period: str) -> list:
+    """Умови WHERE для фільтрів списку заявок"""
+    conditions = []
+    if status != 'all':
+        conditions.append(TourRequest.status == status)
+    if TOUR_PERIODS[period][1]:
+        conditions.append(TourRequest.created_at >= datetime.utcnow() - TOUR_PERIODS[period][1])
+    return conditions
+
+
+def _tour_page_cursor(request) -> str:
+    """Курсор сторінки заявок для callback_data: час створення та id"""
+    return f"{request.created_at.isoformat()}:{request.id}"
+
+
+async def get_tour_requests_page(status: str, period: str, cursor: tuple = None,
+                                 forward: bool = True, limit: int = TOUR_REQUESTS_PAGE_SIZE) -> tuple:
+    """Сторінка заявок (новіші першими) разом з телефоном клієнта одним запитом
+
+    Пагінація за ключем (created_at, id) - той самий порядок, що й в індексі
+    (status, created_at), тому сторінка зі статусом читається з індексу без сортування
+    всіх заявок. Читається тільки limit + 1 рядок. cursor - (created_at, id).
+    Повертає (рядки, чи є новіші, чи є старіші)
+    """
+    query = (
+        select(TourRequest.id, TourRequest.status, TourRequest.created_at, User.phone_number)
+        .outerjoin(User, User.id == TourRequest.user_id)
+        .where(*_tour_filters(status, period))
+    )
+    key = tuple_(TourRequest.created_at, TourRequest.id)
+    if forward:
+        if cursor:
+            query = query.where(key < tuple_(*cursor))
+        query = query.order_by(TourRequest.created_at.desc(), TourRequest.id.desc())
+    else:
+        query = query.where(key > tuple_(*cursor)).order_by(TourRequest.created_at, TourRequest.id)
+
+    async with async_session() as session:
+        rows = (await session.execute(query.limit(limit + 1))).all()
+
+    has_more = len(rows) > limit
+    rows = list(rows[:limit])
+    if forward:
+        return rows, cursor is not None, has_more
+    rows.reverse()
+    return rows, has_more, True
+
+
+async def count_tour_requests(period: str) -> dict:
+    """Кількість заявок за статусами одним GROUP BY (покривається індексом status, created_at)"""
+    async with async_session() as session:
+        rows = await session.execute(
+            select(TourRequest.status, func.count())
+            .where(*_tour_filters('all', period))
+            .group_by(TourRequest.status)
+        )
+    return dict(rows.all())
 
 
 async def show_tour_requests(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показати список заявок на тури"""
-    with Session() as session:
-        # Отримуємо нові заявки
-        new_requests = session.query(TourRequest).filter_by(status='new').order_by(TourRequest.created_at.desc()).all()
-
-        # Отримуємо оброблені заявки
-        processed_requests = session.query(TourRequest).filter_by(status='end').order_by(TourRequest.created_at.desc()).all()
-
-        text = "📋 ЗАЯВКИ НА ТУРИ\n\n"
-
-        if new_requests:
-            text += "🆕 НОВІ ЗАЯВКИ:\n"
-            for request in new_requests:
-                # Перевіряємо статус в Redis
-                status = get_tour_request_status(request.id) or 'new'
-
-                # Перевіряємо дані користувача в Redis
-                user = session.query(User).get(request.user_id)
-                user_data = get_user_data(str(user.telegram_id))
-                if not user_data:
-                    user_data = {
-                        'telegram_id': str(user.telegram_id),
-                        'phone_number': user.phone_number,
-                        'referral_code': user.referral_code,
-                        'referred_by': user.referred_by,
-                        'balance': user.balance,
-                        'is_admin': user.is_admin
-                    }
-                    set_user_data(str(user.telegram_id), user_data)
-
-                text += f"├── ID: {request.id}\n"
-                text += f"├── Клієнт: {user_data['phone_number']}\n"
-                text += f"├── Статус: {status}\n"
-                text += f"└── Створено: {request.created_at.strftime('%d.%m.%Y %H:%M')}\n\n"
-        else:
-            text += "🆕 Нових заявок немає\n\n"
-
-        if processed_requests:
-            text += "✅ ОБРОБЛЕНІ ЗАЯВКИ:\n"
-            for request in processed_requests:
-                # Перевіряємо статус в Redis
-                status = get_tour_request_status(request.id) or 'end'
-
-                # Перевіряємо дані користувача в Redis
-                user = session.query(User).get(request.user_id)
-                user_data = get_user_data(str(user.telegram_id))
-                if not user_data:
-                    user_data = {
-                        'telegram_id': str(user.telegram_id),
-                        'phone_number': user.phone_number,
-                        'referral_code': user.referral_code,
-                        'referred_by': user.referred_by,
-                        'balance': user.balance,
-                        'is_admin': user.is_admin
-                    }
-                    set_user_data(str(user.telegram_id), user_data)
-
-                text += f"├── ID: {request.id}\n"
-                text += f"├── Клієнт: {user_data['phone_number']}\n"
-                text += f"├── Статус: {status}\n"
-                text += f"└── Створено: {request.created_at.strftime('%d.%m.%Y %H:%M')}\n\n"
-        else:
-            text += "✅ Оброблених заявок немає\n\n"
+    """Показати список заявок на тури посторінково з фільтрами за статусом та періодом
 
-        keyboard = []
-        for request in new_requests:
-            keyboard.append([InlineKeyboardButton(f"Заявка #{request.id}", callback_data=f"tour_request_{request.id}")])
+    callback_data: tl:<статус>:<період>[:<n|p>:<created_at>:<id>]
+    """
+    if not is_admin(context):
+        return
 
-        keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data="admin_tours")])
+    query = update.callback_query
+    parts = query.data.split(':', 4) if query.data.startswith('tl:') else []
+    status = parts[1] if len(parts) > 2 and parts[1] in TOUR_STATUSES else 'new'
+    period = parts[2] if len(parts) > 2 and parts[2] in TOUR_PERIODS else 'all'
+    cursor, forward = None, True
+    if len(parts) == 5:
+        forward = parts[3] == 'n'
+        created_at, request_id = parts[4].rsplit(':', 1)
+        cursor = (datetime.fromisoformat(created_at), int(request_id))
+
+    requests, has_newer, has_older = await get_tour_requests_page(status, period, cursor, forward)
+    counts = await count_tour_requests(period)
 
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.callback_query.edit_message_text(text, reply_markup=reply_markup)
+    text = (
+        "📋 ЗАЯВКИ НА ТУРИ\n\n"
+        f"🆕 Нових: {counts.get('new', 0)}\n"
+        f"✅ Оброблених: {counts.get('end', 0)}\n"
+        f"📅 Період: {TOUR_PERIODS[period][0]}\n\n"
+    )
+
+    if requests:
+        # Статуси з Redis (як у деталях заявки) одним MGET на всю сторінку
+        statuses = await get_many_tour_statuses([request.id for request in requests])
+        for request in requests:
+            text += f"├── ID: {request.id}\n"
+            text += f"├── Клієнт: {request.phone_number or 'Невідомий'}\n"
+            text += f"├── Статус: {statuses[request.id] or request.status}\n"
+            text += f"└── Створено: {request.created_at.strftime('%d.%m.%Y %H:%M')}\n\n"
+    else:
+        text += "Заявок не знайдено\n"
+
+    keyboard = [
+        [InlineKeyboardButton(f"Заявка #{request.id}", callback_data=f"tour_request_{request.id}")]
+        for request in requests
+    ]
+
+    navigation = []
+    if has_newer:
+        navigation.append(InlineKeyboardButton("◀️", callback_data=f"tl:{status}:{period}:p:{_tour_page_cursor(requests[0])}"))
+    if has_older:
+        navigation.append(InlineKeyboardButton("▶️", callback_data=f"tl:{status}:{period}:n:{_tour_page_cursor(requests[-1])}"))
+    if navigation:
+        keyboard.append(navigation)
+
+    keyboard.append([
+        InlineKeyboardButton(f"{'• ' if code == status else ''}{label}", callback_data=f"tl:{code}:{period}")
+        for code, label in TOUR_STATUSES.items()
+    ])
+    keyboard.append([
+        InlineKeyboardButton(f"{'• ' if code == period else ''}{label}", callback_data=f"tl:{status}:{code}")
+        for code, (label, _) in TOUR_PERIODS.items()
+    ])
+    keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data="admin_tours")])
+
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(text, reply_markup=reply_markup)
 
 
 async def show_tour_request_details(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показати деталі заявки на тур"""
     request_id = int(update.callback_query.data.split('_')[2])
 
-    with Session() as session:
-        request = session.query(TourRequest).get(request_id)
+    async with async_session() as session:
+        request = await session.get(TourRequest, request_id)
         if request:
-            # Перевіряємо дані користувача в Redis
-            user = session.query(User).get(request.user_id)
-            user_data = get_user_data(str(user.telegram_id))
-            if not user_data:
-                user_data = {
-                    'telegram_id': str(user.telegram_id),
-                    'phone_number': user.phone_number,
-                    'referral_code': user.referral_code,
-                    'referred_by': user.referred_by,
-                    'balance': user.balance,
-                    'is_admin': user.is_admin
-                }
-                set_user_data(str(user.telegram_id), user_data)
+            # Дані користувача в канонічному вигляді (без часткового запису в кеш)
+            user = await session.get(User, request.user_id)
+            user_data = UserRepository.serialize(user)
 
             # Перевіряємо статус в Redis
-            status = get_tour_request_status(request.id) or request.status
+            status = await get_tour_request_status(request.id) or request.status
 
             text = f"📋 ДЕТАЛІ ЗАЯВКИ #{request.id}\n\n"
             text += f"👤 Клієнт: {user_data['phone_number']}\n"
@@ -795,66 +721,43 @@ async def complete_tour_request(update: Update, context: ContextTypes.DEFAULT_TY
     """Завершити обробку заявки на тур"""
     request_id = int(update.callback_query.data.split('_')[2])
 
-    with Session() as session:
-        request = session.query(TourRequest).get(request_id)
+    async with async_session() as session:
+        request = await session.get(TourRequest, request_id)
         if request and request.status == 'new':
             request.status = 'end'
-            session.commit()
+            await session.commit()
 
             # Оновлюємо статус в Redis
-            set_tour_request_status(request_id, 'end')
-
-            # Перевіряємо дані користувача в Redis
-            user = session.query(User).get(request.user_id)
-            user_data = get_user_data(str(user.telegram_id))
-            if not user_data:
-                user_data = {
-                    'telegram_id': str(user.telegram_id),
-                    'phone_number': user.phone_number,
-                    'referral_code': user.referral_code,
-                    'referred_by': user.referred_by,
-                    'balance': user.balance,
-                    'is_admin': user.is_admin
-                }
-                set_user_data(str(user.telegram_id), user_data)
+            await set_tour_request_status(request_id, 'end')
 
             await show_tour_requests(update, context)
 
 
 async def show_bonus_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показ історії нарахувань користувача"""
-    if not is_admin(update.effective_user.id):
+    if not is_admin(context):
         return
 
     user_id = int(update.callback_query.data.split('_')[2]) 
     
-    with Session() as session:
-        user = session.query(User).get(user_id)
+    async with async_session() as session:
+        user = await session.get(User, user_id)
         if not user:
             await update.callback_query.message.edit_text("❌ Користувача не знайдено")
             return
 
-        # Перевіряємо дані користувача в Redis
-        user_data = get_user_data(str(user.telegram_id))
-        if not user_data:
-            user_data = {
-                'telegram_id': str(user.telegram_id),
-                'phone_number': user.phone_number,
-                'referral_code': user.referral_code,
-                'referred_by': user.referred_by,
-                'balance': user.balance,
-                'is_admin': user.is_admin
-            }
-            set_user_data(str(user.telegram_id), user_data)
+        user_data = UserRepository.serialize(user)
 
         # Отримуємо історію нарахувань
-        bonuses = session.query(ReferralBonus).filter_by(user_id=user_id).order_by(ReferralBonus.created_at.desc()).all()
+        bonuses = (await session.scalars(
+            select(ReferralBonus).filter_by(user_id=user_id).order_by(ReferralBonus.created_at.desc())
+        )).all()
 
         if bonuses:
             text = f"📊 ІСТОРІЯ НАРАХУВАНЬ\n\nКористувач: {user_data['phone_number']}\n\n"
             for bonus in bonuses:
                 text += (
-                    f"💰 {bonus.amount} грн\n"
+                    f"💰 {format_amount(bonus.amount)} грн\n"
                     f"📝 {bonus.description}\n"
                     f"📅 {bonus.created_at.strftime('%d.%m.%Y %H:%M')}\n"
                     "─────────────────\n"
@@ -873,7 +776,7 @@ async def show_bonus_history(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 async def show_tour_requests_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показ меню роботи з заявками"""
-    if not is_admin(update.effective_user.id):
+    if not is_admin(context):
         return
 
     keyboard = [
@@ -892,7 +795,7 @@ async def show_tour_requests_menu(update: Update, context: ContextTypes.DEFAULT_
 
 async def search_tour_request(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Початок процесу пошуку заявки"""
-    if not is_admin(update.effective_user.id):
+    if not is_admin(context):
         return
 
     text = "Введіть ID заявки для пошуку:\nДля скасування напишіть 'вийти'"
@@ -907,7 +810,7 @@ async def search_tour_request(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def handle_tour_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обробка пошуку заявки"""
-    if not is_admin(update.effective_user.id):
+    if not is_admin(context):
         return
 
     if not context.user_data.get('waiting_for_tour_search'):
@@ -922,10 +825,10 @@ async def handle_tour_search(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     try:
         request_id = int(identifier)
-        with Session() as session:
-            request = session.query(TourRequest).get(request_id)
+        async with async_session() as session:
+            request = await session.get(TourRequest, request_id)
             if request:
-                user = session.query(User).get(request.user_id)
+                user = await session.get(User, request.user_id)
                 text = (
                     f"🏖 ДЕТАЛІ ЗАЯВКИ #{request.id}\n\n"
                     f"👤 Користувач: {user.phone_number if user else 'Невідомий'}\n"
@@ -960,62 +863,47 @@ async def handle_tour_search(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 async def set_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Встановлення користувача як адміністратора"""
-    if not is_admin(update.effective_user.id):
+    if not is_admin(context):
         await update.message.reply_text("❌ У вас немає доступу до цієї команди!")
         return
 
     try:
         identifier = context.args[0]
-        with Session() as session:
+        async with async_session() as session:
             # Спробуємо знайти користувача за ID або телефоном
-            try:
-                user_id = int(identifier)
-                user = session.query(User).get(user_id) or session.query(User).filter_by(
-                    telegram_id=str(user_id)).first()
-            except ValueError:
-                pass
-            if not user:
-                user = session.query(User).filter_by(phone_number=str(user_id)).first()
+            user_data = await users.find(identifier)
+            user = await session.get(User, user_data['id']) if user_data else None
 
             if user:
                 user.is_admin = True
-                session.commit()
+                await session.commit()
 
                 # Оновлюємо дані в Redis
-                user_data = get_user_data(str(user.telegram_id))
-                if user_data:
-                    user_data['is_admin'] = True
-                    set_user_data(str(user.telegram_id), user_data)
+                await users.cache(user)
 
                 # Очищаємо кеш списку користувачів
-                clear_users_list_cache()
+                await clear_users_list_cache()
 
                 # Сповіщаємо нового адміністратора та оновлюємо його меню
-                try:
-                    keyboard = [
-                        [KeyboardButton("👥 Управління користувачами"), KeyboardButton("📋 Заявки на тури")],
-                        [KeyboardButton("💰 Нарахування балів")],
-                        [KeyboardButton("👤 Режим користувача")]
-                    ]
-                    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
-                    # Надсилаємо повідомлення новому адміністратору
-                    await context.bot.send_message(
-                        chat_id=user.telegram_id,
-                        text="🎉 Вітаємо! Ви тепер адміністратор системи!\n"
-                             "🛠 Адмін-панель активована. Використовуйте кнопки нижче для управління.",
-                        reply_markup=reply_markup
-                    )
-
-                    await update.message.reply_text(
-                        f"✅ Користувач {user.phone_number} тепер адміністратор\n"
-                        f"📨 Йому надіслано сповіщення про нові права"
-                    )
-                except Exception as e:
-                    await update.message.reply_text(
-                        f"✅ Користувач {user.phone_number} тепер адміністратор\n"
-                        f"⚠️ Не вдалося надіслати сповіщення (можливо, користувач заблокував бота)"
-                    )
+                keyboard = [
+                    [KeyboardButton("👥 Управління користувачами"), KeyboardButton("📋 Заявки на тури")],
+                    [KeyboardButton("💰 Нарахування балів"), KeyboardButton("📢 Розсилка")],
+                    [KeyboardButton("👤 Режим користувача")]
+                ]
+                reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+
+                # Надсилаємо повідомлення новому адміністратору
+                outbound.enqueue(
+                    user.telegram_id,
+                    "🎉 Вітаємо! Ви тепер адміністратор системи!\n"
+                    "🛠 Адмін-панель активована. Використовуйте кнопки нижче для управління.",
+                    reply_markup=reply_markup
+                )
+
+                await update.message.reply_text(
+                    f"✅ Користувач {user.phone_number} тепер адміністратор\n"
+                    f"📨 Сповіщення про нові права поставлено в чергу"
+                )
             else:
                 await update.message.reply_text("❌ Користувача не знайдено")
 
@@ -1027,62 +915,47 @@ async def set_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def remove_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Зняття прав адміністратора"""
-    if not is_admin(update.effective_user.id):
+    if not is_admin(context):
         await update.message.reply_text("❌ У вас немає доступу до цієї команди!")
         return
 
     try:
         identifier = context.args[0]
-        with Session() as session:
+        async with async_session() as session:
             # Спробуємо знайти користувача за ID або телефоном
-            try:
-                user_id = int(identifier)
-                user = session.query(User).get(user_id) or session.query(User).filter_by(
-                    telegram_id=str(user_id)).first()
-            except ValueError:
-                pass
-            if not user:
-                user = session.query(User).filter_by(phone_number=str(user_id)).first()
+            user_data = await users.find(identifier)
+            user = await session.get(User, user_data['id']) if user_data else None
 
             if user and user.is_admin:
                 user.is_admin = False
-                session.commit()
+                await session.commit()
 
                 # Оновлюємо дані в Redis
-                user_data = get_user_data(str(user.telegram_id))
-                if user_data:
-                    user_data['is_admin'] = False
-                    set_user_data(str(user.telegram_id), user_data)
+                await users.cache(user)
 
                 # Очищаємо кеш списку користувачів
-                clear_users_list_cache()
+                await clear_users_list_cache()
 
                 # Оновлюємо меню користувача на звичайне
-                try:
-                    keyboard = [
-                        [KeyboardButton("📊 Моя статистика")],
-                        [KeyboardButton("🔗 Моє посилання")],
-                        [KeyboardButton("🏖 Підбір туру")],
-                        [KeyboardButton("ℹ Про програму")],
-                        [KeyboardButton("📞 Контакти")]
-                    ]
-                    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
-                    await context.bot.send_message(
-                        chat_id=user.telegram_id,
-                        text="ℹ️ Ваші права адміністратора скасовані.\n"
-                             "Меню повернуто до звичайного режиму.",
-                        reply_markup=reply_markup
-                    )
-
-                    await update.message.reply_text(
-                        f"✅ У користувача {user.phone_number} скасовані права адміністратора"
-                    )
-                except Exception as e:
-                    await update.message.reply_text(
-                        f"✅ У користувача {user.phone_number} скасовані права адміністратора\n"
-                        f"⚠️ Не вдалося надіслати сповіщення (можливо, користувач заблокував бота)"
-                    )
+                keyboard = [
+                    [KeyboardButton("📊 Моя статистика")],
+                    [KeyboardButton("🔗 Моє посилання")],
+                    [KeyboardButton("🏖 Підбір туру")],
+                    [KeyboardButton("ℹ Про програму")],
+                    [KeyboardButton("📞 Контакти")]
+                ]
+                reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+
+                outbound.enqueue(
+                    user.telegram_id,
+                    "ℹ️ Ваші права адміністратора скасовані.\n"
+                    "Меню повернуто до звичайного режиму.",
+                    reply_markup=reply_markup
+                )
+
+                await update.message.reply_text(
+                    f"✅ У користувача {user.phone_number} скасовані права адміністратора"
+                )
             else:
                 await update.message.reply_text("❌ Користувача не знайдено або він не є адміністратором")
 
@@ -1092,105 +965,51 @@ async def remove_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(f"❌ Помилка: {str(e)}")
 
 
-def get_user_referrals(user_id: int, level: int = 1):
-    """Отримання рефералів користувача за рівнем"""
-    with Session() as session:
-        if level == 1:
-            # Прямі реферали
-            return session.query(User).filter_by(referred_by=user_id).all()
-        else:
-            # Отримуємо рефералів попереднього рівня
-            prev_level_referrals = get_user_referrals(user_id, level - 1)
-            if not prev_level_referrals:
-                return []
-            
-            # Отримуємо рефералів для кожного реферала попереднього рівня
-            current_level_referrals = []
-            for referral in prev_level_referrals:
-                current_level_referrals.extend(
-                    session.query(User).filter_by(referred_by=referral.id).all()
-                )
-            return current_level_referrals
+async def get_referral_bonus_stats(user_id: int):
+    """Отримання статистики бонусів від рефералів користувача
 
+    Один запит GROUP BY level за індексом (user_id, level): записи без рівня
+    (нарахування адміністратором, коригування) входять тільки в загальну суму
+    """
+    async with async_session() as session:
+        result = await session.execute(
+            select(ReferralBonus.level, func.sum(ReferralBonus.amount))
+            .where(ReferralBonus.user_id == user_id)
+            .group_by(ReferralBonus.level)
+        )
+        totals = {level: amount for level, amount in result}
 
-def get_referral_stats(user_id: int):
-    """Отримання статистики рефералів користувача"""
-    stats = {
-        'level_1': 0,
-        'level_2': 0,
-        'level_3': 0
+    return {
+        'level_1': totals.get(1, 0),
+        'level_2': totals.get(2, 0),
+        'level_3': totals.get(3, 0),
+        'total': sum(totals.values())
     }
-    
-    for level in range(1, 4):
-        referrals = get_user_referrals(user_id, level)
-        stats[f'level_{level}'] = len(referrals)
-    
-    return stats
-
-
-def get_referral_bonus_stats(user_id: int):
-    """Отримання статистики бонусів від рефералів користувача"""
-    with Session() as session:
-        # Отримуємо бонуси для рефералів 1-го рівня
-        first_level_bonuses = session.query(func.sum(ReferralBonus.amount)).filter(
-            ReferralBonus.user_id == user_id,
-            ReferralBonus.amount == 100
-        ).scalar() or 0
-
-        # Отримуємо бонуси для рефералів 2-го рівня
-        second_level_bonuses = session.query(func.sum(ReferralBonus.amount)).filter(
-            ReferralBonus.user_id == user_id,
-            ReferralBonus.description.like('%2-й рівень%')
-        ).scalar() or 0
-
-        # Отримуємо бонуси для рефералів 3-го рівня
-        third_level_bonuses = session.query(func.sum(ReferralBonus.amount)).filter(
-            ReferralBonus.user_id == user_id,
-            ReferralBonus.description.like('%3-й рівень%')
-        ).scalar() or 0
-
-        # Отримуємо загальну суму бонусів
-        total_bonuses = session.query(func.sum(ReferralBonus.amount)).filter(
-            ReferralBonus.user_id == user_id
-        ).scalar() or 0
-
-        stats = {
-            'level_1': first_level_bonuses,
-            'level_2': second_level_bonuses,
-            'level_3': third_level_bonuses,
-            'total': total_bonuses
-        }
-        return stats
 
 
 async def show_user_referrals(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показ рефералів користувача"""
-    if not is_admin(update.effective_user.id):
+    if not is_admin(context):
         return
 
     query = update.callback_query
     user_id = int(query.data.split('_')[2])  # Отримуємо ID користувача з callback_data
 
-    # Отримуємо статистику рефералів
-    stats = get_referral_stats(user_id)
-    bonus_stats = get_referral_bonus_stats(user_id)
-    
-    # Отримуємо всі бонуси для перевірки
-    with Session() as session:
-        all_bonuses = session.query(ReferralBonus).filter_by(user_id=user_id).all()
-        total_bonus_amount = sum(bonus.amount for bonus in all_bonuses)
-    
-    text = (
-        f"👥 РЕФЕРАЛИ КОРИСТУВАЧА (ID: {user_id})\n\n"
-        f"📊 Статистика:\n"
-        f"1️⃣ Рівень: {stats['level_1']} рефералів (Бонуси: {bonus_stats['level_1']} грн)\n"
-        f"2️⃣ Рівень: {stats['level_2']} рефералів (Бонуси: {bonus_stats['level_2']} грн)\n"
-        f"3️⃣ Рівень: {stats['level_3']} рефералів (Бонуси: {bonus_stats['level_3']} грн)\n"
-    )
+    # Отримуємо всіх рефералів до 3-го рівня та підсумки по рівнях
+    async with async_session() as session:
+        downline = await get_downline(session, user_id)
+        level_stats = await get_level_stats(session, user_id)
+    bonus_stats = await get_referral_bonus_stats(user_id)
+
+    text = f"👥 РЕФЕРАЛИ КОРИСТУВАЧА (ID: {user_id})\n\n📊 Статистика:\n"
+    for level, emoji in ((1, "1️⃣"), (2, "2️⃣"), (3, "3️⃣")):
+        text += (
+            f"{emoji} Рівень: {level_stats[level]['count']} рефералів, "
+            f"баланс {format_amount(level_stats[level]['balance'])} грн "
+            f"(Бонуси: {format_amount(bonus_stats[f'level_{level}'])} грн)\n"
+        )
 
-    # Отримуємо рефералів для кожного рівня
-    for level in range(1, 4):
-        referrals = get_user_referrals(user_id, level)
+    for level, referrals in downline.items():
         text += f"📊 Рівень {level}:\n"
         
         if referrals:
@@ -1198,7 +1017,7 @@ async def show_user_referrals(update: Update, context: ContextTypes.DEFAULT_TYPE
                 text += (
                     f"👤 ID: {ref.id}\n"
                     f"📱 Телефон: {ref.phone_number}\n"
-                    f"💰 Баланс: {ref.balance} грн\n"
+                    f"💰 Баланс: {format_amount(ref.balance)} грн\n"
                     f"📅 Дата реєстрації: {ref.created_at.strftime('%d.%m.%Y')}\n"
                     "─────────────────\n"
                 )
@@ -1216,29 +1035,34 @@ async def show_user_referrals(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def show_user_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показ інформації про користувача"""
-    if not is_admin(update.effective_user.id):
+    if not is_admin(context):
         return
 
     query = update.callback_query
     user_id = int(query.data.split('_')[2])  # Отримуємо ID користувача з callback_data
 
-    with Session() as session:
-        user = session.query(User).get(user_id)
+    async with async_session() as session:
+        user = await session.get(User, user_id)
         if not user:
             await query.message.edit_text("❌ Користувача не знайдено")
             return
 
         # Отримуємо актуальну статистику з БД
-        total_referrals = session.query(User).filter_by(referred_by=user.id).count()
-        total_bonuses = session.query(ReferralBonus).filter_by(user_id=user.id).count()
-        total_bonus_amount = session.query(ReferralBonus).filter_by(user_id=user.id).with_entities(
-            func.sum(ReferralBonus.amount)).scalar() or 0
+        total_referrals = await session.scalar(
+            select(func.count(User.id)).filter_by(referred_by=user.id)
+        )
+        total_bonuses = await session.scalar(
+            select(func.count(ReferralBonus.id)).filter_by(user_id=user.id)
+        )
+        total_bonus_amount = await session.scalar(
+            select(func.sum(ReferralBonus.amount)).filter_by(user_id=user.id)
+        ) or 0
 
         text = (
             f"👤 ІНФОРМАЦІЯ ПРО КОРИСТУВАЧА\n\n"
             f"🆔 ID: {user.id}\n"
             f"📱 Телефон: {user.phone_number}\n"
-            f"💰 Баланс: {user.balance} грн\n"
+            f"💰 Баланс: {format_amount(user.balance)} грн\n"
             f"🔗 Реферальний код: {user.referral_code}\n"
             f"📅 Дата реєстрації: {user.created_at.strftime('%d.%m.%Y')}\n"
             f"👥 Запрошено рефералів: {total_referrals}\n"
@@ -1256,4 +1080,90 @@ async def show_user_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
 
-        await query.message.edit_text(text, reply_markup=reply_markup)
\ No newline at end of file
+        await query.message.edit_text(text, reply_markup=reply_markup)
+
+
+async def start_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Початок створення розсилки всім користувачам"""
+    if not is_admin(context):
+        return
+
+    # Одночасно може виконуватись тільки одна розсилка
+    state = await get_broadcast()
+    if state.get('status') == 'running':
+        await update.message.reply_text(format_progress(state), reply_markup=progress_markup(state))
+        return
+
+    await update.message.reply_text(
+        "📢 Введіть текст повідомлення для всіх користувачів:\n"
+        "Для скасування напишіть 'вийти'"
+    )
+    context.user_data['waiting_for_broadcast_text'] = True
+
+
+async def handle_broadcast_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обробка тексту розсилки та запит підтвердження"""
+    if not is_admin(context):
+        return
+
+    text = update.message.text
+    context.user_data.pop('waiting_for_broadcast_text', None)
+
+    if text.lower() in ['вийти', 'exit', 'cancel', 'скасувати']:
+        await update.message.reply_text("❌ Розсилку скасовано")
+        return
+
+    context.user_data['broadcast_text'] = text
+
+    keyboard = [
+        [InlineKeyboardButton("✅ Надіслати", callback_data='broadcast_confirm')],
+        [InlineKeyboardButton("❌ Скасувати", callback_data='broadcast_discard')]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+
+    await update.message.reply_text(
+        f"📢 Надіслати це повідомлення всім користувачам?\n\n{text}",
+        reply_markup=reply_markup
+    )
+
+
+async def confirm_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Запуск підтвердженої розсилки"""
+    if not is_admin(context):
+        return
+
+    query = update.callback_query
+    text = context.user_data.pop('broadcast_text', None)
+    if not text:
+        await query.message.edit_text("❌ Текст розсилки не знайдено, почніть спочатку")
+        return
+
+    # Це повідомлення оновлюється прогресом під час розсилки
+    await query.message.edit_text("📢 Розсилка запускається...")
+    broadcast_id = await create_broadcast(text, query.message.chat_id, query.message.message_id)
+    if not broadcast_id:
+        await query.message.edit_text("❌ Інша розсилка ще триває")
+        return
+
+    start_broadcast_task(context.bot)
+
+
+async def discard_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Відмова від підготовленої розсилки"""
+    if not is_admin(context):
+        return
+
+    context.user_data.pop('broadcast_text', None)
+    await update.callback_query.message.edit_text("❌ Розсилку скасовано")
+
+
+async def stop_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Зупинка розсилки, що триває"""
+    if not is_admin(context):
+        return
+
+    query = update.callback_query
+    if await cancel_broadcast():
+        await query.message.edit_text("⛔ Розсилку зупиняємо...")
+    else:
+        await query.message.edit_text("ℹ️ Розсилка вже завершена")
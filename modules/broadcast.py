@@ -0,0 +1,300 @@
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime
+from dotenv import load_dotenv
+from sqlalchemy import select, func
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import Forbidden
+from redis.exceptions import RedisError
+from .models import async_session, User
+from .redis_client import redis_client
+from .outbound_queue import outbound
+
+# Завантаження змінних середовища
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Скільки отримувачів читається з курсора та ставиться в чергу за раз
+BROADCAST_BATCH = int(os.getenv('BROADCAST_BATCH', 100))
+# Скільки рядків читає один серверний курсор, після чого транзакція закривається
+# і читання продовжується з контрольної точки новим курсором
+BROADCAST_WINDOW = int(os.getenv('BROADCAST_WINDOW', 5000))
+# Як часто оновлювати повідомлення з прогресом, секунди
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv('BROADCAST_PROGRESS_INTERVAL', 5))
+
+BROADCAST_KEY = "broadcast:current"
+BROADCAST_LOCK_KEY = "broadcast:lock"
+# Якщо процес, що виконує розсилку, зупинився, інший продовжить її після цього часу
+BROADCAST_LOCK_TTL = 60
+# Блокування продовжується окремою задачею, незалежно від тривалості пачки
+BROADCAST_LOCK_RENEW_INTERVAL = BROADCAST_LOCK_TTL / 3
+BROADCAST_SUPERVISOR_INTERVAL = 30
+
+# Нова розсилка створюється тільки якщо попередня не триває
+CREATE_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'status') == 'running' then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], unpack(ARGV))
+return 1
+"""
+
+# Продовження та звільнення блокування - тільки власником
+RENEW_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_create = redis_client.register_script(CREATE_SCRIPT)
+_renew_lock = redis_client.register_script(RENEW_LOCK_SCRIPT)
+_release_lock = redis_client.register_script(RELEASE_LOCK_SCRIPT)
+
+_supervisor_task = None
+_run_tasks = set()
+# Розсилка вже виконується в цьому процесі
+_running = False
+
+
+def failed_key(broadcast_id: str) -> str:
+    return f"broadcast:{broadcast_id}:failed"
+
+
+def blocked_key(broadcast_id: str) -> str:
+    return f"broadcast:{broadcast_id}:blocked"
+
+
+async def get_broadcast() -> dict:
+    """Стан поточної (або останньої) розсилки"""
+    return await redis_client.hgetall(BROADCAST_KEY)
+
+
+async def create_broadcast(text: str, admin_chat_id: int, progress_message_id: int) -> str:
+    """Створити розсилку. None - якщо інша розсилка ще триває"""
+    async with async_session() as session:
+        total = await session.scalar(select(func.count(User.id)))
+
+    broadcast_id = uuid.uuid4().hex[:8]
+    state = {
+        'id': broadcast_id,
+        'text': text,
+        'status': 'running',
+        'admin_chat_id': admin_chat_id,
+        'progress_message_id': progress_message_id,
+        'total': total,
+        'last_user_id': 0,
+        'sent': 0,
+        'failed': 0,
+        'blocked': 0,
+        'started_at': datetime.utcnow().strftime('%d.%m.%Y %H:%M')
+    }
+    args = [item for pair in state.items() for item in pair]
+    if not await _create(keys=[BROADCAST_KEY], args=args):
+        return None
+    return broadcast_id
+
+
+async def cancel_broadcast() -> bool:
+    """Зупинити розсилку, що триває"""
+    state = await get_broadcast()
+    if state.get('status') != 'running':
+        return False
+    await redis_client.hset(BROADCAST_KEY, 'status', 'cancelled')
+    return True
+
+
+def format_progress(state: dict) -> str:
+    """Текст повідомлення з прогресом розсилки"""
+    statuses = {'running': '⏳ триває', 'done': '✅ завершено', 'cancelled': '⛔ зупинено'}
+    processed = int(state['sent']) + int(state['failed']) + int(state['blocked'])
+    return (
+        f"📢 РОЗСИЛКА\n\n"
+        f"├── Статус: {statuses.get(state['status'], state['status'])}\n"
+        f"├── Оброблено: {processed} з {state['total']}\n"
+        f"├── Надіслано: {state['sent']}\n"
+        f"├── Заблокували бота: {state['blocked']}\n"
+        f"├── Помилки: {state['failed']}\n"
+        f"└── Початок: {state['started_at']}"
+    )
+
+
+def progress_markup(state: dict) -> InlineKeyboardMarkup:
+    if state.get('status') != 'running':
+        return None
+    return InlineKeyboardMarkup([[InlineKeyboardButton("⛔ Зупинити розсилку", callback_data='broadcast_stop')]])
+
+
+async def _report(bot: Bot):
+    """Оновити повідомлення з прогресом у чаті адміністратора"""
+    state = await get_broadcast()
+    try:
+        await bot.edit_message_text(
+            chat_id=state['admin_chat_id'],
+            message_id=int(state['progress_message_id']),
+            text=format_progress(state),
+            reply_markup=progress_markup(state)
+        )
+    except Exception as e:
+        # Повідомлення не змінилось або видалене - на розсилку це не впливає
+        logger.debug(f"Не вдалося оновити прогрес розсилки: {e}")
+
+
+async def _run(bot: Bot, lock_lost: asyncio.Event):
+    """Розсилка з контрольної точки last_user_id
+
+    Отримувачі читаються серверним курсором у порядку id пачками по BROADCAST_BATCH.
+    Пачка ставиться в чергу вихідних повідомлень (вона ж обмежує швидкість), і тільки
+    після доставки всієї пачки контрольна точка та лічильники записуються в Redis.
+    Після перезапуску розсилка продовжується з наступного користувача; повторно
+    можуть отримати повідомлення лише отримувачі незавершеної пачки. Якщо блокування
+    втрачено (lock_lost), розсилка зупиняється після поточної пачки.
+    """
+    state = await get_broadcast()
+    broadcast_id = state['id']
+    text = state['text']
+    last_id = int(state['last_user_id'])
+    loop = asyncio.get_running_loop()
+    last_report = 0.0
+
+    while True:
+        window_rows = 0
+        async with async_session() as session:
+            result = await session.stream(
+                select(User.id, User.telegram_id)
+                .where(User.id > last_id)
+                .order_by(User.id)
+                .limit(BROADCAST_WINDOW)
+                .execution_options(yield_per=BROADCAST_BATCH)
+            )
+            async for batch in result.partitions():
+                if await redis_client.hget(BROADCAST_KEY, 'status') != 'running':
+                    await _report(bot)
+                    return
+
+                errors = await asyncio.gather(*(outbound.enqueue(row.telegram_id, text) for row in batch))
+                blocked = [row.telegram_id for row, error in zip(batch, errors) if isinstance(error, Forbidden)]
+                failed = [row.telegram_id for row, error in zip(batch, errors)
+                          if error is not None and not isinstance(error, Forbidden)]
+                last_id = batch[-1].id
+                window_rows += len(batch)
+
+                async with redis_client.pipeline(transaction=True) as pipe:
+                    pipe.hset(BROADCAST_KEY, 'last_user_id', last_id)
+                    pipe.hincrby(BROADCAST_KEY, 'sent', len(batch) - len(blocked) - len(failed))
+                    pipe.hincrby(BROADCAST_KEY, 'blocked', len(blocked))
+                    pipe.hincrby(BROADCAST_KEY, 'failed', len(failed))
+                    if blocked:
+                        pipe.sadd(blocked_key(broadcast_id), *blocked)
+                    if failed:
+                        pipe.sadd(failed_key(broadcast_id), *failed)
+                    await pipe.execute()
+
+                if lock_lost.is_set():
+                    logger.warning(f"Розсилку {broadcast_id} перехопив інший процес")
+                    return
+
+                if loop.time() - last_report >= BROADCAST_PROGRESS_INTERVAL:
+                    await _report(bot)
+                    last_report = loop.time()
+
+        if window_rows < BROADCAST_WINDOW:
+            break
+
+    await redis_client.hset(BROADCAST_KEY, 'status', 'done')
+    await _report(bot)
+    logger.info(f"Розсилку {broadcast_id} завершено")
+
+
+async def _hold_lock(token: str, lock_lost: asyncio.Event):
+    """Продовжувати блокування, поки виконується розсилка; при втраті - встановити lock_lost"""
+    while True:
+        await asyncio.sleep(BROADCAST_LOCK_RENEW_INTERVAL)
+        try:
+            renewed = await _renew_lock(keys=[BROADCAST_LOCK_KEY], args=[token, BROADCAST_LOCK_TTL])
+        except RedisError as e:
+            logger.warning(f"Не вдалося продовжити блокування розсилки: {e}")
+            continue
+        if not renewed:
+            lock_lost.set()
+            return
+
+
+async def run_pending_broadcast(bot: Bot) -> bool:
+    """Виконати незавершену розсилку, якщо її не виконує цей або інший процес
+
+    Кожне захоплення блокування має власний токен, тому розсилка, блокування якої
+    встигло закінчитися, не може продовжити чуже
+    """
+    global _running
+    if _running:
+        return False
+    _running = True
+    try:
+        if await redis_client.hget(BROADCAST_KEY, 'status') != 'running':
+            return False
+        token = uuid.uuid4().hex
+        if not await redis_client.set(BROADCAST_LOCK_KEY, token, nx=True, ex=BROADCAST_LOCK_TTL):
+            return False
+        lock_lost = asyncio.Event()
+        heartbeat = asyncio.create_task(_hold_lock(token, lock_lost))
+        try:
+            await _run(bot, lock_lost)
+        finally:
+            heartbeat.cancel()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+            await _release_lock(keys=[BROADCAST_LOCK_KEY], args=[token])
+        return True
+    finally:
+        _running = False
+
+
+async def _run_safely(bot: Bot):
+    try:
+        await run_pending_broadcast(bot)
+    except Exception as e:
+        logger.error(f"Помилка виконання розсилки: {e}")
+
+
+def start_broadcast_task(bot: Bot):
+    """Почати виконання щойно створеної розсилки у фоні"""
+    task = asyncio.create_task(_run_safely(bot))
+    _run_tasks.add(task)
+    task.add_done_callback(_run_tasks.discard)
+
+
+async def _supervise(bot: Bot):
+    """Підхоплює розсилку після перезапуску або зупинки процесу, що її виконував"""
+    while True:
+        await _run_safely(bot)
+        await asyncio.sleep(BROADCAST_SUPERVISOR_INTERVAL)
+
+
+def start_broadcast_supervisor(bot: Bot):
+    """Запустити фоновий нагляд за розсилками"""
+    global _supervisor_task
+    if _supervisor_task is None:
+        _supervisor_task = asyncio.create_task(_supervise(bot))
+
+
+async def stop_broadcast_supervisor():
+    """Зупинити нагляд та розсилку, що виконується (її продовжить наступний запуск)"""
+    global _supervisor_task
+    tasks = list(_run_tasks)
+    if _supervisor_task is not None:
+        tasks.append(_supervisor_task)
+        _supervisor_task = None
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from dotenv import load_dotenv
+from sqlalchemy import select, update, insert, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from .models import async_session, User, ReferralBonus, BalanceSnapshot
+
+# Завантаження змінних середовища
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Суми зберігаються в копійках (цілі числа)
+MINOR_UNITS = 100
+
+# Як часто знімати знімки балансів, секунди
+SNAPSHOT_INTERVAL = float(os.getenv('BALANCE_SNAPSHOT_INTERVAL', 3600))
+# Записи журналу молодші за цей час не потрапляють у знімок - їх транзакції
+# можуть бути ще не завершені, а знімок не повинен пропустити запис з меншим id
+SNAPSHOT_SAFETY_MARGIN = timedelta(minutes=5)
+# Скільки розбіжностей балансу з журналом виводити в лог за одну звірку
+DRIFT_REPORT_LIMIT = 100
+
+_snapshot_task = None
+
+
+def to_minor(amount) -> int:
+    """Сума в гривнях (число або рядок, кома чи крапка) -> копійки
+
+    ValueError - якщо це не число
+    """
+    try:
+        value = Decimal(str(amount).strip().replace(',', '.'))
+    except InvalidOperation:
+        raise ValueError(f"Некоректна сума: {amount}")
+    if not value.is_finite():
+        raise ValueError(f"Некоректна сума: {amount}")
+    return int((value * MINOR_UNITS).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def format_amount(minor: int) -> str:
+    """Копійки -> рядок для повідомлень: 100, 12.50"""
+    units, cents = divmod(abs(int(minor or 0)), MINOR_UNITS)
+    sign = '-' if minor and minor < 0 else ''
+    return f"{sign}{units}.{cents:02d}" if cents else f"{sign}{units}"
+
+
+async def _apply(session: AsyncSession, user_id: int, amount: int, description: str, condition=None) -> int:
+    """Змінити баланс одним умовним UPDATE ... RETURNING та додати запис у журнал
+
+    Перевірка умови та зміна балансу виконуються одним оператором, тому паралельні
+    зміни не можуть обидві пройти перевірку, а рядок блокується лише на час UPDATE
+    """
+    statement = update(User).where(User.id == user_id)
+    if condition is not None:
+        statement = statement.where(condition)
+    balance = await session.scalar(
+        statement
+        .values(balance=User.balance + amount)
+        .returning(User.balance)
+        .execution_options(synchronize_session=False)
+    )
+    if balance is None:
+        return None
+    await session.execute(insert(ReferralBonus).values(user_id=user_id, amount=amount, description=description))
+    return balance
+
+
+async def credit(session: AsyncSession, user_id: int, amount: int, description: str) -> int:
+    """Нарахувати amount копійок
+
+    Повертає новий баланс або None, якщо користувача немає. Коміт - на стороні викликача.
+    """
+    return await _apply(session, user_id, amount, description)
+
+
+async def debit(session: AsyncSession, user_id: int, amount: int, description: str) -> int:
+    """Списати amount копійок, тільки якщо їх достатньо (WHERE balance >= amount)
+
+    Повертає новий баланс або None, якщо коштів недостатньо або користувача немає.
+    Коміт - на стороні викликача.
+    """
+    return await _apply(session, user_id, -amount, description, User.balance >= amount)
+
+
+async def record_entries(session: AsyncSession, entries: list):
+    """Записати в журнал кілька змін, баланси яких вже змінено одним UPDATE ... RETURNING
+
+    entries - [{'user_id', 'amount', 'description', ...}] (kind, level, source_user_id - за потреби)
+    """
+    if entries:
+        await session.execute(insert(ReferralBonus), entries)
+
+
+async def get_balance(session: AsyncSession, user_id: int) -> int:
+    """Поточний баланс - один рядок users, незалежно від довжини історії"""
+    return await session.scalar(select(User.balance).where(User.id == user_id))
+
+
+def _latest_snapshots():
+    """Останній знімок кожного користувача"""
+    return (
+        select(BalanceSnapshot.user_id, BalanceSnapshot.last_entry_id, BalanceSnapshot.balance)
+        .distinct(BalanceSnapshot.user_id)
+        .order_by(BalanceSnapshot.user_id, BalanceSnapshot.last_entry_id.desc())
+        .subquery()
+    )
+
+
+async def take_snapshots() -> int:
+    """Зняти знімки балансів для всіх користувачів з новими записами - одним INSERT ... SELECT"""
+    latest = _latest_snapshots()
+    cutoff = datetime.utcnow() - SNAPSHOT_SAFETY_MARGIN
+    new_entries = (
+        select(
+            ReferralBonus.user_id,
+            func.max(ReferralBonus.id),
+            func.coalesce(latest.c.balance, 0) + func.sum(ReferralBonus.amount),
+        )
+        .outerjoin(latest, latest.c.user_id == ReferralBonus.user_id)
+        .where(
+            ReferralBonus.id > func.coalesce(latest.c.last_entry_id, 0),
+            ReferralBonus.created_at < cutoff
+        )
+        .group_by(ReferralBonus.user_id, latest.c.balance)
+    )
+    statement = (
+        pg_insert(BalanceSnapshot)
+        .from_select(['user_id', 'last_entry_id', 'balance'], new_entries)
+        .on_conflict_do_nothing(index_elements=['user_id', 'last_entry_id'])
+    )
+    async with async_session() as session:
+        result = await session.execute(statement)
+        await session.commit()
+    return result.rowcount
+
+
+async def find_balance_drift(limit: int = DRIFT_REPORT_LIMIT) -> list:
+    """Користувачі, у яких users.balance не збігається з балансом за журналом
+
+    Баланс за журналом - останній знімок плюс записи після нього, тому запит читає
+    тільки записи, що накопичились з попередніх знімків, а не всю історію.
+    Баланс і запис журналу змінюються в одній транзакції, тож будь-яка розбіжність -
+    це зміна балансу в обхід журналу.
+    Повертає [(user_id, users.balance, баланс за журналом)]
+    """
+    latest = _latest_snapshots()
+    tail = (
+        select(ReferralBonus.user_id, func.sum(ReferralBonus.amount).label('total'))
+        .outerjoin(latest, latest.c.user_id == ReferralBonus.user_id)
+        .where(ReferralBonus.id > func.coalesce(latest.c.last_entry_id, 0))
+        .group_by(ReferralBonus.user_id)
+        .subquery()
+    )
+    ledger = func.coalesce(latest.c.balance, 0) + func.coalesce(tail.c.total, 0)
+    async with async_session() as session:
+        result = await session.execute(
+            select(User.id, User.balance, ledger)
+            .outerjoin(latest, latest.c.user_id == User.id)
+            .outerjoin(tail, tail.c.user_id == User.id)
+            .where(User.balance != ledger)
+            .order_by(User.id)
+            .limit(limit)
+        )
+        return [tuple(row) for row in result]
+
+
+async def _snapshot_periodically():
+    """Знімки балансів, після них - звірка users.balance з журналом"""
+    while True:
+        await asyncio.sleep(SNAPSHOT_INTERVAL)
+        try:
+            created = await take_snapshots()
+            logger.info(f"Знято знімків балансу: {created}")
+            drift = await find_balance_drift()
+            if drift:
+                logger.error(
+                    f"Баланс не збігається з журналом у {len(drift)} користувачів "
+                    f"(user_id, баланс, за журналом): {drift}"
+                )
+        except Exception as e:
+            logger.error(f"Помилка зняття знімків балансу: {e}")
+
+
+def start_snapshotter():
+    """Запустити періодичне зняття знімків балансу та звірку з журналом"""
+    global _snapshot_task
+    if _snapshot_task is None:
+        _snapshot_task = asyncio.create_task(_snapshot_periodically())
+
+
+async def stop_snapshotter():
+    """Зупинити періодичне зняття знімків балансу"""
+    global _snapshot_task
+    if _snapshot_task is not None:
+        _snapshot_task.cancel()
+        try:
+            await _snapshot_task
+        except asyncio.CancelledError:
+            pass
+        _snapshot_task = None
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from dotenv import load_dotenv
+from redis.exceptions import ConnectionError as RedisConnectionError
+from .redis_client import redis_client
+
+# Завантаження змінних середовища
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+LOCAL_CACHE_SIZE = int(os.getenv('LOCAL_CACHE_SIZE', 10000))
+LOCAL_CACHE_TTL = float(os.getenv('LOCAL_CACHE_TTL', 30))
+
+# Канал Redis, через який процеси бота повідомляють один одного про зміни
+INVALIDATION_CHANNEL = "cache:invalidate"
+# Ідентифікатор процесу - власні повідомлення про інвалідацію ігноруються
+INSTANCE_ID = uuid.uuid4().hex
+
+# Зареєстровані кеші процесу за назвою
+_caches = {}
+_listener_task = None
+
+
+class LocalCache:
+    """Обмежений LRU-кеш з TTL в пам'яті процесу (L1 перед Redis)"""
+
+    def __init__(self, name: str, maxsize: int = LOCAL_CACHE_SIZE, ttl: float = LOCAL_CACHE_TTL):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        _caches[name] = self
+
+    def get(self, key):
+        """Отримати значення або None, якщо його немає чи термін дії минув"""
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key, value):
+        """Зберегти значення, витісняючи найдавніше використане при переповненні"""
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        """Видалити ключі з кешу"""
+        for key in keys:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Очистити кеш повністю"""
+        self._data.clear()
+
+    def stats(self) -> dict:
+        """Лічильники влучань/промахів"""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+
+def get_cache_stats() -> dict:
+    """Статистика всіх локальних кешів процесу"""
+    return {name: cache.stats() for name, cache in _caches.items()}
+
+
+async def publish_invalidation(cache_name: str, keys: list):
+    """Повідомити інші процеси, що ключі кешу застаріли
+
+    Ключі передаються в JSON без перетворення, тому слухач отримує їх того ж типу,
+    що й ключі локального кешу (Telegram ID - цілі числа)
+    """
+    if not keys:
+        return
+    message = {'origin': INSTANCE_ID, 'cache': cache_name, 'keys': list(keys)}
+    await redis_client.publish(INVALIDATION_CHANNEL, json.dumps(message))
+
+
+def _apply_invalidation(payload: dict):
+    """Видалити з локального кешу ключі, які змінив інший процес"""
+    if payload['origin'] == INSTANCE_ID:
+        return
+    cache = _caches.get(payload['cache'])
+    if cache:
+        cache.delete(*payload['keys'])
+
+
+async def _listen_for_invalidations():
+    """Слухає канал інвалідації та видаляє застарілі ключі з локальних кешів"""
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    try:
+        while True:
+            try:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                async for message in pubsub.listen():
+                    _apply_invalidation(json.loads(message['data']))
+            except RedisConnectionError as e:
+                # Повідомлення під час розриву з'єднання втрачено - скидаємо все
+                logger.warning(f"Втрачено з'єднання з каналом інвалідації: {e}")
+                for cache in _caches.values():
+                    cache.clear()
+                await asyncio.sleep(1)
+    finally:
+        await pubsub.aclose()
+
+
+def start_invalidation_listener():
+    """Запустити фонового слухача каналу інвалідації"""
+    global _listener_task
+    if _listener_task is None:
+        _listener_task = asyncio.create_task(_listen_for_invalidations())
+
+
+async def stop_invalidation_listener():
+    """Зупинити фонового слухача каналу інвалідації"""
+    global _listener_task
+    if _listener_task is not None:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except asyncio.CancelledError:
+            pass
+        _listener_task = None
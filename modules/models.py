@@ -1,6 +1,7 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Text, BigInteger
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, BigInteger, Index, UniqueConstraint
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import relationship
 from datetime import datetime
 import os
 from dotenv import load_dotenv
@@ -15,12 +16,16 @@ DB_HOST = os.getenv('DB_HOST', 'localhost')
 DB_PORT = os.getenv('DB_PORT', '5432')
 DB_NAME = os.getenv('DB_NAME', 'referral_bot')
 
-# Створення URL для підключення до PostgreSQL
+# Конфігурація міграцій (Alembic) у корені проекту
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'alembic.ini')
+
+# Створення URL для підключення до PostgreSQL (синхронний - для міграцій, migrations/env.py)
 DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+ASYNC_DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
-# Створення двигуна SQLAlchemy з налаштуваннями для PostgreSQL
-engine = create_engine(
-    DATABASE_URL,
+# Асинхронний двигун для обробників бота - запити не блокують event loop
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
     pool_size=20,  # Розмір пулу з'єднань
     max_overflow=10,  # Максимальна кількість додаткових з'єднань
     pool_timeout=30,  # Таймаут очікування з'єднання
@@ -31,39 +36,99 @@ engine = create_engine(
 # Створення базового класу для моделей
 Base = declarative_base()
 
-# Створення фабрики сесій
-Session = sessionmaker(bind=engine)
+# Фабрика асинхронних сесій. expire_on_commit=False - атрибути об'єктів
+# доступні після commit без повторного (неявного) запиту до БД
+async_session = async_sessionmaker(async_engine, expire_on_commit=False)
 
 # Моделі
 class User(Base):
     __tablename__ = 'users'
 
     id = Column(Integer, primary_key=True)
-    telegram_id = Column(String, unique=True, nullable=False)
-    phone_number = Column(String, nullable=False)
+    telegram_id = Column(BigInteger, unique=True, nullable=False)
+    phone_number = Column(String, nullable=False, index=True)
     referral_code = Column(String, unique=True)
-    referred_by = Column(Integer, ForeignKey('users.id'), nullable=True)
-    balance = Column(Float, default=0.0)
+    referred_by = Column(Integer, ForeignKey('users.id'), nullable=True, index=True)
+    # Баланс в копійках. Змінюється тільки разом із записом у журналі (ledger.credit / ledger.debit)
+    balance = Column(BigInteger, default=0, nullable=False)
     is_admin = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     # Зв'язки
     referrals = relationship('User', backref='referrer', remote_side=[id])
-    bonuses = relationship('ReferralBonus', back_populates='user')
+    bonuses = relationship('ReferralBonus', back_populates='user', foreign_keys='ReferralBonus.user_id')
     tour_requests = relationship('TourRequest', back_populates='user')
 
+    __table_args__ = (
+        # Список користувачів за балансом та датою реєстрації: пагінація за ключем (значення, id)
+        Index('ix_users_balance_id', 'balance', 'id'),
+        Index('ix_users_created_id', 'created_at', 'id'),
+    )
+
+
+class ReferralClosure(Base):
+    """Таблиця замикання реферального дерева: всі пари (предок, нащадок)
+
+    Кожен користувач має рядок сам на себе з depth=0, пряме запрошення - depth=1 і т.д.
+    """
+    __tablename__ = 'referral_closure'
+
+    ancestor_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    descendant_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    depth = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        # Кількість рефералів по рівнях: WHERE ancestor_id = ? GROUP BY depth
+        Index('ix_referral_closure_ancestor_depth', 'ancestor_id', 'depth'),
+        # Ланцюжок запрошувачів: WHERE descendant_id = ?
+        Index('ix_referral_closure_descendant', 'descendant_id', 'depth'),
+    )
+
 
 class ReferralBonus(Base):
+    """Журнал змін балансу (тільки додавання): нарахування > 0, списання < 0, в копійках
+
+    kind: referral - реферальний бонус (level - рівень, source_user_id - запрошений
+    користувач), manual - нарахування або списання адміністратором, adjustment - коригування
+    """
     __tablename__ = 'referral_bonuses'
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
-    amount = Column(Float)
+    amount = Column(BigInteger, nullable=False)
+    kind = Column(String(20), nullable=False, default='manual', server_default='manual')
+    level = Column(Integer, nullable=True)
+    source_user_id = Column(Integer, ForeignKey('users.id'), nullable=True)
     description = Column(String(200))
     created_at = Column(DateTime, default=datetime.utcnow)
 
     # Зв'язки
-    user = relationship('User', back_populates='bonuses')
+    user = relationship('User', back_populates='bonuses', foreign_keys=[user_id])
+
+    __table_args__ = (
+        # Історія нарахувань користувача: WHERE user_id = ? ORDER BY created_at DESC
+        Index('ix_referral_bonuses_user_created', 'user_id', 'created_at'),
+        # Суми бонусів за рівнями: WHERE user_id = ? GROUP BY level (тільки за індексом)
+        Index('ix_referral_bonuses_user_level', 'user_id', 'level', postgresql_include=['amount']),
+    )
+
+
+class BalanceSnapshot(Base):
+    """Знімок балансу користувача після запису журналу last_entry_id
+
+    Баланс за журналом = останній знімок + записи з id > last_entry_id
+    """
+    __tablename__ = 'balance_snapshots'
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    last_entry_id = Column(Integer, nullable=False)
+    balance = Column(BigInteger, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'last_entry_id', name='uq_balance_snapshots_user_entry'),
+    )
 
 
 class TourRequest(Base):
@@ -79,7 +144,16 @@ class TourRequest(Base):
     # Зв'язки
     user = relationship('User', back_populates='tour_requests')
 
+    __table_args__ = (
+        # Список заявок з фільтром за статусом та періодом
+        Index('ix_tour_requests_status_created', 'status', 'created_at'),
+    )
 
-# Створення таблиць
+
+# Створення та оновлення таблиць - міграціями до останньої версії
 def init_db():
-    Base.metadata.create_all(engine) 
\ No newline at end of file
+    # Alembic потрібен тільки службовим скриптам, процеси бота його не імпортують
+    from alembic import command
+    from alembic.config import Config
+
+    command.upgrade(Config(ALEMBIC_INI), 'head')
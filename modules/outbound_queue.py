@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import os
+from collections import deque
+from dotenv import load_dotenv
+from telegram import Bot
+from telegram.error import RetryAfter, Forbidden, BadRequest, NetworkError
+
+# Завантаження змінних середовища
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Загальний ліміт відправки повідомлень процесом, повідомлень на секунду. Ліміт діє
+# в межах одного процесу: при кількох обробниках сумарна швидкість - ліміт * кількість
+OUTBOUND_RATE_LIMIT = float(os.getenv('OUTBOUND_RATE_LIMIT', 30))
+# Мінімальний інтервал між повідомленнями в один чат, секунди
+OUTBOUND_CHAT_INTERVAL = float(os.getenv('OUTBOUND_CHAT_INTERVAL', 1))
+# Скільки разів повторювати відправку при мережевих помилках
+OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', 5))
+# Кількість одночасних відправок
+OUTBOUND_SENDERS = int(os.getenv('OUTBOUND_SENDERS', 8))
+
+
+class _Message:
+    __slots__ = ('chat_id', 'text', 'kwargs', 'future', 'attempts')
+
+    def __init__(self, chat_id, text: str, kwargs: dict, future: asyncio.Future):
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.future = future
+        self.attempts = 0
+
+
+class OutboundQueue:
+    """Фонова черга вихідних повідомлень з обмеженням швидкості
+
+    Обробники тільки ставлять повідомлення в чергу (enqueue) і одразу повертаються.
+    Відправники дотримуються загального для процесу ліміту та інтервалу між повідомленнями
+    в один чат, при 429 зупиняють всю відправку на retry_after, а при мережевих помилках
+    повторюють відправку з експоненційною затримкою. Повідомлення одного чату йдуть по порядку:
+    чат одночасно обробляє не більше одного відправника.
+    """
+
+    def __init__(self, rate_limit: float = OUTBOUND_RATE_LIMIT, chat_interval: float = OUTBOUND_CHAT_INTERVAL,
+                 max_retries: int = OUTBOUND_MAX_RETRIES, senders: int = OUTBOUND_SENDERS):
+        self.interval = 1 / rate_limit
+        self.chat_interval = chat_interval
+        self.max_retries = max_retries
+        self.senders = senders
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self._bot = None
+        self._tasks = []
+        # chat_id -> черга повідомлень; чат є в словнику, поки в нього є що відправляти
+        self._chats = {}
+        self._ready = None
+        self._pending = 0
+        self._idle = None
+        self._next_slot = 0.0
+
+    def start(self, bot: Bot):
+        """Запустити відправників"""
+        self._bot = bot
+        self._ready = asyncio.Queue()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks = [asyncio.create_task(self._sender()) for _ in range(self.senders)]
+
+    async def stop(self, timeout: float = 5):
+        """Дочекатися відправки залишку черги (не довше timeout) та зупинити відправників"""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Зупинка з {self._pending} невідправленими повідомленнями")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def enqueue(self, chat_id, text: str, **kwargs) -> asyncio.Future:
+        """Поставити повідомлення в чергу
+
+        Future завершується значенням None, якщо повідомлення доставлено, або помилкою доставки
+        """
+        future = asyncio.get_running_loop().create_future()
+        message = _Message(chat_id, text, kwargs, future)
+        self._pending += 1
+        self._idle.clear()
+        messages = self._chats.get(chat_id)
+        if messages is None:
+            self._chats[chat_id] = deque([message])
+            self._ready.put_nowait(chat_id)
+        else:
+            messages.append(message)
+        return future
+
+    @property
+    def depth(self) -> int:
+        """Кількість повідомлень, що чекають на відправку"""
+        return self._pending
+
+    def stats(self) -> dict:
+        return {
+            'depth': self._pending,
+            'chats': len(self._chats),
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried
+        }
+
+    def _schedule(self, chat_id, delay: float):
+        """Повернути чат в чергу готових через delay секунд"""
+        if delay <= 0:
+            self._ready.put_nowait(chat_id)
+        else:
+            asyncio.get_running_loop().call_later(delay, self._ready.put_nowait, chat_id)
+
+    async def _acquire_slot(self):
+        """Загальний ліміт: рівномірно розподілені слоти відправки"""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def _finish(self, message: _Message, error: Exception = None):
+        if error is None:
+            self.sent += 1
+        else:
+            self.failed += 1
+        if not message.future.done():
+            message.future.set_result(error)
+        self._pending -= 1
+        if self._pending == 0:
+            self._idle.set()
+
+    async def _sender(self):
+        while True:
+            chat_id = await self._ready.get()
+            messages = self._chats[chat_id]
+            message = messages[0]
+            await self._acquire_slot()
+
+            delay = self.chat_interval
+            try:
+                await self._bot.send_message(chat_id=message.chat_id, text=message.text, **message.kwargs)
+                messages.popleft()
+                self._finish(message)
+            except RetryAfter as e:
+                # Telegram сам каже, скільки чекати - повідомлення залишається першим.
+                # Обмеження діє на весь бот, тому пауза стосується всіх відправників
+                self.retried += 1
+                delay = float(e.retry_after)
+                self._next_slot = max(self._next_slot, asyncio.get_running_loop().time() + delay)
+            except (Forbidden, BadRequest) as e:
+                # Користувач заблокував бота або чат недоступний - повтор не допоможе
+                logger.warning(f"Повідомлення в чат {chat_id} не доставлено: {e}")
+                messages.popleft()
+                self._finish(message, e)
+            except NetworkError as e:
+                message.attempts += 1
+                if message.attempts > self.max_retries:
+                    logger.error(f"Повідомлення в чат {chat_id} не доставлено після {message.attempts} спроб: {e}")
+                    messages.popleft()
+                    self._finish(message, e)
+                else:
+                    self.retried += 1
+                    delay = min(2 ** message.attempts, 60)
+            except Exception as e:
+                logger.error(f"Помилка відправки повідомлення в чат {chat_id}: {e}")
+                messages.popleft()
+                self._finish(message, e)
+
+            if messages:
+                self._schedule(chat_id, delay)
+            else:
+                del self._chats[chat_id]
+
+
+outbound = OutboundQueue()
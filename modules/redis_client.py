@@ -1,4 +1,4 @@
-import redis
+import redis.asyncio as redis
 import json
 from datetime import datetime, timedelta
 import os
@@ -12,144 +12,253 @@ REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
 REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
 REDIS_DB = int(os.getenv('REDIS_DB', 0))
 REDIS_PASSWORD = os.getenv('REDIS_PASSWORD', None)
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 50))
+# Максимальна кількість ключів в одному MGET / pipeline пакетних функцій та UNLINK при очищенні кешу
+REDIS_BATCH_SIZE = int(os.getenv('REDIS_BATCH_SIZE', 500))
 
-# Створення клієнта Redis
-redis_client = redis.Redis(
+# Спільний пул з'єднань для всіх обробників. При вичерпанні пулу запит
+# чекає на вільне з'єднання замість помилки "Too many connections"
+redis_pool = redis.BlockingConnectionPool(
     host=REDIS_HOST,
     port=REDIS_PORT,
     db=REDIS_DB,
     password=REDIS_PASSWORD,
+    max_connections=REDIS_MAX_CONNECTIONS,
+    timeout=5,
     decode_responses=True  # Автоматично декодуємо відповіді в рядки
 )
 
+# Створення асинхронного клієнта Redis
+redis_client = redis.Redis(connection_pool=redis_pool)
 
-def set_user_data(user_id: str, data: dict, expire_seconds: int = 3600):
+
+def _chunks(items: list, size: int = REDIS_BATCH_SIZE):
+    """Розбити список ключів на пакети, щоб не блокувати Redis одною великою командою"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+async def _mget(keys: list) -> list:
+    """MGET пакетами - один запит на REDIS_BATCH_SIZE ключів"""
+    values = []
+    for chunk in _chunks(keys):
+        values.extend(await redis_client.mget(chunk))
+    return values
+
+
+async def set_user_data(user_id: int, data: dict, expire_seconds: int = 3600):
     """Зберігає дані користувача в Redis"""
     key = f"user:{user_id}"
-    redis_client.setex(key, expire_seconds, json.dumps(data))
+    await redis_client.setex(key, expire_seconds, json.dumps(data))
 
 
-def get_user_data(user_id: str) -> dict:
+async def get_user_data(user_id: int) -> dict:
     """Отримує дані користувача з Redis"""
     key = f"user:{user_id}"
-    data = redis_client.get(key)
+    data = await redis_client.get(key)
     return json.loads(data) if data else {}
 
 
-def delete_user_data(user_id: str):
-    """Видаляє дані користувача з Redis"""
-    key = f"user:{user_id}"
-    redis_client.delete(key)
+async def get_many_user_data(user_ids: list) -> dict:
+    """Отримує дані кількох користувачів ({user_id: дані}, відсутні в кеші пропускаються)"""
+    values = await _mget([f"user:{user_id}" for user_id in user_ids])
+    return {user_id: json.loads(data) for user_id, data in zip(user_ids, values) if data}
 
 
-def set_referral_code(code: str, user_id: str, expire_seconds: int = 86400):
-    """Зберігає реферальний код в Redis"""
-    key = f"referral:{code}"
-    redis_client.setex(key, expire_seconds, user_id)
+async def set_many_user_data(users_data: dict, expire_seconds: int = 3600):
+    """Зберігає дані кількох користувачів pipeline-ами ({user_id: дані})"""
+    items = list(users_data.items())
+    for chunk in _chunks(items):
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for user_id, data in chunk:
+                pipe.setex(f"user:{user_id}", expire_seconds, json.dumps(data))
+            await pipe.execute()
 
 
-def get_referral_user_id(code: str) -> str:
-    """Отримує ID користувача за реферальним кодом"""
-    key = f"referral:{code}"
-    return redis_client.get(key)
+async def delete_user_data(user_id: str):
+    """Видаляє дані користувача з Redis"""
+    key = f"user:{user_id}"
+    await redis_client.delete(key)
 
 
-def increment_user_balance(user_id: str, amount: float):
-    """Збільшує баланс користувача в Redis"""
-    key = f"balance:{user_id}"
-    redis_client.incrbyfloat(key, amount)
+async def delete_users_data(user_ids: list):
+    """Видаляє дані кількох користувачів з Redis одним запитом"""
+    if user_ids:
+        await redis_client.delete(*[f"user:{user_id}" for user_id in user_ids])
 
 
-def decrement_user_balance(user_id: str, amount: float):
-    """Зменшує баланс користувача в Redis"""
-    key = f"balance:{user_id}"
-    redis_client.incrbyfloat(key, -amount)
+async def set_referral_code(code: str, user_id: int, expire_seconds: int = 86400):
+    """Зберігає реферальний код в Redis"""
+    key = f"referral:{code}"
+    await redis_client.setex(key, expire_seconds, user_id)
 
 
-def get_user_balance(user_id: str) -> float:
-    """Отримує баланс користувача з Redis"""
-    key = f"balance:{user_id}"
-    balance = redis_client.get(key)
-    return float(balance) if balance else 0.0
+async def get_referral_user_id(code: str) -> str:
+    """Отримує ID користувача за реферальним кодом"""
+    key = f"referral:{code}"
+    return await redis_client.get(key)
 
 
-def set_tour_request_status(request_id: int, status: str):
+async def set_tour_request_status(request_id: int, status: str):
     """Зберігає статус заявки на тур в Redis"""
     key = f"tour_request:{request_id}"
-    redis_client.set(key, status)
+    await redis_client.set(key, status)
 
 
-def get_tour_request_status(request_id: int) -> str:
+async def get_tour_request_status(request_id: int) -> str:
     """Отримує статус заявки на тур з Redis"""
     key = f"tour_request:{request_id}"
-    return redis_client.get(key)
+    return await redis_client.get(key)
+
 
+async def get_many_tour_statuses(request_ids: list) -> dict:
+    """Отримує статуси кількох заявок ({request_id: статус}, відсутні - None)"""
+    values = await _mget([f"tour_request:{request_id}" for request_id in request_ids])
+    return dict(zip(request_ids, values))
 
-def add_to_recent_requests(request_id: int, user_id: str):
+
+async def add_to_recent_requests(request_id: int, user_id: int):
     """Додає заявку до списку останніх заявок користувача"""
     key = f"recent_requests:{user_id}"
-    redis_client.lpush(key, str(request_id))
-    redis_client.ltrim(key, 0, 9)  # Зберігаємо тільки 10 останніх заявок
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.lpush(key, str(request_id))
+        pipe.ltrim(key, 0, 9)  # Зберігаємо тільки 10 останніх заявок
+        await pipe.execute()
 
 
-def get_recent_requests(user_id: str) -> list:
+async def get_recent_requests(user_id: int) -> list:
     """Отримує список останніх заявок користувача"""
     key = f"recent_requests:{user_id}"
-    return redis_client.lrange(key, 0, -1)
+    return await redis_client.lrange(key, 0, -1)
 
 
-def set_user_session(user_id: str, session_data: dict, expire_seconds: int = 3600):
-    """Зберігає дані сесії користувача"""
-    key = f"session:{user_id}"
-    redis_client.setex(key, expire_seconds, json.dumps(session_data))
+# Поточне покоління простору імен кешу: ключі мають вигляд <простір>:g<покоління>:<ключ>
+CACHE_GENERATION_KEY = "cache_gen:{}"
+USERS_LIST_NAMESPACE = "users_list"
 
 
-def get_user_session(user_id: str) -> dict:
-    """Отримує дані сесії користувача"""
-    key = f"session:{user_id}"
-    data = redis_client.get(key)
-    return json.loads(data) if data else {}
+async def get_namespaced(namespace: str, key: str) -> tuple:
+    """Значення з поточного покоління простору імен: (покоління, значення або None)
 
+    Два GET: ім'я ключа значення залежить від покоління, а скрипт Lua не може
+    звертатися до ключів, не переданих у KEYS (і ламається в Redis Cluster).
+    Покоління потрібно передати в set_namespaced - якщо простір інвалідували між
+    читанням та записом, застаріле значення потрапить у старе покоління
+    """
+    generation = int(await redis_client.get(CACHE_GENERATION_KEY.format(namespace)) or 0)
+    value = await redis_client.get(f"{namespace}:g{generation}:{key}")
+    return generation, value
 
-def clear_user_session(user_id: str):
-    """Очищає дані сесії користувача"""
-    key = f"session:{user_id}"
-    redis_client.delete(key)
 
+async def set_namespaced(namespace: str, generation: int, key: str, value: str, expire_seconds: int):
+    """Записати значення в покоління простору імен (TTL прибирає старі покоління)"""
+    await redis_client.setex(f"{namespace}:g{generation}:{key}", expire_seconds, value)
 
-def clear_users_list_cache():
-    """Очистити кеш списку користувачів"""
-    pattern = "users_list:*"
-    keys = redis_client.keys(pattern)
-    if keys:
-        redis_client.delete(*keys)
 
+async def bump_namespace(namespace: str) -> int:
+    """Інвалідувати весь простір імен за O(1) - новим поколінням"""
+    return await redis_client.incr(CACHE_GENERATION_KEY.format(namespace))
+
+
+async def sweep_namespace(namespace: str) -> int:
+    """Фізично видалити ключі старих поколінь простору імен (SCAN, без блокування Redis)
+
+    Потрібно лише коли не можна дочекатися TTL, наприклад при нестачі пам'яті
+    """
+    current = f"{namespace}:g{int(await redis_client.get(CACHE_GENERATION_KEY.format(namespace)) or 0)}:"
+    deleted = 0
+    stale = []
+    async for key in redis_client.scan_iter(match=f"{namespace}:g*", count=1000):
+        if not key.startswith(current):
+            stale.append(key)
+        if len(stale) >= REDIS_BATCH_SIZE:
+            deleted += await redis_client.unlink(*stale)
+            stale = []
+    if stale:
+        deleted += await redis_client.unlink(*stale)
+    return deleted
+
+
+async def get_users_list_page(page_key: str) -> tuple:
+    """Отримати відрендерену сторінку списку користувачів: (покоління, сторінка або None)"""
+    generation, data = await get_namespaced(USERS_LIST_NAMESPACE, page_key)
+    return generation, json.loads(data) if data else None
+
+
+async def set_users_list_page(generation: int, page_key: str, page: dict, expire_seconds: int = 300):
+    """Зберегти відрендерену сторінку списку користувачів"""
+    await set_namespaced(USERS_LIST_NAMESPACE, generation, page_key, json.dumps(page), expire_seconds)
+
+
+async def clear_users_list_cache():
+    """Очистити кеш списку користувачів (нове покоління замість пошуку ключів)"""
+    await bump_namespace(USERS_LIST_NAMESPACE)
 
-def get_system_stats() -> dict:
-    """Отримати системну статистику з Redis"""
-    data = redis_client.get("system_stats")
-    return json.loads(data) if data else None
 
+# Лічильники системної статистики в хеші stats:system (суми - в копійках)
+SYSTEM_STATS_KEY = "stats:system"
 
-def set_system_stats(stats: dict, expire_seconds: int = 600):
-    """Зберегти системну статистику в Redis"""
-    redis_client.setex("system_stats", expire_seconds, json.dumps(stats))
+# Лічильники змінюються тільки якщо хеш уже заповнений звіркою з БД: інакше
+# перша подія створила б частковий хеш, відлік якого почався б з нуля
+INCREMENT_STATS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+for i = 1, #ARGV, 2 do
+    redis.call('HINCRBY', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+return 1
+"""
 
+_increment_stats = redis_client.register_script(INCREMENT_STATS_SCRIPT)
 
-def set_tour_request_data(request_id: int, request_data: dict, expire_seconds: int = 3600):
+
+async def get_system_stats() -> dict:
+    """Отримати системну статистику з Redis (None, якщо лічильників ще немає)"""
+    data = await redis_client.hgetall(SYSTEM_STATS_KEY)
+    if not data:
+        return None
+    return {field: int(value) for field, value in data.items()}
+
+
+async def set_system_stats(stats: dict):
+    """Перезаписати лічильники системної статистики (звірка з БД)"""
+    await redis_client.hset(SYSTEM_STATS_KEY, mapping=stats)
+
+
+async def increment_system_stats(deltas: dict) -> bool:
+    """Атомарно змінити кілька лічильників статистики ({поле: зміна})
+
+    False - лічильників ще немає (перший запуск, перезапуск Redis), подія пропущена:
+    їх заповнить звірка з БД
+    """
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if not deltas:
+        return True
+    args = [item for pair in deltas.items() for item in pair]
+    return bool(await _increment_stats(keys=[SYSTEM_STATS_KEY], args=args))
+
+
+async def set_tour_request_data(request_id: int, request_data: dict, expire_seconds: int = 3600):
     """Зберегти дані заявки в Redis"""
     key = f"tour_request:{request_id}"
-    redis_client.setex(key, expire_seconds, json.dumps(request_data))
+    await redis_client.setex(key, expire_seconds, json.dumps(request_data))
 
 
-def get_tour_request_data(request_id: int) -> dict:
+async def get_tour_request_data(request_id: int) -> dict:
     """Отримати дані заявки з Redis"""
     key = f"tour_request:{request_id}"
-    data = redis_client.get(key)
+    data = await redis_client.get(key)
     return json.loads(data) if data else None
 
 
-def clear_all_redis_data():
+async def clear_all_redis_data():
     """Повністю очистити всі дані в Redis"""
-    redis_client.flushall()
-    print("✅ Redis очищено успішно") 
\ No newline at end of file
+    await redis_client.flushall()
+    print("✅ Redis очищено успішно")
+
+
+async def close_redis():
+    """Закриває клієнта та пул з'єднань Redis"""
+    await redis_client.aclose()
+    await redis_pool.disconnect()
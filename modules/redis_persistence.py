@@ -0,0 +1,161 @@
+import asyncio
+import json
+import logging
+import os
+from dotenv import load_dotenv
+from telegram.ext import BasePersistence, PersistenceInput
+from .redis_client import redis_client
+
+# Завантаження змінних середовища
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Як часто PTB передає змінені дані в persistence, секунди
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv('PERSISTENCE_UPDATE_INTERVAL', 5))
+# Затримка перед записом - всі зміни за цей час йдуть в Redis одним pipeline
+PERSISTENCE_FLUSH_DELAY = float(os.getenv('PERSISTENCE_FLUSH_DELAY', 0.5))
+
+
+class RedisPersistence(BasePersistence):
+    """Збереження user_data/chat_data/bot_data та станів розмов в хешах Redis
+
+    Зміни не пишуться одразу: вони накопичуються в пам'яті та записуються
+    одним pipeline через PERSISTENCE_FLUSH_DELAY секунд. Перед обробкою кожного
+    оновлення дані користувача та чату перечитуються з Redis, тому стан
+    спільний для всіх процесів бота і переживає перезапуск.
+    """
+
+    def __init__(self, prefix: str = 'ptb', update_interval: float = PERSISTENCE_UPDATE_INTERVAL,
+                 flush_delay: float = PERSISTENCE_FLUSH_DELAY):
+        super().__init__(store_data=PersistenceInput(callback_data=False), update_interval=update_interval)
+        self.prefix = prefix
+        self.flush_delay = flush_delay
+        # (ключ Redis, поле хешу або None для рядка) -> JSON або None для видалення
+        self._pending = {}
+        # (ключ Redis, поле) -> JSON, востаннє прочитаний з Redis або переданий на запис.
+        # Якщо словник у пам'яті від нього відрізняється, процес тримає новіші зміни,
+        # які PTB ще не передав (update_interval), і перечитувати їх не можна
+        self._synced = {}
+        self._flush_task = None
+
+    def _key(self, name: str) -> str:
+        return f"{self.prefix}:{name}"
+
+    async def _load_hash(self, name: str) -> dict:
+        redis_key = self._key(name)
+        loaded = {}
+        for key, value in (await redis_client.hgetall(redis_key)).items():
+            loaded[int(key)] = json.loads(value)
+            self._synced[(redis_key, key)] = json.dumps(loaded[int(key)])
+        return loaded
+
+    async def _refresh(self, name: str, key: int, data: dict):
+        """Оновити словник на місці даними з Redis, якщо локальних незаписаних змін немає"""
+        item = (self._key(name), str(key))
+        if item in self._pending:
+            return
+        if json.dumps(data) != self._synced.get(item, '{}'):
+            return
+        raw = await redis_client.hget(*item)
+        data.clear()
+        if raw is not None:
+            data.update(json.loads(raw))
+        self._synced[item] = json.dumps(data)
+
+    def _schedule_data(self, name: str, key: int, data: dict = None):
+        """Поставити на запис дані користувача/чату (None - видалення)"""
+        item = (self._key(name), str(key))
+        if data is None:
+            self._synced.pop(item, None)
+            self._schedule(*item, None)
+        else:
+            value = self._synced[item] = json.dumps(data)
+            self._schedule(*item, value)
+
+    def _schedule(self, key: str, field, value):
+        """Поставити зміну в чергу на запис"""
+        self._pending[(key, field)] = value
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_delay)
+        await self._write_pending()
+
+    async def _write_pending(self):
+        """Записати всі накопичені зміни одним pipeline"""
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for (key, field), value in pending.items():
+                    if field is None and value is None:
+                        pipe.delete(key)
+                    elif field is None:
+                        pipe.set(key, value)
+                    elif value is None:
+                        pipe.hdel(key, field)
+                    else:
+                        pipe.hset(key, field, value)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Помилка запису стану в Redis: {e}")
+            # Повертаємо незаписані зміни, якщо їх ще не замінили новіші
+            for item, value in pending.items():
+                self._pending.setdefault(item, value)
+
+    async def get_user_data(self) -> dict:
+        return await self._load_hash('user_data')
+
+    async def get_chat_data(self) -> dict:
+        return await self._load_hash('chat_data')
+
+    async def get_bot_data(self) -> dict:
+        data = await redis_client.get(self._key('bot_data'))
+        return json.loads(data) if data else {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        data = await redis_client.hgetall(self._key(f"conversations:{name}"))
+        return {tuple(json.loads(key)): json.loads(value) for key, value in data.items()}
+
+    async def update_conversation(self, name: str, key: tuple, new_state):
+        value = json.dumps(new_state) if new_state is not None else None
+        self._schedule(self._key(f"conversations:{name}"), json.dumps(list(key)), value)
+
+    async def update_user_data(self, user_id: int, data: dict):
+        self._schedule_data('user_data', user_id, data)
+
+    async def update_chat_data(self, chat_id: int, data: dict):
+        self._schedule_data('chat_data', chat_id, data)
+
+    async def update_bot_data(self, data: dict):
+        self._schedule(self._key('bot_data'), None, json.dumps(data))
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id: int):
+        self._schedule_data('user_data', user_id)
+
+    async def drop_chat_data(self, chat_id: int):
+        self._schedule_data('chat_data', chat_id)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        await self._refresh('user_data', user_id, user_data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict):
+        await self._refresh('chat_data', chat_id, chat_data)
+
+    async def refresh_bot_data(self, bot_data: dict):
+        pass
+
+    async def flush(self):
+        """Записати все, що залишилось, при зупинці бота"""
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._write_pending()
@@ -0,0 +1,81 @@
+import os
+from sqlalchemy import select, update, case
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+from .models import User, ReferralClosure
+from .ledger import to_minor, record_entries
+
+# Завантаження змінних середовища
+load_dotenv()
+
+# Бонуси за рівнями: 1-й - 100 грн, 2-й - 50 грн, 3-й і всі наступні - 25 грн.
+# Останнє значення розкладу застосовується до всіх глибших рівнів. Зберігається в копійках
+BONUS_SCHEDULE = [to_minor(amount) for amount in os.getenv('REFERRAL_BONUS_SCHEDULE', '100,50,25').split(',')]
+
+# Максимальний рівень, за який нараховується бонус (0 - без обмеження)
+BONUS_MAX_DEPTH = int(os.getenv('REFERRAL_BONUS_MAX_DEPTH', 0)) or None
+
+
+def bonus_for_level(level: int) -> int:
+    """Розмір бонусу для рівня згідно з розкладом, в копійках"""
+    return BONUS_SCHEDULE[min(level, len(BONUS_SCHEDULE)) - 1]
+
+
+def bonus_description(phone_number: str, level: int) -> str:
+    """Опис бонусу для історії нарахувань"""
+    if level == 1:
+        return f"Бонус за запрошення користувача {phone_number}"
+    return f"Бонус за запрошення користувача {phone_number} ({level}-й рівень)"
+
+
+async def propagate_bonuses(session: AsyncSession, new_user_id: int, phone_number: str) -> list:
+    """Нарахувати бонуси всьому ланцюжку запрошувачів нового користувача
+
+    Ланцюжок береться з таблиці замикання, тому рядки нового користувача мають бути
+    вже додані (add_to_closure). Баланси всього ланцюжка оновлюються одним UPDATE,
+    записи журналу - одним пакетним INSERT. Коміт - на стороні викликача.
+
+    Повертає список виплат [{'user_id', 'telegram_id', 'level', 'amount'}] від 1-го рівня
+    """
+    # Рівні беруться окремим запитом за індексом (descendant_id, depth): RETURNING
+    # в UPDATE ... FROM не повертає колонки referral_closure (ORM їх відкидає)
+    conditions = [ReferralClosure.descendant_id == new_user_id, ReferralClosure.depth >= 1]
+    if BONUS_MAX_DEPTH is not None:
+        conditions.append(ReferralClosure.depth <= BONUS_MAX_DEPTH)
+    levels = dict((await session.execute(
+        select(ReferralClosure.ancestor_id, ReferralClosure.depth).where(*conditions)
+    )).all())
+    if not levels:
+        return []
+
+    result = await session.execute(
+        update(User)
+        .where(User.id.in_(levels))
+        .values(balance=User.balance + case(
+            {user_id: bonus_for_level(level) for user_id, level in levels.items()}, value=User.id
+        ))
+        .returning(User.id, User.telegram_id)
+        .execution_options(synchronize_session=False)
+    )
+
+    payouts = sorted(
+        (
+            {'user_id': user_id, 'telegram_id': telegram_id, 'level': levels[user_id],
+             'amount': bonus_for_level(levels[user_id])}
+            for user_id, telegram_id in result
+        ),
+        key=lambda payout: payout['level']
+    )
+
+    await record_entries(session, [
+        {
+            'user_id': payout['user_id'],
+            'amount': payout['amount'],
+            'kind': 'referral',
+            'level': payout['level'],
+            'source_user_id': new_user_id,
+            'description': bonus_description(phone_number, payout['level'])
+        }
+        for payout in payouts
+    ])
+    return payouts
@@ -0,0 +1,116 @@
+from sqlalchemy import select, func, literal, literal_column, Integer
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from .models import async_session, User, ReferralClosure
+
+# Глибина реферальної програми за замовчуванням (1-й, 2-й, 3-й рівень)
+DEFAULT_DEPTH = 3
+
+
+class MissingClosureError(Exception):
+    """Запрошувача немає в таблиці замикання - бонуси ланцюжку не можуть бути нараховані"""
+
+
+def _depth_filter(max_depth: int):
+    """Умова на рівні 1..max_depth (max_depth=None - без обмеження)"""
+    if max_depth is None:
+        return ReferralClosure.depth >= 1
+    return ReferralClosure.depth.between(1, max_depth)
+
+
+async def add_to_closure(session: AsyncSession, user_id: int, referred_by: int = None):
+    """Додати нового користувача в таблицю замикання
+
+    Викликається в тій самій транзакції, що й створення користувача. Якщо в таблиці
+    немає рядка запрошувача (depth 0), реєстрація переривається MissingClosureError:
+    інакше ланцюжок мовчки залишився б без бонусів
+    """
+    columns = ['ancestor_id', 'descendant_id', 'depth']
+    rows = select(literal(user_id), literal(user_id), literal(0))
+    if referred_by:
+        # Предки нового користувача = запрошувач та всі його предки, на рівень глибше
+        rows = rows.union_all(
+            select(ReferralClosure.ancestor_id, literal(user_id), ReferralClosure.depth + 1)
+            .where(ReferralClosure.descendant_id == referred_by)
+        )
+    result = await session.execute(insert(ReferralClosure).from_select(columns, rows))
+    if referred_by and result.rowcount < 2:
+        raise MissingClosureError(f"Користувач {referred_by} відсутній в referral_closure")
+
+
+async def get_downline(session: AsyncSession, user_id: int, max_depth: int = DEFAULT_DEPTH) -> dict:
+    """Отримати рефералів користувача по рівнях одним запитом
+
+    Повертає {рівень: [User, ...]}, рівні без рефералів містять порожній список
+    """
+    result = await session.execute(
+        select(User, ReferralClosure.depth)
+        .join(ReferralClosure, User.id == ReferralClosure.descendant_id)
+        .where(ReferralClosure.ancestor_id == user_id, _depth_filter(max_depth))
+        .order_by(ReferralClosure.depth, User.id)
+    )
+
+    levels = {level: [] for level in range(1, (max_depth or 0) + 1)}
+    for user, depth in result:
+        levels.setdefault(depth, []).append(user)
+    return levels
+
+
+async def get_level_counts(session: AsyncSession, user_id: int, max_depth: int = DEFAULT_DEPTH) -> dict:
+    """Кількість рефералів по рівнях: один GROUP BY depth по індексу таблиці замикання
+
+    Повертає {рівень: кількість}
+    """
+    result = await session.execute(
+        select(ReferralClosure.depth, func.count())
+        .where(ReferralClosure.ancestor_id == user_id, _depth_filter(max_depth))
+        .group_by(ReferralClosure.depth)
+    )
+
+    counts = {level: 0 for level in range(1, (max_depth or 0) + 1)}
+    counts.update(dict(result.all()))
+    return counts
+
+
+async def get_level_stats(session: AsyncSession, user_id: int, max_depth: int = DEFAULT_DEPTH) -> dict:
+    """Кількість рефералів та сума їх балансів по рівнях одним запитом
+
+    Повертає {рівень: {'count': int, 'balance': int}}, баланс - в копійках
+    """
+    result = await session.execute(
+        select(ReferralClosure.depth, func.count(User.id), func.coalesce(func.sum(User.balance), 0))
+        .join(User, User.id == ReferralClosure.descendant_id)
+        .where(ReferralClosure.ancestor_id == user_id, _depth_filter(max_depth))
+        .group_by(ReferralClosure.depth)
+    )
+
+    stats = {level: {'count': 0, 'balance': 0} for level in range(1, (max_depth or 0) + 1)}
+    for depth, count, balance in result:
+        stats[depth] = {'count': count, 'balance': int(balance)}
+    return stats
+
+
+async def rebuild_referral_closure() -> int:
+    """Заповнити таблицю замикання для вже існуючих користувачів
+
+    Один INSERT ... WITH RECURSIVE по полю users.referred_by, повторний запуск безпечний
+    """
+    chain = select(
+        User.id.label('ancestor_id'),
+        User.id.label('descendant_id'),
+        literal_column('0', Integer).label('depth')
+    ).cte('chain', recursive=True)
+    chain = chain.union_all(
+        select(chain.c.ancestor_id, User.id, chain.c.depth + 1)
+        .join(User, User.referred_by == chain.c.descendant_id)
+    )
+
+    stmt = insert(ReferralClosure).from_select(
+        ['ancestor_id', 'descendant_id', 'depth'],
+        select(chain.c.ancestor_id, chain.c.descendant_id, chain.c.depth)
+    ).on_conflict_do_nothing()
+
+    async with async_session() as session:
+        result = await session.execute(stmt)
+        await session.commit()
+        return result.rowcount
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import os
+from dotenv import load_dotenv
+from sqlalchemy import select, func
+from .models import async_session, User, ReferralBonus
+from .redis_client import get_system_stats, set_system_stats, increment_system_stats
+
+# Завантаження змінних середовища
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Як часто лічильники звіряються з БД, секунди
+STATS_RECONCILE_INTERVAL = float(os.getenv('STATS_RECONCILE_INTERVAL', 3600))
+
+# Поля лічильників: хеш без будь-якого з них вважається незаповненим
+STATS_FIELDS = (
+    'total_users', 'active_users', 'total_referrals',
+    'total_balance', 'total_bonuses', 'total_bonus_amount'
+)
+
+_reconcile_task = None
+
+
+async def record_registration(referred: bool, payouts: list = ()):
+    """Новий користувач та реферальні бонуси, нараховані за його реєстрацію"""
+    await increment_system_stats({
+        'total_users': 1,
+        'total_referrals': 1 if referred else 0,
+        'total_bonuses': len(payouts),
+        'total_bonus_amount': sum(payout['amount'] for payout in payouts),
+        'total_balance': sum(payout['amount'] for payout in payouts)
+    })
+
+
+async def record_balance_change(amount: int):
+    """Ручне нарахування (amount > 0) або списання (amount < 0) в копійках - один запис журналу"""
+    await increment_system_stats({
+        'total_bonuses': 1,
+        'total_bonus_amount': amount,
+        'total_balance': amount
+    })
+
+
+async def reconcile_system_stats() -> dict:
+    """Перерахувати лічильники з БД одним запитом та перезаписати їх у Redis
+
+    Виправляє розбіжність, що накопичилась (наприклад, після збою між записом
+    у БД та оновленням лічильника). Кількість активних користувачів (з балансом > 0)
+    подіями не відстежується і оновлюється тільки тут.
+    """
+    users_query = select(
+        func.count(User.id),
+        func.count(User.id).filter(User.balance > 0),
+        func.count(User.referred_by),
+        func.coalesce(func.sum(User.balance), 0)
+    )
+    bonuses_query = select(func.count(ReferralBonus.id), func.coalesce(func.sum(ReferralBonus.amount), 0))
+
+    async with async_session() as session:
+        total_users, active_users, total_referrals, total_balance = (await session.execute(users_query)).one()
+        total_bonuses, total_bonus_amount = (await session.execute(bonuses_query)).one()
+
+    stats = {
+        'total_users': total_users,
+        'active_users': active_users,
+        'total_referrals': total_referrals,
+        'total_balance': int(total_balance),
+        'total_bonuses': total_bonuses,
+        'total_bonus_amount': int(total_bonus_amount)
+    }
+    await set_system_stats(stats)
+    return stats
+
+
+async def get_system_statistics() -> dict:
+    """Системна статистика: один HGETALL, звірка з БД тільки якщо лічильники неповні"""
+    stats = await get_system_stats()
+    if stats is None or any(field not in stats for field in STATS_FIELDS):
+        stats = await reconcile_system_stats()
+    return stats
+
+
+async def _reconcile_periodically():
+    """Звірка при запуску (лічильників може не бути після перезапуску Redis), далі - періодично"""
+    while True:
+        try:
+            await reconcile_system_stats()
+        except Exception as e:
+            logger.error(f"Помилка звірки статистики: {e}")
+        await asyncio.sleep(STATS_RECONCILE_INTERVAL)
+
+
+def start_stats_reconciler():
+    """Запустити періодичну звірку лічильників статистики"""
+    global _reconcile_task
+    if _reconcile_task is None:
+        _reconcile_task = asyncio.create_task(_reconcile_periodically())
+
+
+async def stop_stats_reconciler():
+    """Зупинити періодичну звірку лічильників статистики"""
+    global _reconcile_task
+    if _reconcile_task is not None:
+        _reconcile_task.cancel()
+        try:
+            await _reconcile_task
+        except asyncio.CancelledError:
+            pass
+        _reconcile_task = None
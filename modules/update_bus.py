@@ -0,0 +1,164 @@
+import asyncio
+import json
+import logging
+import os
+from dotenv import load_dotenv
+from telegram import Update
+from telegram.ext import Application, ContextTypes
+from redis.exceptions import RedisError, ResponseError
+from .redis_client import redis_client
+
+# Завантаження змінних середовища
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Кількість потоків (Redis Streams), між якими розподіляються оновлення за ID користувача
+UPDATE_PARTITIONS = int(os.getenv('UPDATE_PARTITIONS', 8))
+# Номер цього обробника та загальна кількість обробників: обробник читає потоки p,
+# для яких p % WORKER_COUNT == WORKER_INDEX
+WORKER_INDEX = int(os.getenv('WORKER_INDEX', 0))
+WORKER_COUNT = int(os.getenv('WORKER_COUNT', 1))
+# Після стількох невдалих спроб оновлення переноситься в updates:dead
+UPDATE_MAX_DELIVERIES = int(os.getenv('UPDATE_MAX_DELIVERIES', 5))
+# Приблизна максимальна довжина кожного потоку
+UPDATE_STREAM_MAXLEN = int(os.getenv('UPDATE_STREAM_MAXLEN', 100000))
+
+CONSUMER_GROUP = "workers"
+DEAD_LETTER_STREAM = "updates:dead"
+READ_BATCH = 10
+
+# Запис у потік тільки від актуального лідера (fencing token збігається з поточним)
+FENCED_XADD_SCRIPT = """
+if ARGV[1] ~= '' and redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[3], '*', 'update', ARGV[2])
+return 1
+"""
+
+_fenced_xadd = redis_client.register_script(FENCED_XADD_SCRIPT)
+
+
+# Помилки обробників за update_id: Application.process_update перехоплює винятки
+# і передає їх в error handler, тому до споживача потоку вони не доходять
+_failed_updates = {}
+
+
+class StaleLeaderError(Exception):
+    """Процес-приймач втратив лідерство і більше не може публікувати оновлення"""
+
+
+def partition_for(update: Update) -> int:
+    """Потік для оновлення: всі оновлення одного користувача йдуть в один потік по порядку"""
+    if update.effective_user:
+        key = update.effective_user.id
+    elif update.effective_chat:
+        key = update.effective_chat.id
+    else:
+        key = update.update_id
+    return key % UPDATE_PARTITIONS
+
+
+def stream_key(partition: int) -> str:
+    return f"updates:{partition}"
+
+
+async def publish_update(update: Update, fencing_key: str = None, fencing_token: int = None):
+    """Передати сире оновлення обробникам
+
+    Без fencing_token (режим webhook) запис дозволено будь-якому екземпляру
+    """
+    token = str(fencing_token) if fencing_token is not None else ''
+    pushed = await _fenced_xadd(
+        keys=[fencing_key or '', stream_key(partition_for(update))],
+        args=[token, json.dumps(update.to_dict()), UPDATE_STREAM_MAXLEN]
+    )
+    if not pushed:
+        raise StaleLeaderError(f"Застарілий fencing token {fencing_token}")
+
+
+async def mark_failed_update(update: object, context: ContextTypes.DEFAULT_TYPE):
+    """Error handler обробника: запам'ятати невдале оновлення, щоб не підтверджувати його в потоці"""
+    logger.error(f"Помилка в обробнику оновлення: {context.error}", exc_info=context.error)
+    if isinstance(update, Update):
+        _failed_updates[update.update_id] = context.error
+
+
+async def _ensure_group(stream: str):
+    try:
+        await redis_client.xgroup_create(stream, CONSUMER_GROUP, id='0', mkstream=True)
+    except ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+
+async def _delivery_count(stream: str, entry_id: str) -> int:
+    pending = await redis_client.xpending_range(stream, CONSUMER_GROUP, min=entry_id, max=entry_id, count=1)
+    return pending[0]['times_delivered'] if pending else 0
+
+
+async def _dead_letter(stream: str, entry_id: str, fields: dict):
+    """Перенести оновлення, яке не вдалося обробити, в окремий потік"""
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.xadd(DEAD_LETTER_STREAM, {**fields, 'stream': stream, 'entry_id': entry_id})
+        pipe.xack(stream, CONSUMER_GROUP, entry_id)
+        await pipe.execute()
+    logger.error(f"Оновлення {entry_id} з {stream} перенесено в {DEAD_LETTER_STREAM}")
+
+
+async def _consume_partition(application: Application, partition: int, stop_event: asyncio.Event):
+    """Послідовна обробка одного потоку - зберігає порядок оновлень кожного користувача
+
+    Ім'я споживача прив'язане до потоку, а не до процесу, тому після перезапуску
+    або зміни WORKER_COUNT новий власник потоку бачить непідтверджені записи (PEL)
+    і обробляє їх першими.
+    """
+    stream = stream_key(partition)
+    consumer = f"partition-{partition}"
+    await _ensure_group(stream)
+    # '0' - спочатку власні непідтверджені записи, '>' - нові
+    last_id = '0'
+
+    while not stop_event.is_set():
+        try:
+            entries = await redis_client.xreadgroup(
+                CONSUMER_GROUP, consumer, {stream: last_id},
+                count=READ_BATCH, block=None if last_id == '0' else 1000
+            )
+        except RedisError as e:
+            logger.warning(f"Помилка читання {stream}: {e}")
+            await asyncio.sleep(1)
+            continue
+
+        messages = entries[0][1] if entries else []
+        if not messages:
+            last_id = '>'
+            continue
+
+        for entry_id, fields in messages:
+            if last_id == '0' and await _delivery_count(stream, entry_id) > UPDATE_MAX_DELIVERIES:
+                await _dead_letter(stream, entry_id, fields)
+                continue
+            try:
+                update = Update.de_json(json.loads(fields['update']), application.bot)
+                await application.update_processor.process_update(update, application.process_update(update))
+                error = _failed_updates.pop(update.update_id, None)
+            except Exception as e:
+                error = e
+            if error is not None:
+                # Без підтвердження запис залишиться в PEL - перечитуємо його перед новими
+                logger.error(f"Помилка обробки оновлення {entry_id} з {stream}: {error}")
+                last_id = '0'
+                await asyncio.sleep(1)
+                break
+            await redis_client.xack(stream, CONSUMER_GROUP, entry_id)
+
+
+async def consume_updates(application: Application, stop_event: asyncio.Event):
+    """Обробка всіх потоків, закріплених за цим обробником"""
+    partitions = [p for p in range(UPDATE_PARTITIONS) if p % WORKER_COUNT == WORKER_INDEX]
+    print(f"📥 Обробник {WORKER_INDEX}/{WORKER_COUNT}, потоки: {partitions}")
+    await asyncio.gather(*(
+        _consume_partition(application, partition, stop_event) for partition in partitions
+    ))
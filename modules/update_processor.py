@@ -0,0 +1,74 @@
+import asyncio
+import os
+from dotenv import load_dotenv
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Завантаження змінних середовища
+load_dotenv()
+
+# Максимальна кількість оновлень, що обробляються одночасно
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', 32))
+
+
+class _ChatLock:
+    """Замок чату з лічильником оновлень, які його тримають або чекають"""
+
+    __slots__ = ('lock', 'users')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Паралельна обробка оновлень різних чатів з послідовною обробкою в межах одного чату
+
+    Багатокрокові сценарії (сума -> опис бонусу, підбір туру -> текст заявки) бачать
+    свої повідомлення по порядку, а довгий обробник одного адміністратора не блокує
+    інших користувачів. Замок чату береться в do_process_update, тобто вже в межах
+    загального ліміту PTB: оновлення, що чекає свого чату, займає місце в ліміті.
+    Запис видаляється з реєстру, щойно його не тримає і не чекає жодне оновлення.
+    """
+
+    def __init__(self, max_concurrent_updates: int = UPDATE_CONCURRENCY):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}
+
+    @staticmethod
+    def _key(update: object):
+        if isinstance(update, Update):
+            if update.effective_chat:
+                return update.effective_chat.id
+            if update.effective_user:
+                return update.effective_user.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine):
+        key = self._key(update)
+        if key is None:
+            await coroutine
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = _ChatLock()
+        entry.users += 1
+        try:
+            async with entry.lock:
+                await coroutine
+        finally:
+            entry.users -= 1
+            if entry.users == 0:
+                del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def active_chats(self) -> int:
+        """Кількість чатів, оновлення яких зараз обробляються або чекають"""
+        return len(self._locks)
@@ -2,13 +2,17 @@ import random
 import string
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
 from telegram.ext import ContextTypes
-from .models import Session, User, ReferralBonus, TourRequest
+from sqlalchemy import select
+from .models import async_session, User, TourRequest
+from .referral_tree import add_to_closure, get_level_counts
+from .user_repository import users, get_current_user
+from .outbound_queue import outbound
+from .system_stats import record_registration
+from .referral_bonuses import propagate_bonuses, bonus_for_level, bonus_description
+from .ledger import get_balance, format_amount
 from .redis_client import (
-    set_user_data, get_user_data, set_referral_code,
-    get_referral_user_id, increment_user_balance,
-    get_user_balance, set_tour_request_status,
-    get_tour_request_status, add_to_recent_requests,
-    get_recent_requests, clear_users_list_cache
+    set_referral_code, set_tour_request_status,
+    add_to_recent_requests, clear_users_list_cache
 )
 
 
@@ -38,73 +42,24 @@ async def handle_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     phone_number = update.message.contact.phone_number
-    user_id = str(update.effective_user.id)
+    user_id = update.effective_user.id
 
-    with Session() as session:
-        # Перевіряємо чи користувач вже існує
-        existing_user = session.query(User).filter_by(telegram_id=user_id).first()
-        if existing_user:
-            await update.message.reply_text("✅ Ви вже зареєстровані в системі!")
-            return
+    # Перевіряємо чи користувач вже існує
+    if get_current_user(context):
+        await update.message.reply_text("✅ Ви вже зареєстровані в системі!")
+        return
 
+    async with async_session() as session:
         # Перевіряємо чи є реферальний код
         referral_code = context.user_data.get('referral_code')
-        referred_by = None
         referrer = None
-        second_level_referrer = None
-        third_level_referrer = None
-
         if referral_code:
-            # Спочатку перевіряємо в Redis
-            referrer = session.query(User).filter_by(referral_code=referral_code).first()
-            if referrer:
-                referred_by = referrer.id
-                # Зберігаємо в Redis для майбутнього використання
-                set_referral_code(referral_code, str(referrer.id))
-
-                referrer.balance += 100
-                bonus = ReferralBonus(
-                    user_id=referrer.id,
-                    amount=100,
-                    description=f"Бонус за запрошення користувача {phone_number}"
-                )
-                session.add(bonus)
-                # Оновлюємо баланс в Redis
-                increment_user_balance(str(referrer.telegram_id), 100)
-
-                # Перевіряємо чи є у запрошувача свій запрошувач (другий рівень)
-                if referrer.referred_by:
-                    second_level_referrer = session.query(User).get(referrer.referred_by)
-                    if second_level_referrer:
-                        # Нараховуємо бонус користувачу другого рівня
-                        second_level_referrer.balance += 50
-                        bonus = ReferralBonus(
-                            user_id=second_level_referrer.id,
-                            amount=50,
-                            description=f"Бонус за запрошення користувача {phone_number} (2-й рівень)"
-                        )
-                        session.add(bonus)
-                        # Оновлюємо баланс в Redis
-                        increment_user_balance(str(second_level_referrer.telegram_id), 50)
-
-                        # Перевіряємо чи є у користувача другого рівня свій запрошувач (третій рівень)
-                        if second_level_referrer.referred_by:
-                            third_level_referrer = session.query(User).get(second_level_referrer.referred_by)
-                            if third_level_referrer:
-                                # Нараховуємо бонус користувачу третього рівня
-                                third_level_referrer.balance += 25
-                                bonus = ReferralBonus(
-                                    user_id=third_level_referrer.id,
-                                    amount=50,
-                                    description=f"Бонус за запрошення користувача {phone_number} (3-й рівень)"
-                                )
-                                session.add(bonus)
-                                # Оновлюємо баланс в Redis
-                                increment_user_balance(str(third_level_referrer.telegram_id), 25)
+            referrer = await session.scalar(select(User).filter_by(referral_code=referral_code))
+        referred_by = referrer.id if referrer else None
 
         # Генеруємо реферальний код для нового користувача
         new_referral_code = generate_referral_code()
-        
+
         # Створюємо нового користувача
         new_user = User(
             telegram_id=user_id,
@@ -113,30 +68,31 @@ async def handle_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
             referral_code=new_referral_code
         )
         session.add(new_user)
-        session.commit()
+        await session.flush()
+        # Рядки таблиці замикання та бонуси всьому ланцюжку - в тій самій транзакції
+        await add_to_closure(session, new_user.id, referred_by)
+        payouts = await propagate_bonuses(session, new_user.id, phone_number) if referrer else []
+        await session.commit()
+
+        # Скидаємо застарілий кеш запрошувачів, баланс яких змінився
+        await users.invalidate(*[payout['telegram_id'] for payout in payouts])
+        if referrer:
+            # Зберігаємо в Redis для майбутнього використання
+            await set_referral_code(referral_code, str(referrer.id))
 
         # Зберігаємо дані користувача в Redis
-        user_data = {
-            'id': new_user.id,  # Додаємо ID користувача
-            'telegram_id': user_id,
-            'phone_number': phone_number,
-            'referral_code': new_referral_code,
-            'referred_by': referred_by,
-            'balance': 0.0,
-            'is_admin': False,
-            'created_at': new_user.created_at.strftime('%d.%m.%Y')
-        }
-        set_user_data(user_id, user_data)
-        set_referral_code(new_referral_code, user_id)
-
-        # Очищаємо кеш списку користувачів
-        clear_users_list_cache()
+        await users.cache(new_user)
+        await set_referral_code(new_referral_code, user_id)
+
+        # Очищаємо кеш списку користувачів та оновлюємо лічильники статистики
+        await clear_users_list_cache()
+        await record_registration(referrer is not None, payouts)
 
         # Відправляємо повідомлення про успішну реєстрацію
         if referrer:
             await update.message.reply_text(
                 "✅ Реєстрація успішна!\n\n"
-                "Ваш друг отримав бонус 100 грн!\n"
+                f"Ваш друг отримав бонус {format_amount(bonus_for_level(1))} грн!\n"
                 "Тепер ви можете:\n"
                 "├── Запрошувати друзів\n"
                 "├── Отримувати бонуси\n"
@@ -151,39 +107,13 @@ async def handle_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "└── Використовувати всі можливості бота"
             )
 
-        # Відправляємо повідомлення запрошувачу про нарахування бонусу
-        if referred_by:
-            try:
-                referrer_user = session.query(User).get(referred_by)
-                await context.bot.send_message(
-                    chat_id=referrer_user.telegram_id,
-                    text=f"💰 Вам нараховано +100 грн!\n"
-                         f"💬 За запрошення користувача {phone_number}"
-                )
-            except Exception as e:
-                print(f"Помилка відправки повідомлення запрошувачу {referred_by}: {str(e)}")
-
-        # Відправляємо повідомлення користувачу другого рівня про нарахування бонусу
-        if second_level_referrer:
-            try:
-                await context.bot.send_message(
-                    chat_id=second_level_referrer.telegram_id,
-                    text=f"💰 Вам нараховано +50 грн!\n"
-                         f"💬 За запрошення користувача {phone_number} (2-й рівень)"
-                )
-            except Exception as e:
-                print(f"Помилка відправки повідомлення користувачу 2-го рівня {second_level_referrer.telegram_id}: {str(e)}")
-
-        # Відправляємо повідомлення користувачу третього рівня про нарахування бонусу
-        if third_level_referrer:
-            try:
-                await context.bot.send_message(
-                    chat_id=third_level_referrer.telegram_id,
-                    text=f"💰 Вам нараховано +25 грн!\n"
-                         f"💬 За запрошення користувача {phone_number} (3-й рівень)"
-                )
-            except Exception as e:
-                print(f"Помилка відправки повідомлення користувачу 3-го рівня {third_level_referrer.telegram_id}: {str(e)}")
+        # Відправляємо повідомлення запрошувачам про нарахування бонусу
+        for payout in payouts:
+            outbound.enqueue(
+                payout['telegram_id'],
+                f"💰 Вам нараховано +{format_amount(payout['amount'])} грн!\n"
+                f"💬 {bonus_description(phone_number, payout['level'])}"
+            )
 
         # Показуємо основне меню
         keyboard = [
@@ -199,57 +129,33 @@ async def handle_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def show_statistics(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показати статистику користувача"""
-    user_id = str(update.effective_user.id)
-    
-    with Session() as session:
-        # Спочатку беремо дані з бази
-        user = session.query(User).filter_by(telegram_id=user_id).first()
-        if not user:
-            await update.message.reply_text("Спочатку потрібно зареєструватися!")
-            return
+    user = get_current_user(context)
+    if not user:
+        await update.message.reply_text("Спочатку потрібно зареєструватися!")
+        return
 
+    async with async_session() as session:
         # Отримання статистики рефералів
-        first_level = session.query(User).filter_by(referred_by=user.id).count()
-        second_level = session.query(User).filter(
-            User.referred_by.in_(
-                session.query(User.id).filter_by(referred_by=user.id)
-            )
-        ).count()
-        third_level = session.query(User).filter(
-            User.referred_by.in_(
-                session.query(User.id).filter(
-                    User.referred_by.in_(
-                        session.query(User.id).filter_by(referred_by=user.id)
-                    )
-                )
-            )
-        ).count()
-
-        # Оновлюємо дані в Redis
-        user_data = {
-            'id': user.id,
-            'telegram_id': user_id,
-            'phone_number': user.phone_number,
-            'referral_code': user.referral_code,
-            'referred_by': user.referred_by,
-            'balance': user.balance,
-            'is_admin': user.is_admin
-        }
-        set_user_data(user_id, user_data)
+        level_counts = await get_level_counts(session, user['id'])
+        first_level = level_counts[1]
+        second_level = level_counts[2]
+        third_level = level_counts[3]
+        # Баланс - з БД, кеш користувача може бути застарілим
+        balance = await get_balance(session, user['id'])
 
         stats_text = (
             f"📊 ВАША СТАТИСТИКА\n"
-            f"💰 Поточний баланс: {user.balance} грн\n\n"
+            f"💰 Поточний баланс: {format_amount(balance)} грн\n\n"
             f"👥 ВАШІ РЕФЕРАЛИ:\n"
-            f"├── 1-й рівень: {first_level} осіб ({first_level * 100} грн)\n"
-            f"├── 2-й рівень: {second_level} осіб ({second_level * 50} грн)\n"
-            f"└── 3-й рівень: {third_level} осіб ({third_level * 25} грн)\n\n"
+            f"├── 1-й рівень: {first_level} осіб ({format_amount(first_level * bonus_for_level(1))} грн)\n"
+            f"├── 2-й рівень: {second_level} осіб ({format_amount(second_level * bonus_for_level(2))} грн)\n"
+            f"└── 3-й рівень: {third_level} осіб ({format_amount(third_level * bonus_for_level(3))} грн)\n\n"
             f"🔗 Ваше посилання:\n"
-            f"t.me/TourWithUsBot?start={user.referral_code}"
+            f"t.me/TourWithUsBot?start={user['referral_code']}"
         )
 
         keyboard = [[
-            InlineKeyboardButton("📤 Поділитися посиланням", switch_inline_query=f"https://t.me/TourWithUsBot?start={user.referral_code}")
+            InlineKeyboardButton("📤 Поділитися посиланням", switch_inline_query=f"https://t.me/TourWithUsBot?start={user['referral_code']}")
         ]]
         reply_markup = InlineKeyboardMarkup(keyboard)
 
@@ -258,11 +164,8 @@ async def show_statistics(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def request_tour(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обробник запиту на підбір туру"""
-    user_id = str(update.effective_user.id)
-    
-    # Перевіряємо дані користувача в Redis
-    user_data = get_user_data(user_id)
-    
+    user_data = get_current_user(context)
+
     if not user_data:
         await update.message.reply_text("Спочатку потрібно зареєструватися!")
         return
@@ -277,52 +180,44 @@ async def request_tour(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def handle_tour_request(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обробник тексту з описом туру"""
     if context.user_data.get('waiting_for_tour_request'):
-        user_id = str(update.effective_user.id)
-        
-        # Перевіряємо дані користувача в Redis
-        user_data = get_user_data(user_id)
+        user_id = update.effective_user.id
         
-        if not user_data:
+        user = get_current_user(context)
+
+        if not user:
             await update.message.reply_text("Спочатку потрібно зареєструватися!")
             return
 
-        with Session() as session:
-            user = session.query(User).filter_by(telegram_id=user_id).first()
-            if user:
-                tour_request = TourRequest(
-                    user_id=user.id,
-                    description=update.message.text
-                )
-                session.add(tour_request)
-                session.commit()
-
-                # Зберігаємо статус заявки в Redis
-                set_tour_request_status(tour_request.id, 'new')
-                # Додаємо заявку до списку останніх заявок користувача
-                add_to_recent_requests(tour_request.id, user_id)
-
-                # Відправляємо повідомлення адміністраторам
-                admins = session.query(User).filter_by(is_admin=True).all()
-                for admin in admins:
-                    try:
-                        await context.bot.send_message(
-                            chat_id=admin.telegram_id,
-                            text=f"🔔 НОВА ЗАЯВКА НА ТУР\n\n"
-                                 f"👤 Користувач: {user.phone_number}\n"
-                                 f"📝 Опис:\n{update.message.text}\n\n"
-                                 f"🆔 ID заявки: {tour_request.id}\n"
-                                 f"📅 Створено: {tour_request.created_at.strftime('%d.%m.%Y %H:%M')}"
-                        )
-                    except Exception as e:
-                        print(f"Помилка відправки повідомлення адміну {admin.telegram_id}: {str(e)}")
-
-                await update.message.reply_text(
-                    "Дякую! Ваша заявка передана менеджеру.\n"
-                    "З вами зв'яжуться протягом години! ✅"
+        async with async_session() as session:
+            tour_request = TourRequest(
+                user_id=user['id'],
+                description=update.message.text
+            )
+            session.add(tour_request)
+            await session.commit()
+
+            # Зберігаємо статус заявки в Redis
+            await set_tour_request_status(tour_request.id, 'new')
+            # Додаємо заявку до списку останніх заявок користувача
+            await add_to_recent_requests(tour_request.id, user_id)
+
+            # Відправляємо повідомлення адміністраторам
+            admins = (await session.scalars(select(User).filter_by(is_admin=True))).all()
+            for admin in admins:
+                outbound.enqueue(
+                    admin.telegram_id,
+                    f"🔔 НОВА ЗАЯВКА НА ТУР\n\n"
+                    f"👤 Користувач: {user['phone_number']}\n"
+                    f"📝 Опис:\n{update.message.text}\n\n"
+                    f"🆔 ID заявки: {tour_request.id}\n"
+                    f"📅 Створено: {tour_request.created_at.strftime('%d.%m.%Y %H:%M')}"
                 )
-                context.user_data['waiting_for_tour_request'] = False
-            else:
-                await update.message.reply_text("Спочатку потрібно зареєструватися!")
+
+            await update.message.reply_text(
+                "Дякую! Ваша заявка передана менеджеру.\n"
+                "З вами зв'яжуться протягом години! ✅"
+            )
+            context.user_data['waiting_for_tour_request'] = False
 
 
 async def handle_user_text(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, user):
@@ -352,16 +247,14 @@ async def handle_user_text(update: Update, context: ContextTypes.DEFAULT_TYPE, t
     elif text == "🔗 Моє посилання":
         await update.message.reply_text(
             f"🔗 Ваше реферальне посилання:\n"
-            f"t.me/TourWithUsBot?start={user.referral_code}",
+            f"t.me/TourWithUsBot?start={user['referral_code']}",
             parse_mode='Markdown',
             disable_web_page_preview=True
         )
     elif text == "🛠 Адмін панель":
         # Перевіряємо чи користувач адмін
-        with Session() as session:
-            current_user = session.query(User).filter_by(telegram_id=user.telegram_id).first()
-            if current_user and not current_user.is_admin:
-                await update.message.reply_text("❌ У вас немає доступу до адмін-панелі!")
+        if not user['is_admin']:
+            await update.message.reply_text("❌ У вас немає доступу до адмін-панелі!")
     elif context.user_data.get('waiting_for_tour_request'):
         await handle_tour_request(update, context)
     else:
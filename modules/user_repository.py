@@ -0,0 +1,159 @@
+from datetime import datetime
+from sqlalchemy import select, tuple_
+from .models import async_session, User
+from .redis_client import get_user_data, set_user_data, set_many_user_data, delete_users_data
+from .local_cache import LocalCache, publish_invalidation
+
+# Кеш користувача інвалідовується явно при кожній зміні, тому TTL може бути довгим
+USER_CACHE_TTL = 86400
+
+# users.id - INTEGER, більші числа можуть бути тільки Telegram ID
+MAX_USER_ID = 2 ** 31 - 1
+
+# Сортування списку користувачів: код -> (колонка, за спаданням, тип значення курсора)
+USER_LIST_SORTS = {
+    'i': (User.id, False, int),
+    'b': (User.balance, True, int),
+    'd': (User.created_at, True, datetime.fromisoformat),
+}
+
+
+class UserRepository:
+    """Єдина точка доступу до користувачів з кешем в Redis
+
+    Читання - read-through (локальний L1 кеш процесу, Redis, потім БД із записом в кеш),
+    після зміни рядка в БД викликач робить один запис у кеш (cache) або інвалідацію
+    (invalidate). В кеші завжди лежить повне канонічне представлення (serialize).
+    Про кожну зміну інші процеси дізнаються через Redis pub/sub і скидають свій L1.
+    """
+
+    def __init__(self):
+        self.local = LocalCache('users')
+
+    @staticmethod
+    def serialize(user: User) -> dict:
+        """Канонічне представлення користувача для кешу та обробників"""
+        return {
+            'id': user.id,
+            'telegram_id': user.telegram_id,
+            'phone_number': user.phone_number,
+            'referral_code': user.referral_code,
+            'referred_by': user.referred_by,
+            'balance': user.balance,
+            'is_admin': user.is_admin,
+            'created_at': user.created_at.strftime('%d.%m.%Y')
+        }
+
+    async def remember(self, user: User) -> dict:
+        """Записати прочитані з БД дані користувача в Redis та L1 кеш (без сповіщення)"""
+        user_data = self.serialize(user)
+        await set_user_data(user_data['telegram_id'], user_data, USER_CACHE_TTL)
+        self.local.set(user_data['telegram_id'], user_data)
+        return user_data
+
+    async def remember_many(self, db_users: list) -> list:
+        """Записати кількох прочитаних з БД користувачів у Redis (pipeline) та L1 кеш"""
+        users_data = {}
+        for user in db_users:
+            user_data = self.serialize(user)
+            users_data[user_data['telegram_id']] = user_data
+            self.local.set(user_data['telegram_id'], user_data)
+        await set_many_user_data(users_data, USER_CACHE_TTL)
+        return list(users_data.values())
+
+    async def cache(self, user: User) -> dict:
+        """Записати змінені дані користувача в кеш (write-through) та сповістити інші процеси"""
+        user_data = await self.remember(user)
+        await publish_invalidation(self.local.name, [user_data['telegram_id']])
+        return user_data
+
+    async def invalidate(self, *telegram_ids):
+        """Видалити користувачів з кешу (один запит до Redis + повідомлення в pub/sub)"""
+        keys = [int(telegram_id) for telegram_id in telegram_ids]
+        self.local.delete(*keys)
+        await delete_users_data(keys)
+        await publish_invalidation(self.local.name, keys)
+
+    async def get_by_telegram_id(self, telegram_id) -> dict:
+        """Користувач за Telegram ID: L1 кеш, далі один GET в Redis, при промаху - БД
+
+        Ключі кешу завжди в цілочисельній формі (user:<telegram_id>)
+        """
+        telegram_id = int(telegram_id)
+        user_data = self.local.get(telegram_id)
+        if user_data:
+            return user_data
+
+        user_data = await get_user_data(telegram_id)
+        if user_data:
+            self.local.set(telegram_id, user_data)
+            return user_data
+
+        async with async_session() as session:
+            user = await session.scalar(select(User).filter_by(telegram_id=telegram_id))
+        return await self.remember(user) if user else None
+
+    async def get_by_id(self, user_id: int) -> dict:
+        """Користувач за внутрішнім ID (завжди з БД, з оновленням кешу)"""
+        async with async_session() as session:
+            user = await session.get(User, user_id)
+        return await self.remember(user) if user else None
+
+    async def get_by_phone(self, phone_number: str) -> dict:
+        """Користувач за номером телефону (з БД, з оновленням кешу)"""
+        async with async_session() as session:
+            user = await session.scalar(select(User).filter_by(phone_number=phone_number))
+        return await self.remember(user) if user else None
+
+    async def page(self, sort: str = 'i', cursor: tuple = None, forward: bool = True, limit: int = 10) -> tuple:
+        """Сторінка користувачів з пагінацією за ключем (keyset)
+
+        cursor - (значення колонки сортування, id) першого або останнього рядка
+        попередньої сторінки; forward - напрямок від курсора. Запит читає тільки
+        limit + 1 рядок незалежно від номера сторінки.
+        Повертає (користувачі, чи є попередня сторінка, чи є наступна)
+        """
+        column, descending, _ = USER_LIST_SORTS[sort]
+        # При русі назад порядок обертається, а результат розвертається в кінці
+        reverse = descending == forward
+        query = select(User)
+        if cursor:
+            key, bound = tuple_(column, User.id), tuple_(*cursor)
+            query = query.where(key < bound if reverse else key > bound)
+        if reverse:
+            query = query.order_by(column.desc(), User.id.desc())
+        else:
+            query = query.order_by(column, User.id)
+
+        async with async_session() as session:
+            rows = (await session.scalars(query.limit(limit + 1))).all()
+
+        has_more = len(rows) > limit
+        rows = list(rows[:limit])
+        if forward:
+            return rows, cursor is not None, has_more
+        rows.reverse()
+        return rows, has_more, True
+
+    async def find(self, identifier: str) -> dict:
+        """Пошук користувача за ID, Telegram ID або номером телефону"""
+        identifier = str(identifier).strip()
+        if identifier.isdigit():
+            user_data = None
+            if int(identifier) <= MAX_USER_ID:
+                user_data = await self.get_by_id(int(identifier))
+            user_data = user_data or await self.get_by_telegram_id(int(identifier))
+            if user_data:
+                return user_data
+        return await self.get_by_phone(identifier)
+
+
+users = UserRepository()
+
+
+def get_current_user(context) -> dict:
+    """Користувач поточного оновлення, визначений один раз перед обробниками (bot.py)
+
+    None - користувач не зареєстрований
+    """
+    return getattr(context, 'current_user', None)
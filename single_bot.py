@@ -1,55 +1,122 @@
-import atexit
-import fcntl
+import asyncio
+import logging
 import os
-import signal
-import sys
+import socket
+import uuid
+from dotenv import load_dotenv
+from redis.exceptions import RedisError
 
+from modules.redis_client import redis_client
 
-class SingletonBot:
-    def __init__(self, lock_file_path='bot.lock'):
-        self.lock_file_path = lock_file_path
-        self.lock_file = None
+# Завантаження змінних середовища
+load_dotenv()
 
-    def __enter__(self):
-        """Блокування при вході в контекст"""
-        try:
-            self.lock_file = open(self.lock_file_path, 'w')
-            # Неблокуючий ексклюзивний лок
-            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
-            # Записуємо PID поточного процесу
-            self.lock_file.write(str(os.getpid()))
-            self.lock_file.flush()
-
-            # Реєструємо очищення при завершенні
-            atexit.register(self.cleanup)
-            signal.signal(signal.SIGTERM, self._signal_handler)
-            signal.signal(signal.SIGINT, self._signal_handler)
-
-            return self
-        except (IOError, OSError):
-            if self.lock_file:
-                self.lock_file.close()
-            print("❌ Бот вже запущений! Неможливо запустити другу копію.")
-            sys.exit(1)
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        """Розблокування при виході з контексту"""
-        self.cleanup()
-
-    def cleanup(self):
-        """Очищення lock-файлу"""
-        if self.lock_file:
+logger = logging.getLogger(__name__)
+
+# Час життя лізингу лідера: резервний екземпляр перехоплює polling не пізніше ніж через цей час
+LEADER_LEASE_TTL = float(os.getenv('LEADER_LEASE_TTL', 10))
+# Як часто лідер продовжує лізинг
+LEADER_RENEW_INTERVAL = float(os.getenv('LEADER_RENEW_INTERVAL', 3))
+# Як часто резервний екземпляр пробує отримати лізинг
+LEADER_RETRY_INTERVAL = float(os.getenv('LEADER_RETRY_INTERVAL', 1))
+
+# SET NX PX + новий fencing token тільки при успішному захопленні
+ACQUIRE_SCRIPT = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return redis.call('INCR', KEYS[2])
+end
+return false
+"""
+
+# Продовження та звільнення - тільки власником лізингу
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class LeaderLease:
+    """Розподілене лідерство через Redis замість локального lock-файлу
+
+    Лідер тримає ключ leader:{name} (SET NX PX) та продовжує його heartbeat-ом.
+    Кожне захоплення збільшує лічильник leader:{name}:fencing - цей fencing token
+    дозволяє відкинути запис від колишнього лідера, який ще не помітив втрату лізингу.
+    """
+
+    def __init__(self, name: str = 'telegram_bot'):
+        self.key = f"leader:{name}"
+        self.fencing_key = f"leader:{name}:fencing"
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.fencing_token = None
+        self._ttl_ms = int(LEADER_LEASE_TTL * 1000)
+        self._acquire = redis_client.register_script(ACQUIRE_SCRIPT)
+        self._renew = redis_client.register_script(RENEW_SCRIPT)
+        self._release = redis_client.register_script(RELEASE_SCRIPT)
+
+    @property
+    def is_leader(self) -> bool:
+        return self.fencing_token is not None
+
+    async def try_acquire(self) -> bool:
+        """Одна спроба стати лідером"""
+        token = await self._acquire(keys=[self.key, self.fencing_key], args=[self.owner, self._ttl_ms])
+        if token:
+            self.fencing_token = int(token)
+            return True
+        return False
+
+    async def wait_for_leadership(self, stop_event: asyncio.Event) -> bool:
+        """Чекати на лідерство (гарячий резерв). False - якщо процес зупиняють"""
+        while not stop_event.is_set():
+            try:
+                if await self.try_acquire():
+                    return True
+            except RedisError as e:
+                logger.warning(f"Не вдалося отримати лізинг лідера: {e}")
+            await _wait(stop_event, LEADER_RETRY_INTERVAL)
+        return False
+
+    async def hold(self, stop_event: asyncio.Event):
+        """Продовжувати лізинг, поки процес працює. Повертається при зупинці або втраті лідерства"""
+        loop = asyncio.get_running_loop()
+        expires_at = loop.time() + LEADER_LEASE_TTL
+        while not stop_event.is_set():
+            await _wait(stop_event, LEADER_RENEW_INTERVAL)
+            if stop_event.is_set():
+                return
             try:
-                fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
-                self.lock_file.close()
-                # Видаляємо файл блокування
-                if os.path.exists(self.lock_file_path):
-                    os.unlink(self.lock_file_path)
-            except:
-                pass
-
-    def _signal_handler(self, signum, frame):
-        """Обробник сигналів для коректного завершення"""
-        print(f"\n🛑 Отримано сигнал {signum}. Завершуємо роботу бота...")
-        self.cleanup()
-        sys.exit(0)
+                if not await self._renew(keys=[self.key], args=[self.owner, self._ttl_ms]):
+                    logger.warning("Лізинг лідера перехоплено іншим екземпляром")
+                    break
+                expires_at = loop.time() + LEADER_LEASE_TTL
+            except RedisError as e:
+                logger.warning(f"Не вдалося продовжити лізинг лідера: {e}")
+                # Без підтвердження від Redis поступаємось до того, як лізинг спливе
+                if loop.time() + LEADER_RENEW_INTERVAL >= expires_at:
+                    break
+        self.fencing_token = None
+
+    async def release(self):
+        """Звільнити лізинг, щоб резерв перехопив його одразу"""
+        try:
+            await self._release(keys=[self.key], args=[self.owner])
+        except RedisError as e:
+            logger.warning(f"Не вдалося звільнити лізинг лідера: {e}")
+        self.fencing_token = None
+
+
+async def _wait(stop_event: asyncio.Event, timeout: float):
+    """Пауза, яку перериває сигнал зупинки"""
+    try:
+        await asyncio.wait_for(stop_event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
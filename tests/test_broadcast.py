@@ -0,0 +1,89 @@
+import asyncio
+import pytest
+from modules import broadcast
+
+
+class FakeLockRedis:
+    """Мінімальна заміна redis_client: статус розсилки та блокування з TTL"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.lock = None
+        self.expires_at = 0.0
+        self.acquired = []
+
+    def _now(self) -> float:
+        return asyncio.get_running_loop().time()
+
+    def holder(self):
+        return self.lock if self._now() < self.expires_at else None
+
+    async def hget(self, key, field):
+        return 'running'
+
+    async def set(self, key, value, nx=False, ex=None):
+        if nx and self.holder() is not None:
+            return None
+        self.lock, self.expires_at = value, self._now() + self.ttl
+        self.acquired.append(value)
+        return True
+
+    async def renew(self, keys, args):
+        if self.holder() != args[0]:
+            return 0
+        self.expires_at = self._now() + self.ttl
+        return 1
+
+    async def release(self, keys, args):
+        if self.holder() == args[0]:
+            self.lock = None
+        return 1
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    fake = FakeLockRedis(ttl=0.3)
+    monkeypatch.setattr(broadcast, 'redis_client', fake)
+    monkeypatch.setattr(broadcast, '_renew_lock', fake.renew)
+    monkeypatch.setattr(broadcast, '_release_lock', fake.release)
+    monkeypatch.setattr(broadcast, 'BROADCAST_LOCK_TTL', fake.ttl)
+    monkeypatch.setattr(broadcast, 'BROADCAST_LOCK_RENEW_INTERVAL', 0.1)
+    return fake
+
+
+def test_long_batch_keeps_lock_and_blocks_second_run(fake_redis, monkeypatch):
+    runs = []
+
+    async def slow_run(bot, lock_lost):
+        runs.append(lock_lost)
+        # Пачка довша за TTL блокування (наприклад, flood wait одного чату)
+        await asyncio.sleep(1)
+        assert not lock_lost.is_set()
+        assert fake_redis.holder() is not None
+
+    monkeypatch.setattr(broadcast, '_run', slow_run)
+
+    async def scenario():
+        first = asyncio.create_task(broadcast.run_pending_broadcast(None))
+        await asyncio.sleep(0.5)
+        # Нагляд у тому самому процесі не запускає другу розсилку
+        second = await broadcast.run_pending_broadcast(None)
+        return await first, second, fake_redis.holder()
+
+    assert asyncio.run(scenario()) == (True, False, None)
+    assert len(runs) == 1
+    assert len(fake_redis.acquired) == 1
+
+
+def test_each_acquisition_uses_new_token(fake_redis, monkeypatch):
+    async def quick_run(bot, lock_lost):
+        pass
+
+    monkeypatch.setattr(broadcast, '_run', quick_run)
+
+    async def scenario():
+        await broadcast.run_pending_broadcast(None)
+        await broadcast.run_pending_broadcast(None)
+
+    asyncio.run(scenario())
+    assert len(set(fake_redis.acquired)) == 2
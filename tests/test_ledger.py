@@ -0,0 +1,36 @@
+import asyncio
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from modules.models import Base, User, ReferralBonus
+from modules.ledger import credit, debit
+
+
+async def _debit_after_credit(credited: int, debited: int) -> tuple:
+    """Нарахувати credited, потім спробувати списати debited; (результат debit, баланс, записів у журналі)"""
+    engine = create_async_engine('sqlite+aiosqlite://')
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    try:
+        async with async_sessionmaker(engine, expire_on_commit=False)() as session:
+            user = User(telegram_id=3000, phone_number="+380500000200", referral_code="LEDGER")
+            session.add(user)
+            await session.flush()
+            await credit(session, user.id, credited, "Нарахування")
+            result = await debit(session, user.id, debited, "Списання")
+            await session.commit()
+
+            balance = await session.scalar(select(User.balance).where(User.id == user.id))
+            entries = await session.scalar(select(func.count(ReferralBonus.id)).where(ReferralBonus.user_id == user.id))
+        return result, balance, entries
+    finally:
+        await engine.dispose()
+
+
+def test_debit_within_balance():
+    assert asyncio.run(_debit_after_credit(10000, 2550)) == (7450, 7450, 2)
+
+
+def test_debit_overdraft_changes_nothing():
+    # Недостатньо коштів: ні зміни балансу, ні запису в журналі
+    assert asyncio.run(_debit_after_credit(10000, 10001)) == (None, 10000, 1)
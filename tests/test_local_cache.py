@@ -0,0 +1,24 @@
+import asyncio
+import json
+from modules import local_cache
+from modules.local_cache import LocalCache, publish_invalidation, _apply_invalidation
+
+
+def test_invalidation_from_other_process_removes_int_keys(monkeypatch):
+    published = []
+
+    async def publish(channel, message):
+        published.append(message)
+
+    monkeypatch.setattr(local_cache.redis_client, 'publish', publish)
+    cache = LocalCache('test_users')
+    cache.set(123456789, {'is_admin': True})
+    cache.set(987654321, {'is_admin': False})
+
+    asyncio.run(publish_invalidation(cache.name, [123456789]))
+    payload = json.loads(published[0])
+    payload['origin'] = 'other-process'
+    _apply_invalidation(payload)
+
+    assert cache.get(123456789) is None
+    assert cache.get(987654321) == {'is_admin': False}
@@ -0,0 +1,34 @@
+import asyncio
+from telegram.error import RetryAfter
+from modules.outbound_queue import OutboundQueue
+
+
+class FloodBot:
+    """Перша відправка отримує 429, решта проходять"""
+
+    def __init__(self):
+        self.sent = []
+        self.flooded = False
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if not self.flooded:
+            self.flooded = True
+            raise RetryAfter(1)
+        self.sent.append((asyncio.get_running_loop().time(), chat_id))
+
+
+def test_retry_after_pauses_every_sender():
+    async def scenario():
+        bot = FloodBot()
+        queue = OutboundQueue(rate_limit=1000, chat_interval=0, senders=4)
+        queue.start(bot)
+        start = asyncio.get_running_loop().time()
+        futures = [queue.enqueue(chat_id, "text") for chat_id in range(4)]
+        assert await asyncio.gather(*futures) == [None] * 4
+        await queue.stop()
+        return start, bot.sent
+
+    start, sent = asyncio.run(scenario())
+    # Жоден чат не отримав повідомлення під час flood wait, навіть ті, що не отримали 429
+    assert len(sent) == 4
+    assert all(sent_at - start >= 1 for sent_at, _ in sent)
@@ -0,0 +1,55 @@
+import asyncio
+import json
+import pytest
+from modules import redis_persistence
+from modules.redis_persistence import RedisPersistence
+
+
+class FakeRedis:
+    """Мінімальна заміна redis_client: хеші в пам'яті"""
+
+    def __init__(self):
+        self.hashes = {}
+
+    async def hget(self, key, field):
+        return self.hashes.get(key, {}).get(field)
+
+    async def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(redis_persistence, 'redis_client', fake)
+    return fake
+
+
+def test_refresh_keeps_changes_not_yet_passed_to_persistence(fake_redis):
+    async def scenario():
+        fake_redis.hashes['ptb:user_data'] = {'1': json.dumps({'step': 'old'})}
+        persistence = RedisPersistence()
+        data = (await persistence.get_user_data())[1]
+
+        # Обробник змінив дані, але PTB ще не викликав update_user_data
+        data['step'] = 'new'
+        data.pop('bonus_amount', None)
+        await persistence.refresh_user_data(1, data)
+        return data
+
+    assert asyncio.run(scenario()) == {'step': 'new'}
+
+
+def test_refresh_loads_changes_from_other_processes(fake_redis):
+    async def scenario():
+        persistence = RedisPersistence()
+        data = {}
+        await persistence.refresh_user_data(1, data)
+        assert data == {}
+
+        # Інший процес записав нові дані
+        fake_redis.hashes['ptb:user_data'] = {'1': json.dumps({'step': 'other'})}
+        await persistence.refresh_user_data(1, data)
+        return data
+
+    assert asyncio.run(scenario()) == {'step': 'other'}
@@ -0,0 +1,85 @@
+import asyncio
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from modules.models import Base, User, ReferralBonus
+from modules.referral_tree import add_to_closure, MissingClosureError
+from modules.referral_bonuses import propagate_bonuses, bonus_for_level
+
+
+async def _register_chain(session, length: int) -> list:
+    """Ланцюжок запрошень: кожен наступний користувач запрошений попереднім"""
+    chain = []
+    referred_by = None
+    for index in range(length):
+        user = User(telegram_id=1000 + index, phone_number=f"+38050000000{index}",
+                    referral_code=f"CODE{index}", referred_by=referred_by)
+        session.add(user)
+        await session.flush()
+        await add_to_closure(session, user.id, referred_by)
+        chain.append(user)
+        referred_by = user.id
+    return chain
+
+
+async def _create_engine():
+    engine = create_async_engine('sqlite+aiosqlite://')
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    return engine
+
+
+async def _propagate(length: int):
+    engine = await _create_engine()
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+    async with session_factory() as session:
+        chain = await _register_chain(session, length)
+        newcomer = chain[-1]
+        payouts = await propagate_bonuses(session, newcomer.id, newcomer.phone_number)
+        await session.commit()
+        balances = dict((await session.execute(select(User.id, User.balance))).all())
+        entries = (await session.scalars(select(ReferralBonus).order_by(ReferralBonus.level))).all()
+    await engine.dispose()
+    return chain, payouts, balances, entries
+
+
+def test_propagate_bonuses_pays_every_ancestor():
+    chain, payouts, balances, entries = asyncio.run(_propagate(4))
+    newcomer_id = chain[-1].id
+
+    assert [payout['level'] for payout in payouts] == [1, 2, 3]
+    assert [payout['telegram_id'] for payout in payouts] == [1002, 1001, 1000]
+    assert balances == {
+        chain[0].id: bonus_for_level(3),
+        chain[1].id: bonus_for_level(2),
+        chain[2].id: bonus_for_level(1),
+        newcomer_id: 0,
+    }
+    assert [(entry.user_id, entry.amount, entry.kind, entry.level, entry.source_user_id) for entry in entries] == [
+        (chain[2].id, bonus_for_level(1), 'referral', 1, newcomer_id),
+        (chain[1].id, bonus_for_level(2), 'referral', 2, newcomer_id),
+        (chain[0].id, bonus_for_level(3), 'referral', 3, newcomer_id),
+    ]
+
+
+async def _register_under_unindexed_referrer():
+    engine = await _create_engine()
+    try:
+        async with async_sessionmaker(engine, expire_on_commit=False)() as session:
+            # Запрошувач без рядків у таблиці замикання (наприклад, до її заповнення)
+            referrer = User(telegram_id=2000, phone_number="+380500000100", referral_code="OLD")
+            session.add(referrer)
+            await session.flush()
+            newcomer = User(telegram_id=2001, phone_number="+380500000101",
+                            referral_code="NEW", referred_by=referrer.id)
+            session.add(newcomer)
+            await session.flush()
+            await add_to_closure(session, newcomer.id, referrer.id)
+    finally:
+        await engine.dispose()
+
+
+def test_add_to_closure_rejects_referrer_without_closure_rows():
+    with pytest.raises(MissingClosureError):
+        asyncio.run(_register_under_unindexed_referrer())
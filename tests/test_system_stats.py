@@ -0,0 +1,32 @@
+import asyncio
+from modules import system_stats
+
+
+def _statistics(monkeypatch, cached: dict) -> tuple:
+    reconciled = []
+    full = {field: 7 for field in system_stats.STATS_FIELDS}
+
+    async def get_system_stats():
+        return cached
+
+    async def reconcile_system_stats():
+        reconciled.append(True)
+        return full
+
+    monkeypatch.setattr(system_stats, 'get_system_stats', get_system_stats)
+    monkeypatch.setattr(system_stats, 'reconcile_system_stats', reconcile_system_stats)
+    return asyncio.run(system_stats.get_system_statistics()), len(reconciled)
+
+
+def test_partial_counters_are_reconciled(monkeypatch):
+    # Хеш, створений першою подією до звірки
+    stats, reconciled = _statistics(monkeypatch, {'total_users': 1})
+    assert reconciled == 1
+    assert stats['active_users'] == 7
+
+
+def test_complete_counters_are_read_without_database(monkeypatch):
+    cached = {field: 1 for field in system_stats.STATS_FIELDS}
+    stats, reconciled = _statistics(monkeypatch, cached)
+    assert reconciled == 0
+    assert stats == cached
@@ -0,0 +1,76 @@
+import asyncio
+import json
+from telegram import Bot, Update
+from telegram.ext import Application, TypeHandler
+from modules import update_bus
+from modules.update_bus import mark_failed_update
+
+
+class FakeStreams:
+    """Мінімальна заміна redis_client: один запис у потоці, підтвердження в пам'яті"""
+
+    def __init__(self, entry_id: str, update: dict, stop_event: asyncio.Event):
+        self.entry = (entry_id, {'update': json.dumps(update)})
+        self.stop_event = stop_event
+        self.reads = 0
+        self.acked = []
+
+    async def xgroup_create(self, *args, **kwargs):
+        pass
+
+    async def xreadgroup(self, group, consumer, streams, count=None, block=None):
+        self.reads += 1
+        if self.reads > 2 or self.acked:
+            self.stop_event.set()
+            return []
+        return [(next(iter(streams)), [self.entry])]
+
+    async def xpending_range(self, *args, **kwargs):
+        return [{'times_delivered': self.reads}]
+
+    async def xack(self, stream, group, entry_id):
+        self.acked.append(entry_id)
+
+
+class OfflineBot(Bot):
+    """Бот без звернень до Telegram при ініціалізації"""
+
+    async def initialize(self):
+        pass
+
+
+def _consume(monkeypatch, callback) -> FakeStreams:
+    async def scenario():
+        application = Application.builder().bot(OfflineBot('123:TEST')).updater(None).build()
+        await application.initialize()
+        application.add_handler(TypeHandler(Update, callback))
+        application.add_error_handler(mark_failed_update)
+        stop_event = asyncio.Event()
+        streams = FakeStreams('1-0', {'update_id': 42}, stop_event)
+        monkeypatch.setattr(update_bus, 'redis_client', streams)
+        await update_bus._consume_partition(application, 0, stop_event)
+        return streams
+
+    return asyncio.run(scenario())
+
+
+def test_update_is_acked_after_successful_handler(monkeypatch):
+    async def handler(update, context):
+        pass
+
+    streams = _consume(monkeypatch, handler)
+    assert streams.acked == ['1-0']
+
+
+def test_update_with_failed_handler_stays_pending(monkeypatch):
+    calls = []
+
+    async def handler(update, context):
+        calls.append(update.update_id)
+        raise RuntimeError("handler failed")
+
+    streams = _consume(monkeypatch, handler)
+    # Запис не підтверджено і його перечитано з PEL для повторної обробки
+    assert streams.acked == []
+    assert calls == [42, 42]
+    assert update_bus._failed_updates == {}
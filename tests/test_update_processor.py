@@ -0,0 +1,43 @@
+import asyncio
+from telegram import Update
+from modules.update_processor import ChatOrderedUpdateProcessor
+
+
+def _message(update_id: int, chat_id: int) -> Update:
+    return Update.de_json({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id, 'date': 0, 'text': 'text',
+            'chat': {'id': chat_id, 'type': 'private'},
+        },
+    }, None)
+
+
+def test_updates_of_one_chat_run_in_order_and_other_chats_in_parallel():
+    async def scenario():
+        processor = ChatOrderedUpdateProcessor(max_concurrent_updates=8)
+        events = []
+        release_first = asyncio.Event()
+
+        async def handle(name: str, wait: asyncio.Event = None):
+            events.append(f"start {name}")
+            if wait:
+                await wait.wait()
+            events.append(f"end {name}")
+
+        first = asyncio.create_task(processor.process_update(_message(1, 100), handle('a1', release_first)))
+        second = asyncio.create_task(processor.process_update(_message(2, 100), handle('a2')))
+        other = asyncio.create_task(processor.process_update(_message(3, 200), handle('b1')))
+        await other
+        assert processor.active_chats == 1
+
+        release_first.set()
+        await asyncio.gather(first, second)
+        return events, processor.active_chats
+
+    events, active_chats = asyncio.run(scenario())
+    # Інший чат не чекає на довгий обробник, а друге оновлення чату - чекає
+    assert events.index('end b1') < events.index('end a1')
+    assert events.index('end a1') < events.index('start a2')
+    # Замки чатів без оновлень видаляються з реєстру
+    assert active_chats == 0